@@ -0,0 +1,346 @@
+"""Admission control: per-client rate limits, concurrency limits per route class, load shedding.
+
+Every request is sorted into a route class before it reaches the app:
+
+    read    GET/HEAD/OPTIONS of the API and the pages (database reads)
+    write   POST/PUT/PATCH/DELETE (database writes, one writer at a time with SQLite)
+    static  /static and /media (files, no database)
+
+and then goes through two gates:
+
+1. Rate limit - a token bucket per client and route class (BLOG_RATE_LIMIT_<CLASS>_PER_SECOND,
+   refilled continuously, up to BLOG_RATE_LIMIT_<CLASS>_BURST). An empty bucket answers
+   429 Too Many Requests, with Retry-After set to when the next token arrives. The buckets are kept
+   in memory (per worker) or in Redis (shared by the workers and machines), see build_rate_limiter.
+2. Concurrency limit - at most BLOG_ADMISSION_<CLASS>_CONCURRENCY requests of a class run at the same
+   time in a worker. The others wait in line, up to BLOG_ADMISSION_QUEUE_TIMEOUT_SECONDS: a request
+   still waiting after that (or arriving when BLOG_ADMISSION_MAX_QUEUE are already waiting) is shed
+   with 503 Service Unavailable and Retry-After. Under a spike, latency stays bounded by the queue
+   budget instead of growing with the backlog, and the clients are told to come back later.
+
+The 429 and 503 responses are rendered by the app's own HTTPException handler (see main.py): JSON
+under /api, the error page elsewhere.
+
+The live feed stream is rate limited but holds no concurrency slot (it never finishes, and has its
+own limit, see live.py). /metrics and /ready are never limited: the monitoring keeps seeing the
+overload, and the load balancer doesn't take a busy worker out of rotation.
+Counters per class (admitted, shed, rate limited, waiting, running) are in /api/admin/admission and
+/metrics.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from fastapi import status
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import Settings, get_settings
+from metrics import Histogram
+from warmup import is_warmup
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+STATIC_PREFIXES = ("/static/", "/media/")
+# Not limited at all (nor are the worker's own warm-up requests, see warmup.py)
+UNLIMITED_PATHS = frozenset({"/metrics", "/ready"})
+# Rate limited, but without a concurrency slot: the response is a stream that stays open
+LONG_LIVED_PATHS = frozenset({"/api/posts/stream"})
+# Seconds
+QUEUE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def route_class(scope: Scope) -> str | None:
+    """The route class of a request, or None if it isn't limited."""
+    path = scope["path"]
+    if path in UNLIMITED_PATHS or is_warmup(scope):
+        return None
+    if path.startswith(STATIC_PREFIXES):
+        return "static"
+    return "read" if scope["method"] in READ_METHODS else "write"
+
+
+def client_id(scope: Scope) -> str:
+    # The address uvicorn reports: behind a trusted proxy, the one from X-Forwarded-For (uvicorn FORWARDED_ALLOW_IPS)
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+# RATE LIMITS ###################################################
+@dataclass(frozen=True)
+class RateLimit:
+    per_second: float  # Tokens added per second (0 = no limit)
+    burst: int  # Bucket size: requests a client may send at once after being idle
+
+
+class RateLimiter:
+    """Token buckets, one per key. Interface shared by the memory and Redis stores."""
+
+    name = "base"
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        """
+        Take a token from the bucket of `key`.
+
+        Returns:
+            0 if the request may go on, else the seconds until the bucket has a token again
+        """
+        raise NotImplementedError
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Buckets in this process. With several workers, a client gets each worker's limit.
+
+    Args:
+        max_keys: Buckets kept, the least recently used are forgotten beyond (a forgotten bucket is a full one)
+    """
+
+    name = "memory"
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, updated at)
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (float(limit.burst), now))
+        tokens = min(float(limit.burst), tokens + (now - updated_at) * limit.per_second)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / limit.per_second
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**super().snapshot(), "clients": len(self._buckets)}
+
+
+# Refill and take in one round trip, atomically. The wait goes back as a string: Redis would
+# truncate a Lua number to an integer.
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "at")
+local tokens = tonumber(bucket[1]) or burst
+local at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "at", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Buckets in Redis, shared by every worker and machine: a client gets the limit once, whoever serves it.
+
+    If Redis can't be reached the request is let through (the limits are a protection, not a
+    requirement of the app), and the failure is logged.
+    """
+
+    name = "redis"
+
+    def __init__(self, client: Any, prefix: str = "blog:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        try:
+            # Wall clock, the same on every machine (unlike time.monotonic)
+            wait = await self._script(keys=[self.prefix + key], args=[limit.per_second, limit.burst, time.time()])
+        except Exception as exc:
+            self.errors += 1
+            logger.warning("Rate limit check failed, letting the request through: %s", exc)
+            return 0.0
+        return float(wait)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**super().snapshot(), "errors": self.errors}
+
+
+def build_rate_limiter(settings: Settings) -> RateLimiter:
+    if settings.rate_limit_backend == "redis":
+        # Optional dependency - only needed when the Redis store is selected (pip install 'fastapi-blog[redis]')
+        import redis.asyncio as redis
+
+        return RedisRateLimiter(redis.from_url(settings.redis_url))
+    return MemoryRateLimiter(settings.rate_limit_max_clients)
+
+
+# CONCURRENCY LIMITS ###################################################
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    shed: int = 0
+    rate_limited: int = 0
+
+
+class ConcurrencyLimiter:
+    """
+    At most `limit` requests running at once (0 = no limit), the others waiting in line (first come, first served).
+
+    Args:
+        max_queue: Requests allowed to wait; beyond, new ones are shed straight away
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.stats = AdmissionStats()
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def acquire(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a slot. False if the request should be shed."""
+        if self._semaphore is None:
+            self.running += 1
+            return True
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue or timeout <= 0:
+                return False
+            start = time.perf_counter()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+                self.queue_wait.observe(time.perf_counter() - start)
+        else:
+            await self._semaphore.acquire()
+            self.queue_wait.observe(0.0)
+        self.running += 1
+        return True
+
+    def release(self) -> None:
+        self.running -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"concurrency": self.limit, "running": self.running, "waiting": self.waiting, **asdict(self.stats)}
+
+
+# MIDDLEWARE ###################################################
+class AdmissionMiddleware:
+    """
+    ASGI middleware that applies the rate limits and concurrency limits, see the module docstring.
+
+    Args:
+        limiters: Concurrency limiter per route class (see build_limiters)
+        rate_limits: Rate limit per route class (missing, or 0 per second: no rate limit)
+        rate_limiter: Where the token buckets are kept (None disables the rate limits)
+        queue_timeout: Seconds a request may wait for a slot before it is shed
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiters: dict[str, ConcurrencyLimiter],
+        rate_limits: dict[str, RateLimit],
+        rate_limiter: RateLimiter | None,
+        queue_timeout: float,
+    ):
+        self.app = app
+        self.limiters = limiters
+        self.rate_limits = rate_limits
+        self.rate_limiter = rate_limiter
+        self.queue_timeout = queue_timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope)
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiters[name]
+
+        limit = self.rate_limits.get(name)
+        if self.rate_limiter is not None and limit is not None and limit.per_second > 0:
+            wait = await self.rate_limiter.take(f"{name}:{client_id(scope)}", limit)
+            if wait > 0:
+                limiter.stats.rate_limited += 1
+                await reject(scope, receive, send, status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests, slow down", wait)
+                return
+
+        if scope["path"] in LONG_LIVED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire(self.queue_timeout):
+            limiter.stats.shed += 1
+            await reject(
+                scope, receive, send, status.HTTP_503_SERVICE_UNAVAILABLE, "The server is busy, please retry shortly", self.queue_timeout
+            )
+            return
+        limiter.stats.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+async def reject(scope: Scope, receive: Receive, send: Send, status_code: int, detail: str, retry_after: float) -> None:
+    """Answer with an HTTPException, rendered by the app's own handler (JSON under /api, the error page elsewhere)."""
+    exception = StarletteHTTPException(status_code, detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+    app = scope.get("app")
+    handler = getattr(app, "exception_handlers", {}).get(StarletteHTTPException)
+    if handler is None:
+        response = PlainTextResponse(detail, status_code, headers=exception.headers)
+    else:
+        # The router isn't in the scope yet (it's set once the request reaches it), the error page needs it for url_for
+        response = await handler(Request({**scope, "router": app.router}), exception)
+    await response(scope, receive, send)
+
+
+def build_limiters(settings: Settings) -> dict[str, ConcurrencyLimiter]:
+    return {
+        "read": ConcurrencyLimiter(settings.admission_read_concurrency, settings.admission_max_queue),
+        "write": ConcurrencyLimiter(settings.admission_write_concurrency, settings.admission_max_queue),
+        "static": ConcurrencyLimiter(settings.admission_static_concurrency, settings.admission_max_queue),
+    }
+
+
+def build_rate_limits(settings: Settings) -> dict[str, RateLimit]:
+    return {
+        "read": RateLimit(settings.rate_limit_read_per_second, settings.rate_limit_read_burst),
+        "write": RateLimit(settings.rate_limit_write_per_second, settings.rate_limit_write_burst),
+        "static": RateLimit(settings.rate_limit_static_per_second, settings.rate_limit_static_burst),
+    }
+
+
+# Shared by the middleware, the admin endpoint and /metrics (per worker, like the metrics)
+limiters = build_limiters(get_settings())
+rate_limiter = build_rate_limiter(get_settings()) if get_settings().rate_limit_enabled else None
+
+
+def snapshot() -> dict[str, Any]:
+    """The counters of every route class, and of the rate limit store (for /api/admin/admission and /metrics)."""
+    return {
+        "classes": {name: limiter.snapshot() for name, limiter in limiters.items()},
+        "rate_limits": rate_limiter.snapshot() if rate_limiter is not None else None,
+    }
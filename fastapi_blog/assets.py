@@ -0,0 +1,187 @@
+"""Cache-friendly static and media file serving.
+
+- Every file in static/ gets a content-hashed URL (css/main.css -> css/main.3f2a9c1d.css),
+  built once at startup. Templates call `asset_url('css/main.css')` to get it.
+- Hashed URLs (and media files, whose names are already unique) are served with a
+  far-future immutable Cache-Control, so browsers never re-validate them.
+- Everything else gets `no-cache`: the browser re-validates with If-None-Match / If-Modified-Since
+  and gets a 304 when nothing changed.
+- Precompressed `.br` / `.gz` variants (created by `python -m assets`) are served to clients that accept them.
+
+Build the compressed variants as part of the deploy:
+    python -m assets
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from compression import choose_encoding
+
+# Get the base directory (where main.py is located)
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+MEDIA_DIR = BASE_DIR / "media"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # 1 year
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Only text formats are worth compressing (images are already compressed)
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".txt", ".html", ".json"}
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class AssetManifest:
+    """Maps the files of a directory to content-hashed names, and back."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.hashed: dict[str, str] = {}  # "css/main.css" -> "css/main.3f2a9c1d.css"
+        self.originals: dict[str, str] = {}  # "css/main.3f2a9c1d.css" -> "css/main.css"
+        self.encodings: dict[str, tuple[str, ...]] = {}  # "css/main.css" -> ("br", "gzip")
+
+    def build(self) -> "AssetManifest":
+        self.hashed.clear()
+        self.originals.clear()
+        self.encodings.clear()
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file() or path.suffix in (".br", ".gz") or path.name.startswith("."):
+                continue
+            relative = path.relative_to(self.directory).as_posix()
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()[:8]
+            hashed = path.with_name(f"{path.stem}.{digest}{path.suffix}").relative_to(self.directory).as_posix()
+            self.hashed[relative] = hashed
+            self.originals[hashed] = relative
+            available = tuple(encoding for encoding, suffix in ENCODINGS if path.with_name(path.name + suffix).is_file())
+            if available:
+                self.encodings[relative] = available
+        return self
+
+    def hashed_path(self, path: str) -> str:
+        # Unknown files keep their plain name (served with revalidation instead of immutable caching)
+        return self.hashed.get(path, path)
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with content-hashed URLs, Cache-Control headers and precompressed variants.
+
+    Args:
+        manifest: Resolves hashed URLs and knows which files have .br/.gz variants
+        immutable: Serve every file as immutable (for directories whose file names are never reused)
+    """
+
+    def __init__(self, *, directory: Path, manifest: AssetManifest | None = None, immutable: bool = False):
+        super().__init__(directory=str(directory))
+        self.manifest = manifest
+        self.immutable = immutable
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        original = self.manifest.originals.get(path) if self.manifest else None
+        response = await super().get_response(original or path, scope)
+        if original is not None or self.immutable:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return response
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        response = self._precompressed_response(str(full_path), request_headers, status_code)
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+            if Path(full_path).suffix in COMPRESSIBLE_SUFFIXES:
+                response.headers["Vary"] = "Accept-Encoding"
+
+        # Handles If-None-Match (ETag) and If-Modified-Since
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _precompressed_response(self, full_path: str, request_headers: Headers, status_code: int) -> FileResponse | None:
+        if self.manifest is None:
+            return None
+        relative = Path(os.path.relpath(full_path, self.directory)).as_posix()
+        built = self.manifest.encodings.get(relative, ())
+        # Honour the q-values (br;q=0 refuses brotli), preferring br over gzip on a tie, like the API responses
+        encoding = choose_encoding(
+            request_headers.get("accept-encoding", ""), tuple(name for name, _ in ENCODINGS if name in built)
+        )
+        if encoding is None:
+            return None
+        compressed_path = full_path + dict(ENCODINGS)[encoding]
+        try:
+            compressed_stat = os.stat(compressed_path)
+        except FileNotFoundError:
+            # Removed after the manifest was built, serve the uncompressed file
+            return None
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        return FileResponse(
+            compressed_path,
+            status_code=status_code,
+            stat_result=compressed_stat,
+            media_type=media_type,
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+        )
+
+
+static_manifest = AssetManifest(STATIC_DIR)
+
+
+@pass_context
+def asset_url(context, path: str):
+    """
+    Template helper returning the content-hashed URL of a static file.
+
+    Example:
+        {{ asset_url('css/main.css') }} -> "/static/css/main.3f2a9c1d.css"
+    """
+    return context["request"].url_for("static", path=static_manifest.hashed_path(path))
+
+
+def compress_static_files(directory: Path = STATIC_DIR) -> list[Path]:
+    """
+    Write .gz (and .br, when a brotli module is installed) variants of the text assets.
+
+    Returns:
+        The paths of the files written
+    """
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            brotli = None
+
+    written = []
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        data = path.read_bytes()
+        gz_path = path.with_name(path.name + ".gz")
+        # mtime=0 keeps the output identical between builds
+        gz_path.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+        written.append(gz_path)
+        if brotli is not None:
+            br_path = path.with_name(path.name + ".br")
+            br_path.write_bytes(brotli.compress(data, quality=11))
+            written.append(br_path)
+    return written
+
+
+if __name__ == "__main__":
+    for compressed in compress_static_files():
+        print(f"wrote {compressed.relative_to(BASE_DIR)}")
+    manifest = AssetManifest(STATIC_DIR).build()
+    for original, hashed in manifest.hashed.items():
+        print(f"{original} -> {hashed}")
@@ -0,0 +1,108 @@
+"""
+Compare two benchmark results files (see results.py) and fail on regressions.
+
+A route or micro-benchmark regresses when, compared to the baseline:
+- its p50 or p95 latency grew by more than --threshold (0.2 = 20%)
+- its requests per second dropped by more than --threshold
+- it runs more SQL queries per request (any increase: query counts don't fluctuate, an extra
+  query per request is a new N+1 or a lost optimization)
+
+p99 and the mean are reported but not checked, a few hundred requests don't pin them down.
+Timings only compare between runs on the same machine with the same parameters.
+
+Run from the project directory:
+    python -m benchmarks.compare baseline.json current.json --threshold 0.2
+
+Exits with status 1 if anything regressed.
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from benchmarks.results import load
+
+# (section, metric, True if higher is worse)
+CHECKED_METRICS = (
+    ("micro", "p50_us", True),
+    ("micro", "p95_us", True),
+    ("routes", "p50_ms", True),
+    ("routes", "p95_ms", True),
+    ("routes", "rps", False),
+)
+
+
+@dataclass
+class Regression:
+    section: str
+    name: str
+    metric: str
+    baseline: float
+    current: float
+
+    def __str__(self) -> str:
+        change = (self.current - self.baseline) / self.baseline * 100 if self.baseline else float("inf")
+        return f"{self.section}: {self.name}: {self.metric} {self.baseline:.2f} -> {self.current:.2f} ({change:+.1f}%)"
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[Regression]:
+    """
+    The regressions of `current` against `baseline`.
+
+    Benchmarks missing from either side are skipped (added or removed since the baseline).
+    """
+    regressions = []
+    for section, metric, higher_is_worse in CHECKED_METRICS:
+        for name, values in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name, {}).get(metric)
+            after = values.get(metric)
+            if before is None or after is None:
+                continue
+            if higher_is_worse and after > before * (1 + threshold):
+                regressions.append(Regression(section, name, metric, before, after))
+            elif not higher_is_worse and after < before / (1 + threshold):
+                regressions.append(Regression(section, name, metric, before, after))
+
+    for name, values in current.get("routes", {}).items():
+        before = baseline.get("routes", {}).get(name, {}).get("queries_per_request")
+        after = values.get("queries_per_request")
+        # Rounded: write scenarios average over requests that may take slightly different paths
+        if before is not None and after is not None and round(after, 1) > round(before, 1):
+            regressions.append(Regression("routes", name, "queries_per_request", before, after))
+    return regressions
+
+
+def report(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> bool:
+    """Print the comparison. Returns True if there is no regression."""
+    for label, results in (("baseline", baseline), ("current", current)):
+        env = results.get("environment", {})
+        print(f"{label:<9} {env.get('git_commit')}{' (dirty)' if env.get('git_dirty') else ''}  {env.get('created_at')}  {env.get('platform')}")
+    if baseline.get("parameters") != current.get("parameters"):
+        print("warning: the runs used different parameters, the numbers may not be comparable")
+    if baseline.get("environment", {}).get("cpu_count") != current.get("environment", {}).get("cpu_count"):
+        print("warning: the runs were measured on different machines")
+
+    regressions = compare(baseline, current, threshold)
+    if not regressions:
+        print(f"no regression (threshold {threshold:.0%})")
+        return True
+    print(f"{len(regressions)} regression(s) (threshold {threshold:.0%}):")
+    for regression in regressions:
+        print(f"  {regression}")
+    return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown, as a fraction (default: 0.2)")
+    args = parser.parse_args()
+    if not report(load(args.baseline), load(args.current), args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Data generator: a throwaway SQLite database, migrated and seeded with N users and M posts.
+
+The data only depends on --seed (titles, content lengths, authors, dates), so two runs of the
+suite measure the same rows. Like a real blog:
+- post lengths vary from a couple of sentences to long articles
+- a few prolific authors write most of the posts
+- dates are spread over the last --days days, in id order
+The search index and user_stats are filled the way the app fills them.
+
+The app reads BLOG_DATABASE_URL when it is imported: set it (see use_database) before importing
+anything from the app, as the suite does.
+
+Run from the project directory:
+    python -m benchmarks.data --users 100 --posts 5000 --database /tmp/bench.db
+"""
+
+import argparse
+import asyncio
+import os
+import random
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+WORDS = (
+    "async await fastapi python database query index cursor cache latency throughput request response "
+    "template render worker process thread event loop socket pool connection transaction commit rollback "
+    "migration schema column table row join select update insert delete replica primary shard queue job "
+    "retry backoff timeout signal drain compression header etag version stream batch bulk export import"
+).split()
+
+
+def use_database(path: Path) -> str:
+    """Point the app at the database file `path` (before the app is imported). Returns the URL."""
+    database_url = f"sqlite+aiosqlite:///{path}"
+    os.environ["BLOG_DATABASE_URL"] = database_url
+    return database_url
+
+
+def sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(6, 16))
+    return " ".join(words).capitalize() + "."
+
+
+def post_content(rng: random.Random) -> str:
+    # Mostly short posts, a long tail of articles (a few thousand characters)
+    paragraphs = min(int(rng.expovariate(1 / 3)) + 1, 20)
+    return "\n\n".join(" ".join(sentence(rng) for _ in range(rng.randint(2, 6))) for _ in range(paragraphs))
+
+
+async def seed(users: int, posts: int, seed: int = 0, days: int = 365, batch_size: int = 1000) -> None:
+    """Migrate the database the app points to, then insert the users and posts."""
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import insert
+
+    import models.models as models
+    import rendering
+    import search
+    import user_stats
+    from database import AsyncSessionLocal, BASE_DIR, engine
+
+    # Alembic runs its own event loop (migrations/env.py), so not from this one
+    await asyncio.to_thread(command.upgrade, Config(str(BASE_DIR / "alembic.ini")), "head")
+
+    rng = random.Random(seed)
+    now = datetime.now(UTC).replace(microsecond=0)
+    # Zipf-like authorship: user 1 writes the most, the last ones a post or two
+    author_weights = [1 / rank for rank in range(1, users + 1)]
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            insert(models.User),
+            [{"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "updated_at": now} for i in range(1, users + 1)],
+        )
+        for start in range(1, posts + 1, batch_size):
+            rows = []
+            for post_id in range(start, min(start + batch_size, posts + 1)):
+                date_posted = now - timedelta(days=days) * (1 - post_id / posts)
+                content = post_content(rng)
+                rows.append({
+                    "id": post_id,
+                    "title": sentence(rng)[:100],
+                    "content": content,
+                    **rendering.rendered_columns(content),
+                    "user_id": rng.choices(range(1, users + 1), weights=author_weights)[0],
+                    "date_posted": date_posted,
+                    "updated_at": date_posted,
+                })
+            await db.execute(insert(models.Post), rows)
+            await search.index_new_posts(db, [SimpleNamespace(**row) for row in rows])
+            await db.commit()
+        await user_stats.rebuild_user_stats(db)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", type=Path, required=True, help="SQLite file to create (must not exist)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=365, help="Posts are spread over this many days")
+    args = parser.parse_args()
+
+    if args.database.exists():
+        parser.error(f"{args.database} already exists")
+    use_database(args.database.resolve())
+    asyncio.run(seed(args.users, args.posts, args.seed, args.days))
+    print(f"seeded {args.users} users and {args.posts} posts into {args.database}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Load test: read throughput while other tasks keep writing.
+
+Compares the old engine setup (default rollback journal, no pragmas, default pool)
+with the engine built from settings by `database.build_engine` (WAL + tuned pragmas).
+
+Run from the project directory:
+    python -m benchmarks.db_engine_load --readers 20 --writers 4 --seconds 10
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+import models.models as models
+from config import Settings
+from database import Base, build_engine
+
+
+async def seed(engine: AsyncEngine, users: int, posts: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        session.add_all(models.User(username=f"user{i}", email=f"user{i}@example.com") for i in range(users))
+        await session.flush()
+        session.add_all(
+            models.Post(title=f"Post {i}", content="Lorem ipsum dolor sit amet. " * 20, user_id=(i % users) + 1)
+            for i in range(posts)
+        )
+        await session.commit()
+
+
+async def run_load(engine: AsyncEngine, readers: int, writers: int, seconds: float) -> dict:
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    counters = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+
+    async def reader():
+        while time.perf_counter() < deadline:
+            try:
+                async with session_factory() as session:
+                    # Same shape as a page of the feed
+                    result = await session.execute(
+                        select(models.Post).order_by(models.Post.date_posted.desc(), models.Post.id.desc()).limit(20)
+                    )
+                    result.scalars().all()
+                counters["reads"] += 1
+            except Exception:
+                counters["errors"] += 1
+
+    async def writer(n: int):
+        while time.perf_counter() < deadline:
+            try:
+                async with session_factory() as session:
+                    session.add(models.Post(title=f"Load {n}", content="Written during the load test.", user_id=1))
+                    await session.commit()
+                counters["writes"] += 1
+            except Exception:
+                counters["errors"] += 1
+
+    await asyncio.gather(*(reader() for _ in range(readers)), *(writer(n) for n in range(writers)))
+
+    async with session_factory() as session:
+        total_posts = await session.scalar(select(func.count()).select_from(models.Post))
+
+    return {
+        "reads_per_sec": round(counters["reads"] / seconds, 1),
+        "writes_per_sec": round(counters["writes"] / seconds, 1),
+        "errors": counters["errors"],
+        "posts_in_table": total_posts,
+    }
+
+
+async def benchmark(profile: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{Path(tmp) / 'load.db'}"
+        if profile == "before":
+            # What database.py used to do: default journal, no pragmas, default pool
+            engine = create_async_engine(url, connect_args={"check_same_thread": False})
+        else:
+            engine = build_engine(Settings(database_url=url, db_pool_size=args.readers + args.writers))
+        try:
+            await seed(engine, users=10, posts=args.posts)
+            return await run_load(engine, args.readers, args.writers, args.seconds)
+        finally:
+            await engine.dispose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--posts", type=int, default=5000, help="Posts seeded before the run")
+    args = parser.parse_args()
+
+    for profile in ("before", "after"):
+        result = await benchmark(profile, args)
+        print(f"{profile:>6}: " + "  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
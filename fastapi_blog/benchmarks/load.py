@@ -0,0 +1,287 @@
+"""
+In-process load test of every route: p50/p95/p99 latency, requests per second, SQL queries per request.
+
+Each scenario sends --requests requests to one route, --concurrency at a time, through
+httpx.ASGITransport: the whole app (middlewares, dependencies, database, templates) runs, but
+there is no server process and no network, so the numbers move with the code and not with
+the machine's TCP stack. The query count of every request comes from the Server-Timing header
+(see metrics.py).
+
+Reads run first, against the seeded data. The writes follow (sign-ups, new posts, edits, bulk
+imports) and the deletes come last, on the newest seeded posts.
+
+Routes of the app with no scenario are listed at the end, so a new route doesn't go unmeasured.
+
+Run from the project directory (seeds a throwaway database first):
+    python -m benchmarks.load --posts 2000 --requests 200 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.data import seed, use_database
+from benchmarks.results import percentiles
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+# Routes deliberately left out, with the reason
+NOT_MEASURED = {
+    "POST /api/users/{user_id}/profile-picture": "writes images into media/ of the project",
+    "POST /api/admin/jobs/{job_id}/retry": "needs failed jobs",
+    "GET /api/posts/stream": "a live feed stream never ends",
+}
+
+
+@dataclass
+class Scenario:
+    route: str  # "GET /api/posts/{post_id}", as listed by app_routes()
+    build: Callable[[int], dict[str, Any]]  # request number -> arguments of client.request (url, json, ...)
+    label: str = ""  # Tells apart scenarios of the same route
+    expected_status: int = 200
+
+    @property
+    def name(self) -> str:
+        return f"{self.route} {self.label}".strip()
+
+
+@dataclass
+class SeededPosts:
+    cursors: dict[int, str]  # post id -> "older than this post" feed cursor, for the deep page scenarios
+    authors: dict[int, int]  # post id -> user id, edits are only allowed to the author
+
+
+def scenarios(users: int, posts: int, requests: int, seeded: SeededPosts) -> list[Scenario]:
+    """
+    The scenarios, in the order they run.
+
+    Args:
+        requests: Requests per scenario, warm-up included (request numbers go from 0 to requests - 1)
+        seeded: What the requests need to know about the seeded posts (see seeded_posts)
+    """
+
+    def post_id(i: int) -> int:
+        # Spread over the seeded posts, so the reads don't all hit the same rows
+        return (i * 7919) % posts + 1
+
+    def user_id(i: int) -> int:
+        return (i * 31) % users + 1
+
+    def bulk(lines: list[dict]) -> dict[str, Any]:
+        return {"content": "\n".join(json.dumps(line) for line in lines).encode(), "headers": {"Content-Type": "application/x-ndjson"}}
+
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 10
+    if requests > posts // 2:
+        raise ValueError(f"{requests} requests per scenario need at least {requests * 2} posts: the deletes need posts of their own")
+
+    return [
+        # READS - API
+        Scenario("GET /api/posts", lambda i: {"url": "/api/posts?limit=20"}, "first page"),
+        Scenario("GET /api/posts", lambda i: {"url": f"/api/posts?limit=20&cursor={seeded.cursors[post_id(i)]}"}, "deep page"),
+        Scenario("GET /api/posts", lambda i: {"url": "/api/posts?limit=50&fields=id,title,author&excerpt=100"}, "fields+excerpt"),
+        Scenario("GET /api/posts/{post_id}", lambda i: {"url": f"/api/posts/{post_id(i)}"}),
+        Scenario("GET /api/posts/{user_id}/posts", lambda i: {"url": f"/api/posts/{user_id(i)}/posts"}),
+        Scenario("GET /api/posts/search", lambda i: {"url": "/api/posts/search?q=database+query"}),
+        Scenario("GET /api/posts/export", lambda i: {"url": "/api/posts/export"}),
+        Scenario("GET /api/users/{user_id}", lambda i: {"url": f"/api/users/{user_id(i)}"}),
+        Scenario("GET /api/admin/cache", lambda i: {"url": "/api/admin/cache"}),
+        Scenario("GET /api/admin/replicas", lambda i: {"url": "/api/admin/replicas"}),
+        Scenario("GET /api/admin/jobs", lambda i: {"url": "/api/admin/jobs"}),
+        Scenario("GET /api/admin/live", lambda i: {"url": "/api/admin/live"}),
+        Scenario("GET /api/admin/media", lambda i: {"url": "/api/admin/media"}),
+        Scenario("GET /api/admin/admission", lambda i: {"url": "/api/admin/admission"}),
+        Scenario("GET /metrics", lambda i: {"url": "/metrics"}),
+        Scenario("GET /ready", lambda i: {"url": "/ready"}),
+        # READS - HTML
+        Scenario("GET /", lambda i: {"url": "/"}),
+        Scenario("GET /", lambda i: {"url": "/?q=cache+latency"}, "search"),
+        Scenario("GET /posts", lambda i: {"url": f"/posts?cursor={seeded.cursors[post_id(i)]}"}, "deep page"),
+        Scenario("GET /posts/{post_id}", lambda i: {"url": f"/posts/{post_id(i)}"}),
+        Scenario("GET /users/{user_id}/posts", lambda i: {"url": f"/users/{user_id(i)}/posts"}),
+        # WRITES
+        Scenario(
+            "POST /api/users",
+            lambda i: {"url": "/api/users", "json": {"username": f"load{i}", "email": f"load{i}@example.com"}},
+            expected_status=201,
+        ),
+        Scenario("PATCH /api/users/{user_id}", lambda i: {"url": f"/api/users/{user_id(i)}", "json": {"email": f"patched{i}@example.com"}}),
+        Scenario(
+            "POST /api/posts",
+            lambda i: {"url": "/api/posts", "json": {"title": f"Load test {i}", "content": text, "user_id": user_id(i)}},
+            expected_status=201,
+        ),
+        Scenario(
+            "PUT /api/posts/{post_id}",
+            lambda i: {"url": f"/api/posts/{post_id(i)}", "json": {"title": f"Edited {i}", "content": text, "user_id": seeded.authors[post_id(i)]}},
+        ),
+        Scenario("PATCH /api/posts/{post_id}", lambda i: {"url": f"/api/posts/{post_id(i)}", "json": {"title": f"Patched {i}"}}),
+        Scenario(
+            "POST /api/users/bulk",
+            lambda i: {"url": "/api/users/bulk", **bulk([{"username": f"bulk{i}-{n}", "email": f"bulk{i}-{n}@example.com"} for n in range(50)])},
+            "50 lines",
+        ),
+        Scenario(
+            "POST /api/posts/bulk",
+            lambda i: {"url": "/api/posts/bulk", **bulk([{"title": f"Bulk {i}-{n}", "content": text, "user_id": user_id(n)} for n in range(50)])},
+            "50 lines",
+        ),
+        # Newest seeded posts first, one per request (the reads above used the whole range, they're done)
+        Scenario("DELETE /api/posts/{post_id}", lambda i: {"url": f"/api/posts/{posts - i}"}, expected_status=204),
+    ]
+
+
+async def seeded_posts() -> SeededPosts:
+    from sqlalchemy import select
+
+    import models.models as models
+    from database import AsyncSessionLocal
+    from pagination import encode_cursor
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(models.Post.id, models.Post.date_posted, models.Post.user_id))).all()
+    return SeededPosts({row.id: encode_cursor(row, "older") for row in rows}, {row.id: row.user_id for row in rows})
+
+
+def app_routes() -> set[str]:
+    """'METHOD /path' of every route of the app (the docs and static mounts excluded)."""
+    from fastapi.routing import APIRoute
+    from starlette.routing import Route
+
+    from main import app
+
+    routes = set()
+    for route in app.routes:
+        if not isinstance(route, (APIRoute, Route)) or route.path.startswith(("/docs", "/redoc", "/openapi")):
+            continue
+        for method in route.methods or ():
+            if method != "HEAD":
+                routes.add(f"{method} {route.path}")
+    return routes
+
+
+async def run_scenario(client: Any, scenario: Scenario, requests: int, concurrency: int, warmup: int) -> dict[str, float]:
+    timings: list[float] = []
+    queries: list[int] = []
+    errors = 0
+
+    async def send(i: int, measured: bool) -> None:
+        nonlocal errors
+        arguments = scenario.build(i)
+        method = scenario.route.split(" ", 1)[0]
+        start = time.perf_counter()
+        response = await client.request(method, **arguments)
+        await response.aread()
+        elapsed = time.perf_counter() - start
+        if not measured:
+            return
+        if response.status_code != scenario.expected_status:
+            errors += 1
+        timings.append(elapsed * 1000)
+        match = QUERIES.search(response.headers.get("server-timing", ""))
+        if match:
+            queries.append(int(match.group(1)))
+
+    for i in range(warmup):
+        await send(i, measured=False)
+
+    next_request = warmup
+    total = warmup + requests
+
+    async def worker() -> None:
+        nonlocal next_request
+        while next_request < total:
+            i = next_request
+            next_request += 1
+            await send(i, measured=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    cuts = percentiles(timings)
+    return {
+        "p50_ms": cuts["p50"],
+        "p95_ms": cuts["p95"],
+        "p99_ms": cuts["p99"],
+        "rps": requests / wall,
+        "queries_per_request": sum(queries) / len(queries) if queries else 0.0,
+        "requests": requests,
+        "errors": errors,
+    }
+
+
+async def run(users: int, posts: int, requests: int, concurrency: int, warmup: int, only: str | None = None) -> dict[str, dict[str, float]]:
+    """
+    Run the scenarios against the database the app points to (already seeded).
+
+    Args:
+        only: Run only the scenarios whose name contains this text
+    """
+    import httpx
+
+    from main import app
+
+    seeded = await seeded_posts()
+    selected = [scenario for scenario in scenarios(users, posts, warmup + requests, seeded) if not only or only in scenario.name]
+    results = {}
+    # Unhandled errors become 500 responses (as behind a real server) instead of stopping the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    # ASGITransport doesn't send lifespan events: run the startup and shutdown of the app here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for scenario in selected:
+                results[scenario.name] = await run_scenario(client, scenario, requests, concurrency, warmup)
+    return results
+
+
+def unmeasured_routes() -> set[str]:
+    measured = {scenario.route for scenario in scenarios(users=1, posts=2, requests=1, seeded=SeededPosts({}, {}))}
+    return app_routes() - measured - set(NOT_MEASURED)
+
+
+def print_results(results: dict[str, dict[str, float]]) -> None:
+    width = max(len(name) for name in results)
+    print(f"{'route':<{width}}  {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'errors':>7}")
+    for name, values in results.items():
+        print(
+            f"{name:<{width}}  {values['p50_ms']:8.2f} {values['p95_ms']:8.2f} {values['p99_ms']:8.2f}"
+            f" {values['rps']:8.1f} {values['queries_per_request']:8.1f} {values['errors']:7d}"
+        )
+    for route, reason in sorted(NOT_MEASURED.items()):
+        print(f"not measured: {route} ({reason})")
+    for route in sorted(unmeasured_routes()):
+        print(f"warning: no scenario for {route}, add one to benchmarks/load.py")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="Requests sent before measuring, per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--only", help="Only the scenarios whose name contains this text, e.g. 'GET /api/posts'")
+    parser.add_argument("--cache", action="store_true", help="Keep the response and fragment caches enabled")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(Path(tmp) / "load.db")
+        if not args.cache:
+            # Every request does the full work: database, ORM, rendering, serialization
+            os.environ["BLOG_CACHE_BACKEND"] = "none"
+            os.environ["BLOG_FRAGMENT_CACHE_MAX_BYTES"] = "0"
+        # Every request comes from the same client: the per-client rate limits would turn most of them away
+        os.environ["BLOG_RATE_LIMIT_ENABLED"] = "false"
+        asyncio.run(seed(args.users, args.posts))
+        print_results(asyncio.run(run(args.users, args.posts, args.requests, args.concurrency, args.warmup, args.only)))
+
+
+if __name__ == "__main__":
+    main()
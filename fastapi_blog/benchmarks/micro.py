@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks: post serialization and template rendering, without HTTP or the database.
+
+The inputs (a feed page of ORM posts with their authors, the same page as lean rows) are loaded
+once from the seeded database, then each benchmark runs the same call --repeat times:
+
+- PostResponse: what the ORM endpoints do, model_validate + model_dump_json per post
+- lean page: what GET /api/posts does, row dicts through the TypedDict serializer (see projections.py)
+- templates: home.html, post.html and user_posts.html rendered through Jinja, with the fragment
+  cache off (every post card rendered) and warm (cards from the {% cache %} blocks)
+
+Run from the project directory (seeds a throwaway database first):
+    python -m benchmarks.micro --posts 2000 --repeat 500
+"""
+
+import argparse
+import asyncio
+import gc
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.data import seed, use_database
+from benchmarks.results import percentiles
+
+
+def bench(function: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """Time `repeat` calls of `function` (after a few warm-up calls). Microseconds per call."""
+    for _ in range(min(10, repeat)):
+        function()
+    timings = []
+    # The collector would charge a random call with the whole pause
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    finally:
+        gc.enable()
+    cuts = percentiles(timings)
+    return {"mean_us": sum(timings) / len(timings), "p50_us": cuts["p50"], "p95_us": cuts["p95"], "p99_us": cuts["p99"]}
+
+
+async def load_inputs(page_size: int) -> dict[str, Any]:
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    import models.models as models
+    from database import AsyncSessionLocal, engine
+    from pagination import paginate_posts
+    from projections import POST_FIELDS, select_post_rows
+
+    async with AsyncSessionLocal() as db:
+        posts = (
+            await db.execute(paginate_posts(select(models.Post).options(selectinload(models.Post.author)), None, page_size))
+        ).scalars().all()[:page_size]
+        rows = (await db.execute(paginate_posts(select_post_rows(POST_FIELDS, None), None, page_size))).all()[:page_size]
+        author = (await db.execute(select(models.User).where(models.User.id == posts[0].user_id))).scalar_one()
+        # Loaded now: the session is gone by the time the templates read post.author
+        author_posts_stmt = select(models.Post).options(selectinload(models.Post.author)).where(models.Post.user_id == author.id)
+        author_posts = (await db.execute(paginate_posts(author_posts_stmt, None, page_size))).scalars().all()[:page_size]
+    # Connections belong to this event loop, the load test runs in another one
+    await engine.dispose()
+    return {"posts": posts, "rows": rows, "author": author, "author_posts": author_posts}
+
+
+def fake_request(path: str) -> Any:
+    """A Request the templates can call url_for() on, without an HTTP round trip."""
+    from starlette.requests import Request
+
+    from main import app
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("bench", 80),
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "app": app,
+        "router": app.router,
+    }
+    return Request(scope)
+
+
+def run(repeat: int, page_size: int = 20) -> dict[str, dict[str, float]]:
+    """Run every micro-benchmark against the database the app points to (already seeded)."""
+    import models.schemas as schemas
+    from main import templates
+    from projections import POST_FIELDS, post_page_serializer, row_to_item
+    from render_cache import FragmentCache
+
+    inputs = asyncio.run(load_inputs(page_size))
+    posts, rows, author, author_posts = inputs["posts"], inputs["rows"], inputs["author"], inputs["author_posts"]
+
+    def orm_serialization() -> None:
+        for post in posts:
+            schemas.PostResponse.model_validate(post).model_dump_json()
+
+    def lean_serialization() -> None:
+        post_page_serializer.dump_json(
+            {"items": [row_to_item(row, POST_FIELDS) for row in rows], "next_cursor": None, "prev_cursor": None, "next": None, "prev": None}
+        )
+
+    home = templates.get_template("home.html")
+    post_page = templates.get_template("post.html")
+    user_posts = templates.get_template("user_posts.html")
+    home_context = {"request": fake_request("/"), "posts": posts, "title": "Home", "older_url": None, "newer_url": None}
+    post_context = {"request": fake_request(f"/posts/{posts[0].id}"), "post": posts[0], "title": posts[0].title[:50]}
+    user_posts_context = {
+        "request": fake_request(f"/users/{author.id}/posts"),
+        "posts": author_posts,
+        "user": author,
+        "stats": author.stats,
+        "title": f"{author.username}'s Posts",
+        "older_url": None,
+        "newer_url": None,
+    }
+
+    results = {
+        f"PostResponse x{len(posts)} (ORM, model_validate)": bench(orm_serialization, repeat),
+        f"lean post page x{len(rows)} (TypedDict serializer)": bench(lean_serialization, repeat),
+    }
+    saved_fragment_cache = templates.env.fragment_cache
+    try:
+        for label, fragment_cache in (("no fragment cache", None), ("warm fragments", FragmentCache(16 * 1024 * 1024))):
+            templates.env.fragment_cache = fragment_cache
+            results[f"render home.html x{len(posts)} ({label})"] = bench(lambda: home.render(home_context), repeat)
+            results[f"render post.html ({label})"] = bench(lambda: post_page.render(post_context), repeat)
+            results[f"render user_posts.html x{len(author_posts)} ({label})"] = bench(lambda: user_posts.render(user_posts_context), repeat)
+    finally:
+        templates.env.fragment_cache = saved_fragment_cache
+    return results
+
+
+def print_results(results: dict[str, dict[str, float]]) -> None:
+    width = max(len(name) for name in results)
+    print(f"{'micro-benchmark':<{width}}  {'p50 us':>10} {'p95 us':>10} {'mean us':>10}")
+    for name, values in results.items():
+        print(f"{name:<{width}}  {values['p50_us']:10.1f} {values['p95_us']:10.1f} {values['mean_us']:10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(Path(tmp) / "micro.db")
+        asyncio.run(seed(args.users, args.posts))
+        print_results(run(args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: time to serve a page listing --posts posts (default 50), with and without the HTML caches.
+
+Uses the first page of /users/{id}/posts against a throwaway SQLite database, in-process through
+the ASGI test client. The HTML pages show DEFAULT_PAGE_SIZE posts each; the benchmark raises the
+page size of the app to --posts, so the page renders a card for every post of the user:
+
+- no cache: the template and every post card are rendered on each request
+- fragments: post cards come from the {% cache %} fragment cache, the page around them is rendered
+- page cache: the whole page comes from the response cache
+- 304: the client already has the page (If-None-Match), no body is sent
+
+Run from the project directory:
+    python -m benchmarks.render_cache --posts 50 --requests 300
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+
+def measure(client, url: str, requests: int, headers: dict | None = None) -> float:
+    client.get(url, headers=headers)  # warm up (fills whatever cache is enabled)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app modules are imported (the engine is built at import time)
+        os.environ["BLOG_DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(tmp) / 'render.db'}"
+        # All the requests come from one client, they must not be rate limited (see admission.py)
+        os.environ["BLOG_RATE_LIMIT_ENABLED"] = "false"
+
+        from alembic import command
+        from alembic.config import Config
+        from fastapi.testclient import TestClient
+
+        import cache as cache_module
+        import main as app_module
+        from database import BASE_DIR
+        from main import app, templates
+        from render_cache import fragment_cache
+
+        command.upgrade(Config(str(BASE_DIR / "alembic.ini")), "head")
+        # One page holds all the posts (the pages read DEFAULT_PAGE_SIZE from main.py at request time)
+        app_module.DEFAULT_PAGE_SIZE = args.posts
+
+        with TestClient(app) as client:
+            user = client.post("/api/users", json={"username": "bench", "email": "bench@example.com"}).json()
+            for i in range(args.posts):
+                client.post(
+                    "/api/posts",
+                    json={"title": f"Benchmark post {i}", "content": "Lorem ipsum dolor sit amet. " * 40, "user_id": user["id"]},
+                )
+            url = f"/users/{user['id']}/posts"
+
+            no_response_cache = cache_module.NullCache(ttl_seconds=0)
+            app.dependency_overrides[cache_module.get_cache] = lambda: no_response_cache
+
+            templates.env.fragment_cache = None
+            no_cache_ms = measure(client, url, args.requests)
+
+            templates.env.fragment_cache = fragment_cache
+            fragments_ms = measure(client, url, args.requests)
+
+            app.dependency_overrides.clear()
+            page_ms = measure(client, url, args.requests)
+            etag = client.get(url).headers["etag"]
+            not_modified_ms = measure(client, url, args.requests, headers={"If-None-Match": etag})
+
+    print(f"{args.posts}-post page, median of {args.requests} requests")
+    for label, value in (
+        ("no cache", no_cache_ms),
+        ("fragments", fragments_ms),
+        ("page cache", page_ms),
+        ("304", not_modified_ms),
+    ):
+        print(f"  {label:<11} {value:7.2f} ms  ({no_cache_ms / value:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
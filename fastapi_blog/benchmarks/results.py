@@ -0,0 +1,65 @@
+"""
+Benchmark results as JSON, so runs can be kept and compared (see compare.py).
+
+A results file looks like:
+
+    {
+      "environment": {"created_at": "...", "git_commit": "d5cbd79", "python": "3.13.1", "cpu_count": 8, ...},
+      "parameters": {"users": 50, "posts": 2000, "requests": 200, "concurrency": 8, ...},
+      "micro": {"PostResponse x20": {"mean_us": 812.4, "p50_us": 790.1, "p95_us": 901.7, "p99_us": 1050.2}, ...},
+      "routes": {"GET /api/posts": {"p50_ms": 3.1, "p95_ms": 4.9, "p99_ms": 6.2, "rps": 290.5,
+                                    "queries_per_request": 1.0, "requests": 200, "errors": 0}, ...}
+    }
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """p50, p95 and p99 of the samples (interpolated, like numpy's default)."""
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def environment() -> dict[str, Any]:
+    """What the numbers were measured on: compare runs from the same machine only."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR, capture_output=True, text=True).stdout
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "created_at": datetime.now(UTC).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "python": platform.python_version(),
+        "implementation": sys.implementation.name,
+        "platform": platform.platform(),
+        "cpu_count": os.process_cpu_count(),
+    }
+
+
+def save(results: dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2) + "\n")
+
+
+def load(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text())
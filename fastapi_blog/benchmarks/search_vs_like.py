@@ -0,0 +1,94 @@
+"""
+Benchmark: FTS5 search (what GET /api/posts/search runs) vs a LIKE '%term%' scan.
+
+Seeds a throwaway SQLite database with synthetic posts (1M by default), builds the
+same FTS5 table as migration 0004, then times both queries for a few terms.
+
+Run from the project directory:
+    python -m benchmarks.search_vs_like --posts 1000000
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from search import _fts5_query
+
+WORDS = (
+    "fastapi python async await database index query cache server client request response "
+    "template render stream worker thread process memory latency throughput benchmark sqlite "
+    "postgres migration schema column table cursor page search token ranking snippet"
+).split()
+# Each rare word appears in only a few posts (a selective query), the WORDS are in almost every post (a broad one)
+RARE_WORDS = ["zeppelin", "quokka", "marzipan"]
+
+
+def seed(conn: sqlite3.Connection, posts: int, rare_hits: int, seed_value: int) -> None:
+    rng = random.Random(seed_value)
+    rare_posts = {post_id: word for word in RARE_WORDS for post_id in rng.sample(range(1, posts + 1), rare_hits)}
+    conn.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, title VARCHAR(100) NOT NULL, content TEXT NOT NULL)")
+    conn.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(title, content, tokenize = 'porter unicode61')")
+
+    def rows():
+        for i in range(1, posts + 1):
+            words = rng.choices(WORDS, k=60)
+            if i in rare_posts:
+                words[rng.randrange(len(words))] = rare_posts[i]
+            yield i, " ".join(rng.choices(WORDS, k=6)).title(), " ".join(words)
+
+    batch = []
+    for row in rows():
+        batch.append(row)
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO posts VALUES (?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO posts VALUES (?, ?, ?)", batch)
+    conn.execute("INSERT INTO posts_fts (rowid, title, content) SELECT id, title, content FROM posts")
+    conn.commit()
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> tuple[float, int]:
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(conn.execute(sql, params).fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20, help="Page size, as in the API")
+    parser.add_argument("--rare-hits", type=int, default=25, help="Posts containing each rare word")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(Path(tmp) / "search.db")
+        start = time.perf_counter()
+        seed(conn, args.posts, args.rare_hits, args.seed)
+        print(f"seeded {args.posts:,} posts in {time.perf_counter() - start:.1f}s")
+
+        fts_sql = (
+            "SELECT id, score FROM (SELECT rowid AS id, bm25(posts_fts, 10.0, 1.0) AS score "
+            "FROM posts_fts WHERE posts_fts MATCH ?) ORDER BY score, id LIMIT ?"
+        )
+        like_sql = "SELECT id FROM posts WHERE title LIKE ? OR content LIKE ? ORDER BY id DESC LIMIT ?"
+
+        print(f"{'term':<12} {'fts ms':>10} {'like ms':>10} {'speedup':>9}")
+        for term in [*RARE_WORDS, "latency"]:
+            fts_ms, _ = timed(conn, fts_sql, (_fts5_query(term), args.limit), args.repeat)
+            like_ms, _ = timed(conn, like_sql, (f"%{term}%", f"%{term}%", args.limit), args.repeat)
+            print(f"{term:<12} {fts_ms:>10.2f} {like_ms:>10.2f} {like_ms / fts_ms:>8.1f}x")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Startup benchmark: how long a worker takes to import, to become ready, and to answer its first requests.
+
+On a throwaway seeded database, for each configuration below, --runs times:
+
+- start `python -m serve` (one worker) and poll GET /ready: time-to-ready is from the process
+  start to the first 200
+- then GET each of FIRST_REQUESTS twice: the first request pays for whatever startup left undone
+  (compiling templates, opening connections, filling caches), the second is the steady state
+
+Configurations:
+
+    cold            BLOG_WARMUP_ENABLED=false, empty template bytecode cache (the old behaviour)
+    warm-up         warm-up on, empty template bytecode cache (a first deploy)
+    warm-up+cache   warm-up on, template bytecode cache left by a previous start (a restart)
+
+plus the time to `import main` in a fresh interpreter. Medians over the runs.
+
+Run from the project directory:
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.results import environment, save
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+FIRST_REQUESTS = ("/", "/posts/1", "/users/1/posts", "/api/posts", "/api/posts/1")
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+def import_seconds(env: dict[str, str]) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=PROJECT_DIR, env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def start_worker(env: dict[str, str], port: int, timeout: float = 60.0) -> dict[str, float]:
+    """Start a worker, wait until it is ready and send the first requests. Milliseconds."""
+    import httpx
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "serve", "--workers", "1", "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_DIR,
+        env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("the worker did not become ready")
+                try:
+                    if client.get("/ready").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            timings = {"ready_ms": (time.perf_counter() - start) * 1000}
+            for attempt in ("first", "second"):
+                for path in FIRST_REQUESTS:
+                    request_start = time.perf_counter()
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"GET {path} answered {response.status_code}")
+                    timings[f"{attempt} {path}"] = (time.perf_counter() - request_start) * 1000
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    return timings
+
+
+def run_configuration(name: str, env: dict[str, str], runs: int, port: int, fresh_template_cache: bool, tmp: Path) -> dict[str, float]:
+    samples: list[dict[str, float]] = []
+    for run in range(runs):
+        run_env = dict(env)
+        if fresh_template_cache:
+            run_env["BLOG_TEMPLATE_CACHE_DIR"] = str(tmp / f"templates-{name}-{run}")
+        samples.append(start_worker(run_env, port))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Starts per configuration")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_name:
+        tmp = Path(tmp_name)
+        database = tmp / "startup.db"
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.data", "--database", str(database), "--users", str(args.users), "--posts", str(args.posts)],
+            cwd=PROJECT_DIR,
+            check=True,
+            capture_output=True,
+        )
+        env = {
+            **os.environ,
+            "BLOG_DATABASE_URL": f"sqlite+aiosqlite:///{database}",
+            # The benchmark polls /ready every few milliseconds
+            "BLOG_RATE_LIMIT_ENABLED": "false",
+        }
+        results = {
+            "environment": environment(),
+            "parameters": {"runs": args.runs, "users": args.users, "posts": args.posts},
+            "import_ms": statistics.median(import_seconds(env) * 1000 for _ in range(args.runs)),
+            "configurations": {},
+        }
+
+        configurations = {
+            "cold": ({**env, "BLOG_WARMUP_ENABLED": "false"}, True),
+            "warm-up": ({**env, "BLOG_WARMUP_ENABLED": "true"}, True),
+            "warm-up+cache": ({**env, "BLOG_WARMUP_ENABLED": "true", "BLOG_TEMPLATE_CACHE_DIR": str(tmp / "templates")}, False),
+        }
+        # Leaves the compiled templates on disk for warm-up+cache, like a previous deploy would
+        start_worker(configurations["warm-up+cache"][0], args.port)
+        for name, (configuration_env, fresh_template_cache) in configurations.items():
+            results["configurations"][name] = run_configuration(name, configuration_env, args.runs, args.port, fresh_template_cache, tmp)
+
+    print(f"import main: {results['import_ms']:.0f} ms (median of {args.runs})")
+    names = list(results["configurations"])
+    keys = list(results["configurations"][names[0]])
+    width = max(len(key) for key in keys)
+    print(f"{'ms':<{width}}  " + " ".join(f"{name:>14}" for name in names))
+    for key in keys:
+        print(f"{key:<{width}}  " + " ".join(f"{results['configurations'][name][key]:14.1f}" for name in names))
+
+    if args.output:
+        save(results, args.output)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+The benchmark suite: seed a throwaway database, run the micro-benchmarks and the load test,
+save the results as JSON and compare them with a baseline.
+
+    data.py     N users and M posts in a throwaway SQLite database (deterministic for a --seed)
+    micro.py    PostResponse serialization and template rendering
+    load.py     every route through the ASGI app: p50/p95/p99, requests per second, queries per request
+    results.py  the JSON results file
+    compare.py  regressions between two results files
+
+Typical use, to check a change to routers/posts.py or main.py:
+
+    git stash && python -m benchmarks.suite --output /tmp/before.json && git stash pop
+    python -m benchmarks.suite --output /tmp/after.json --baseline /tmp/before.json
+
+Exits with status 1 if a benchmark regressed by more than --threshold against --baseline
+(see compare.py). Only compare runs made on the same machine with the same parameters.
+
+The response and fragment caches are disabled unless --cache is given: with them, most requests
+would measure a cache lookup rather than the code behind the route.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks import compare, load, micro
+from benchmarks.data import seed, use_database
+from benchmarks.results import environment, save
+from benchmarks.results import load as load_results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data generator")
+    parser.add_argument("--repeat", type=int, default=500, help="Calls per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per load scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="Requests sent before measuring, per load scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight during the load test")
+    parser.add_argument("--only", help="Only the load scenarios whose name contains this text")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="Keep the response and fragment caches enabled")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown against the baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Read before anything runs: a missing baseline shouldn't cost a whole run
+    baseline = load_results(args.baseline) if args.baseline else None
+    parameters = {
+        name: getattr(args, name)
+        for name in ("users", "posts", "seed", "repeat", "requests", "warmup", "concurrency", "only", "cache")
+    }
+    results = {"environment": environment(), "parameters": parameters, "micro": {}, "routes": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before the app is imported: its engine, cache and settings are set up at import time
+        use_database(Path(tmp) / "suite.db")
+        if not args.cache:
+            os.environ["BLOG_CACHE_BACKEND"] = "none"
+            os.environ["BLOG_FRAGMENT_CACHE_MAX_BYTES"] = "0"
+        # Every request comes from the same client: the per-client rate limits would turn most of them away
+        os.environ["BLOG_RATE_LIMIT_ENABLED"] = "false"
+        os.environ["BLOG_SERVER_TIMING_ENABLED"] = "true"  # load.py counts the queries from the header
+        asyncio.run(seed(args.users, args.posts, args.seed))
+
+        if not args.skip_micro:
+            results["micro"] = micro.run(args.repeat)
+            micro.print_results(results["micro"])
+            print()
+        if not args.skip_load:
+            results["routes"] = asyncio.run(
+                load.run(args.users, args.posts, args.requests, args.concurrency, args.warmup, args.only)
+            )
+            load.print_results(results["routes"])
+            print()
+
+    if args.output:
+        save(results, args.output)
+        print(f"results written to {args.output}")
+    if baseline is not None and not compare.report(baseline, results, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
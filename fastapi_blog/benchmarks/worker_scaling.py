@@ -0,0 +1,163 @@
+"""
+Load test: throughput of the /api/posts endpoints with 1 to N worker processes.
+
+For every worker count, starts `python -m serve --workers N` on a throwaway, migrated and seeded
+SQLite database, then runs load generator processes for --seconds against a mix of
+GET /api/posts (a page of the feed) and GET /api/posts/{id}. Prints requests per second and
+the speedup over a single worker.
+
+The response cache is disabled by default (BLOG_CACHE_BACKEND=none) so every request goes through
+the database, the ORM and serialization, which is the work that spreads over the cores.
+Use --cache to measure with it.
+
+The load generators need CPU too: on a machine with few cores they compete with the workers,
+and the numbers flatten out well before N.
+
+Run from the project directory:
+    python -m benchmarks.worker_scaling --max-workers 4 --seconds 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def seed(database_url: str, users: int, posts: int) -> None:
+    env = {**os.environ, "BLOG_DATABASE_URL": database_url}
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=PROJECT_DIR, env=env, check=True, capture_output=True)
+    script = f"""
+import asyncio
+from sqlalchemy import insert
+import models.models as models
+from database import AsyncSessionLocal, engine
+import user_stats
+
+async def main():
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(models.User), [{{"username": f"user{{i}}", "email": f"user{{i}}@example.com"}} for i in range({users})])
+        await db.execute(
+            insert(models.Post),
+            [{{"title": f"Post {{i}}", "content": "Lorem ipsum dolor sit amet. " * 20, "user_id": (i % {users}) + 1}} for i in range({posts})],
+        )
+        await db.commit()
+        await user_stats.rebuild_user_stats(db)
+    await engine.dispose()
+
+asyncio.run(main())
+"""
+    subprocess.run([sys.executable, "-c", script], cwd=PROJECT_DIR, env=env, check=True)
+
+
+def wait_until_ready(base_url: str, timeout: float = 60.0) -> None:
+    import httpx
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            # 200 once the workers have warmed up (see warmup.py)
+            if httpx.get(f"{base_url}/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("the server did not start")
+
+
+def load_generator(base_url: str, seconds: float, concurrency: int, posts: int, results: "multiprocessing.Queue") -> None:
+    import httpx
+
+    async def run() -> tuple[int, int]:
+        ok = errors = 0
+        deadline = time.perf_counter() + seconds
+        # Several connections per generator, so the kernel spreads them over the workers
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+
+            async def worker(n: int) -> None:
+                nonlocal ok, errors
+                i = n
+                while time.perf_counter() < deadline:
+                    # One feed page for every four single posts
+                    url = "/api/posts?limit=20" if i % 5 == 0 else f"/api/posts/{(i * 7919) % posts + 1}"
+                    try:
+                        response = await client.get(url)
+                        if response.status_code == 200:
+                            ok += 1
+                        else:
+                            errors += 1
+                    except httpx.HTTPError:
+                        errors += 1
+                    i += 1
+
+            await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        return ok, errors
+
+    results.put(asyncio.run(run()))
+
+
+def measure(workers: int, args: argparse.Namespace, database_url: str, port: int) -> tuple[float, int]:
+    # All the requests come from one client, they must not be rate limited (see admission.py)
+    env = {**os.environ, "BLOG_DATABASE_URL": database_url, "BLOG_RATE_LIMIT_ENABLED": "false"}
+    if not args.cache:
+        env["BLOG_CACHE_BACKEND"] = "none"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "serve", "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(base_url)
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        generators = [
+            multiprocessing.Process(target=load_generator, args=(base_url, args.seconds, args.concurrency, args.posts, results))
+            for _ in range(args.clients)
+        ]
+        for generator in generators:
+            generator.start()
+        totals = [results.get() for _ in generators]
+        for generator in generators:
+            generator.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    ok = sum(result[0] for result in totals)
+    errors = sum(result[1] for result in totals)
+    return ok / args.seconds, errors
+
+
+def main() -> None:
+    cores = os.process_cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=cores, help=f"Up to this many workers (default: {cores}, the cores here)")
+    parser.add_argument("--clients", type=int, default=max(1, cores // 2), help="Load generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight per load generator")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--posts", type=int, default=2000, help="Posts seeded before the runs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache enabled")
+    args = parser.parse_args()
+
+    worker_counts = sorted({1, *(n for n in (2, 4, 8, 16, 32, 64) if n < args.max_workers), args.max_workers})
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite+aiosqlite:///{Path(tmp) / 'scaling.db'}"
+        seed(database_url, users=50, posts=args.posts)
+
+        print(f"{cores} cores, {args.clients} load generator(s) x {args.concurrency} requests in flight, {args.seconds:g} s per run")
+        baseline = None
+        for workers in worker_counts:
+            throughput, errors = measure(workers, args, database_url, args.port)
+            baseline = baseline or throughput
+            print(f"{workers:>3} worker(s): {throughput:8.1f} req/s  x{throughput / baseline:.2f}  (errors: {errors})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Write paths: duplicate sign-ups under concurrency, and writes per second.
+
+1. Race: --racers concurrent POST /api/users with the same username. Exactly one may succeed,
+   every other request must get a clean 400 "Username already exists" (no 500s, no second row).
+2. Throughput: create users, create posts and update posts (PUT) through the API for --seconds
+   each, with --concurrency requests in flight.
+
+Runs the app in-process (httpx ASGITransport) against a throwaway, migrated SQLite database.
+Exits with status 1 if the race check fails.
+
+Run from the project directory:
+    python -m benchmarks.write_paths --racers 50 --concurrency 8 --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+
+async def race_duplicate_usernames(client, racers: int) -> bool:
+    responses = await asyncio.gather(
+        *(client.post("/api/users", json={"username": "racer", "email": f"racer{i}@example.com"}) for i in range(racers))
+    )
+    statuses = Counter(response.status_code for response in responses)
+    details = Counter(response.json().get("detail") for response in responses if response.status_code == 400)
+
+    import models.models as models
+    from database import AsyncSessionLocal
+    from sqlalchemy import func, select
+
+    async with AsyncSessionLocal() as session:
+        rows = await session.scalar(select(func.count()).select_from(models.User).where(models.User.username == "racer"))
+
+    ok = statuses == Counter({201: 1, 400: racers - 1}) and details == Counter({"Username already exists": racers - 1}) and rows == 1
+    print(f"race: {racers} concurrent sign-ups as 'racer' -> statuses {dict(statuses)}, rows in users: {rows}  [{'ok' if ok else 'FAILED'}]")
+    return ok
+
+
+async def throughput(client, label: str, seconds: float, concurrency: int, request) -> None:
+    deadline = time.perf_counter() + seconds
+    counts = Counter()
+
+    async def worker(n: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            response = await request(n, i)
+            counts["ok" if response.status_code < 400 else "errors"] += 1
+            i += 1
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    print(f"{label:<12} {counts['ok'] / seconds:8.1f} writes/s  (errors: {counts['errors']})")
+
+
+async def run(args: argparse.Namespace) -> bool:
+    import httpx
+
+    from main import app
+
+    # Unhandled errors become 500 responses (as behind a real server) instead of raising here
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        ok = await race_duplicate_usernames(client, args.racers)
+
+        author = (await client.post("/api/users", json={"username": "author", "email": "author@example.com"})).json()
+        content = "Lorem ipsum dolor sit amet. " * 20
+
+        async def create_user(n: int, i: int):
+            return await client.post("/api/users", json={"username": f"user-{n}-{i}", "email": f"user-{n}-{i}@example.com"})
+
+        post_ids: list[int] = []
+
+        async def create_post(n: int, i: int):
+            response = await client.post("/api/posts", json={"title": f"Post {n}-{i}", "content": content, "user_id": author["id"]})
+            if response.status_code == 201:
+                post_ids.append(response.json()["id"])
+            return response
+
+        async def update_post(n: int, i: int):
+            post_id = post_ids[(n * 7919 + i) % len(post_ids)]
+            return await client.put(
+                f"/api/posts/{post_id}", json={"title": f"Updated {n}-{i}", "content": content, "user_id": author["id"]}
+            )
+
+        print(f"throughput, {args.concurrency} requests in flight, {args.seconds:g} s each")
+        await throughput(client, "create user", args.seconds, args.concurrency, create_user)
+        await throughput(client, "create post", args.seconds, args.concurrency, create_post)
+        await throughput(client, "update post", args.seconds, args.concurrency, update_post)
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--racers", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app modules are imported (the engine is built at import time)
+        os.environ["BLOG_DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(tmp) / 'writes.db'}"
+        # All the requests come from one client, they must not be rate limited (see admission.py)
+        os.environ["BLOG_RATE_LIMIT_ENABLED"] = "false"
+
+        from alembic import command
+        from alembic.config import Config
+
+        from database import BASE_DIR
+
+        command.upgrade(Config(str(BASE_DIR / "alembic.ini")), "head")
+        ok = asyncio.run(run(args))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Bulk import and export as NDJSON (one JSON object per line).
+
+Import (POST /api/users/bulk, POST /api/posts/bulk):
+
+- the request body is read as a stream, line by line, so a file of any size can be sent in one request
+- every line is validated with the same schema as the single-item endpoint (UserCreate / PostCreate)
+- valid lines are inserted in batches of BLOG_BULK_BATCH_SIZE: one executemany INSERT ... RETURNING
+  and one commit per batch, instead of a round trip (and a commit) per row
+- a batch that breaks a constraint (duplicate username, unknown user_id, ...) is retried one row at a
+  time, so only the offending lines are rejected
+- the response reports how many rows were inserted, and an error per rejected line:
+
+      {"inserted": 998, "failed": 2, "errors": [{"line": 3, "detail": "Username already exists"}, ...]}
+
+Export (GET /api/posts/export) streams every post as NDJSON, fetched from a server-side cursor
+BLOG_BULK_BATCH_SIZE rows at a time, so memory use stays flat whatever the size of the table.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models.models as models
+from projections import post_item_serializer, row_to_item, select_post_rows
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Bounds the size of the report, the counts are always complete
+MAX_REPORTED_ERRORS = 1000
+
+
+def ndjson_request_body(schema: type[BaseModel]) -> dict[str, Any]:
+    """OpenAPI description of an NDJSON request body (for the `openapi_extra` of the bulk endpoints)."""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                NDJSON_MEDIA_TYPE: {
+                    "schema": {"type": "string", "description": f"One {schema.__name__} JSON object per line"},
+                },
+            },
+        },
+    }
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    failed: int = 0
+    errors: list[dict[str, Any]] = field(default_factory=list)
+
+    def reject(self, line: int, detail: Any) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "detail": detail})
+
+    def summary(self) -> dict[str, Any]:
+        # Lines of a batch retried row by row are reported after the lines rejected by validation
+        return {"inserted": self.inserted, "failed": self.failed, "errors": sorted(self.errors, key=lambda error: error["line"])}
+
+
+async def read_ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int, report: ImportReport) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    Split a streamed body into lines and yield (line number, line), skipping blank lines.
+
+    Lines longer than `max_line_bytes` are rejected in the report and skipped without being buffered.
+    """
+    buffer = bytearray()
+    line_number = 1
+    skipping = False  # Inside a line that is too long, discarding bytes until its end
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not skipping:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        report.reject(line_number, f"Line longer than {max_line_bytes} bytes")
+                        buffer.clear()
+                        skipping = True
+                break
+            if skipping:
+                skipping = False
+            else:
+                buffer += chunk[start:end]
+                if len(buffer) > max_line_bytes:
+                    report.reject(line_number, f"Line longer than {max_line_bytes} bytes")
+                elif buffer.strip():
+                    yield line_number, bytes(buffer)
+            buffer.clear()
+            line_number += 1
+            start = end + 1
+    if buffer.strip() and not skipping:
+        yield line_number, bytes(buffer)
+
+
+async def bulk_insert(
+    db: AsyncSession,
+    lines: AsyncIterator[tuple[int, bytes]],
+    schema: type[BaseModel],
+    model: type[models.Base],
+    returning: list[Any],
+    batch_size: int,
+    report: ImportReport,
+    describe_violation: Callable[[IntegrityError], str],
+    after_insert: Callable[[AsyncSession, list[Any]], Awaitable[None]] | None = None,
+    before_insert: Callable[[list[dict[str, Any]]], Awaitable[None]] | None = None,
+) -> ImportReport:
+    """
+    Validate NDJSON lines with `schema` and insert them into `model`'s table in batches.
+
+    Args:
+        returning: Columns returned for every inserted row, passed to `after_insert`
+        describe_violation: Turns a constraint violation into the error message for the line
+        after_insert: Runs in the same transaction as each insert, e.g. to update the search index
+        before_insert: Runs on the values of each batch before it is inserted, and may add to them
+            (e.g. columns computed from the validated fields)
+    """
+    stmt = insert(model).returning(*returning)
+    batch: list[tuple[int, dict[str, Any]]] = []
+
+    async def flush() -> None:
+        if before_insert is not None:
+            await before_insert([values for _, values in batch])
+        try:
+            rows = (await db.execute(stmt, [values for _, values in batch])).all()
+            if after_insert is not None:
+                await after_insert(db, rows)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            # Some line broke a constraint: insert this batch row by row to find out which one(s)
+            rows = []
+            for line_number, values in batch:
+                try:
+                    row_result = (await db.execute(stmt, [values])).all()
+                    if after_insert is not None:
+                        await after_insert(db, row_result)
+                    await db.commit()
+                except IntegrityError as exc:
+                    await db.rollback()
+                    report.reject(line_number, describe_violation(exc))
+                else:
+                    rows += row_result
+        report.inserted += len(rows)
+        batch.clear()
+
+    async for line_number, line in lines:
+        try:
+            item = schema.model_validate_json(line)
+        except ValidationError as exc:
+            # Same shape as FastAPI's 422 responses
+            report.reject(line_number, exc.errors(include_url=False, include_context=False, include_input=False))
+            continue
+        batch.append((line_number, item.model_dump()))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return report
+
+
+async def export_posts(db: AsyncSession, fields: tuple[str, ...], batch_size: int) -> AsyncIterator[bytes]:
+    """Yield every post as NDJSON, oldest first, reading `batch_size` rows at a time from a server-side cursor."""
+    stmt = select_post_rows(fields, None).order_by(models.Post.id).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield b"".join(post_item_serializer.dump_json(row_to_item(row, fields)) + b"\n" for row in rows)
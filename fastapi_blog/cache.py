@@ -0,0 +1,285 @@
+"""Read-through response cache for post and user reads.
+
+Cached values are the already-serialized response bodies (bytes), so a cache hit skips
+the database, the ORM and Pydantic entirely.
+
+Every entry is stored with a set of *tags* (e.g. "post:3", "user:5", "posts:list").
+Write endpoints don't need to know which keys exist, they just invalidate the tags they
+affected and every entry carrying one of those tags is dropped.
+
+Invalidations are also published on the cache's bus (see pubsub.py), so that the other worker
+processes drop the same tags from their own in-memory and fragment caches.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterable
+
+from config import Settings, get_settings
+from pubsub import LocalBus, MessageBus, build_bus, split_tags
+
+
+# TAGS ###################################################
+# Tag for every page of the posts feed. Creating or deleting a post shifts all pages.
+POSTS_LIST_TAG = "posts:list"
+
+
+def post_tag(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def user_tag(user_id: int) -> str:
+    # Anything that embeds the user's data (the user itself, or a post showing its author)
+    return f"user:{user_id}"
+
+
+def user_posts_tag(user_id: int) -> str:
+    # The list of posts written by a user
+    return f"user_posts:{user_id}"
+
+
+def user_stats_tag(user_id: int) -> str:
+    # Anything showing the user's post counters (see user_stats.py). Changes with every post the user writes.
+    return f"user_stats:{user_id}"
+
+
+# BACKENDS ###################################################
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+class CacheBackend:
+    """Interface shared by all cache backends."""
+
+    name = "base"
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self._listeners: list[Callable[[tuple[str, ...]], None]] = []
+        # Replaced by build_cache when there are other workers to tell
+        self.bus: MessageBus = LocalBus()
+
+    def add_invalidation_listener(self, listener: Callable[[tuple[str, ...]], None]) -> None:
+        """Call `listener(tags)` on every invalidation, so other caches (e.g. template fragments) can follow along."""
+        self._listeners.append(listener)
+
+    def _notify(self, tags: tuple[str, ...]) -> None:
+        for listener in self._listeners:
+            listener(tags)
+
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, tags: Iterable[str] = (), ttl_seconds: int | None = None) -> None:
+        raise NotImplementedError
+
+    async def invalidate_tags(self, *tags: str) -> None:
+        """Drop every entry carrying one of the tags, in this worker and (through the bus) in the others."""
+        self._invalidate_local(tags)
+        await self._invalidate_shared(tags)
+        for batch in split_tags(tags):
+            await self.bus.publish(batch)
+
+    def apply_remote_invalidation(self, tags: list[str]) -> None:
+        """Drop the tags invalidated by another worker. The bus handler, see pubsub.py."""
+        self._invalidate_local(tuple(tags))
+
+    def _invalidate_local(self, tags: tuple[str, ...]) -> None:
+        # What this process keeps: the listeners' caches, and the entries of in-memory backends
+        self._notify(tags)
+
+    async def _invalidate_shared(self, tags: tuple[str, ...]) -> None:
+        # What every worker shares (Redis), dropped once by the worker that invalidates
+        return None
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the counters (and backend specific details) as a plain dict, e.g. for the admin endpoint."""
+        return {"backend": self.name, **asdict(self.stats)}
+
+
+class NullCache(CacheBackend):
+    """Cache that never stores anything. Used when caching is disabled (BLOG_CACHE_BACKEND=none)."""
+
+    name = "none"
+
+    async def get(self, key: str) -> bytes | None:
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, value: bytes, tags: Iterable[str] = (), ttl_seconds: int | None = None) -> None:
+        return None
+
+    async def clear(self) -> None:
+        return None
+
+
+@dataclass
+class _Entry:
+    value: bytes
+    expires_at: float
+    tags: tuple[str, ...]
+
+
+class MemoryCache(CacheBackend):
+    """
+    In-process cache with a TTL per entry and LRU eviction.
+
+    The cache is bounded both by the number of entries and by the total size of the
+    stored values, whichever limit is hit first.
+    """
+
+    name = "memory"
+
+    def __init__(self, ttl_seconds: int, max_entries: int, max_bytes: int):
+        super().__init__(ttl_seconds)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()  # Least recently used entry first
+        self._tags: dict[str, set[str]] = {}  # tag -> keys carrying that tag
+        self._size = 0
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry.value
+
+    async def set(self, key: str, value: bytes, tags: Iterable[str] = (), ttl_seconds: int | None = None) -> None:
+        # A single value bigger than the whole cache would just evict everything else
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        entry = _Entry(value=value, expires_at=time.monotonic() + ttl, tags=tuple(tags))
+        self._entries[key] = entry
+        self._size += len(value)
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats.evictions += 1
+
+    def _invalidate_local(self, tags: tuple[str, ...]) -> None:
+        self._notify(tags)
+        for tag in tags:
+            for key in self._tags.pop(tag, set()):
+                if key in self._entries:
+                    self._remove(key)
+                    self.stats.invalidations += 1
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self._size = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**super().snapshot(), "entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._size -= len(entry.value)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache stored in Redis, shared by every worker process.
+
+    `client` is anything that speaks the `redis.asyncio.Redis` API (get/set/delete/sadd/smembers/expire/ttl),
+    so tests can pass a local stand-in such as `fakeredis.aioredis.FakeRedis()`.
+    Redis evicts keys on its own (maxmemory policy), so `evictions` is not tracked here.
+    """
+
+    name = "redis"
+
+    def __init__(self, client: Any, ttl_seconds: int, prefix: str = "blog:cache:"):
+        super().__init__(ttl_seconds)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> bytes | None:
+        value = await self.client.get(self.prefix + key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, tags: Iterable[str] = (), ttl_seconds: int | None = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        await self.client.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            await self.client.sadd(tag_key, key)
+            # The tag set has to live as long as the longest-lived entry it points to: only ever extend its TTL,
+            # or an entry with a short TTL would cut it short and leave the longer ones out of invalidation.
+            # ttl() is -1 for a set just created by sadd (no expiry yet), so it gets one too.
+            # (EXPIRE ... GT would do it in one call, but needs Redis 7 and never applies to a key without a TTL.)
+            if await self.client.ttl(tag_key) < ttl:
+                await self.client.expire(tag_key, ttl)
+
+    async def _invalidate_shared(self, tags: tuple[str, ...]) -> None:
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            keys = await self.client.smembers(tag_key)
+            if keys:
+                await self.client.delete(*(self.prefix + (k.decode() if isinstance(k, bytes) else k) for k in keys))
+                self.stats.invalidations += len(keys)
+            await self.client.delete(tag_key)
+
+    async def clear(self) -> None:
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}tag:{tag}"
+
+
+def build_cache(settings: Settings) -> CacheBackend:
+    """Create the cache backend selected in the settings, with the invalidation bus for the deployment."""
+    backend: CacheBackend
+    if settings.cache_backend == "none":
+        backend = NullCache(settings.cache_ttl_seconds)
+    elif settings.cache_backend == "redis":
+        # Optional dependency - only needed when the Redis backend is selected (pip install 'fastapi-blog[redis]')
+        import redis.asyncio as redis
+
+        backend = RedisCache(redis.from_url(settings.redis_url), settings.cache_ttl_seconds)
+    else:
+        backend = MemoryCache(settings.cache_ttl_seconds, settings.cache_max_entries, settings.cache_max_bytes)
+    backend.bus = build_bus(settings, "cache:invalidations", getattr(backend, "client", None))
+    return backend
+
+
+cache = build_cache(get_settings())
+
+
+# Returns the shared cache backend. Used as a dependency (like get_db) so tests can swap it with app.dependency_overrides.
+def get_cache() -> CacheBackend:
+    return cache
@@ -0,0 +1,215 @@
+"""Compression of the dynamic responses (JSON API, NDJSON export, HTML pages): brotli or gzip.
+
+The encoding is negotiated from Accept-Encoding: brotli when the client accepts it and a brotli
+module is installed (the `brotli` extra), else gzip. Bodies smaller than
+BLOG_COMPRESSION_MINIMUM_SIZE are sent as they are: the few bytes saved don't pay for the CPU.
+
+Left alone:
+- responses that already have a Content-Encoding (the precompressed static files, see assets.py)
+- types that don't compress (images, ...) and text/event-stream, which must reach the client event by event
+- 204/304 responses and HEAD requests, which have no body
+
+Streamed responses (the NDJSON export) are compressed chunk by chunk, each chunk flushed so the
+client doesn't wait for the end of the stream to get the rows already sent.
+"""
+
+import zlib
+from typing import Protocol
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSIBLE_TYPES = frozenset({
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+    "text/xml",
+})
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+    def finish(self) -> bytes: ...
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        # wbits=31: gzip header and trailer, not a bare zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encoding: str, available: tuple[str, ...]) -> str | None:
+    """
+    Pick the encoding for a response from the request's Accept-Encoding.
+
+    Args:
+        available: The encodings this server can produce, preferred first
+
+    Example:
+        choose_encoding("gzip, deflate, br;q=0.9", ("br", "gzip")) -> "gzip"
+        choose_encoding("identity", ("br", "gzip")) -> None
+    """
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *parameters = part.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        # Strictly greater: on a tie, the server's preference wins
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing the response bodies with brotli or gzip.
+
+    Args:
+        minimum_size: Bodies smaller than this many bytes are not compressed
+        gzip_level: 1 (fastest) to 9 (smallest)
+        brotli_quality: 0 (fastest) to 11 (smallest). Responses are compressed on every request, keep it low.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        responder = _CompressingResponder(self, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+    def compressor(self, encoding: str) -> Compressor:
+        if encoding == "br":
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+
+def _is_compressible(start: Message, headers: MutableHeaders) -> bool:
+    if start["status"] < 200 or start["status"] in (204, 304) or "content-encoding" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type in COMPRESSIBLE_TYPES
+
+
+class _CompressingResponder:
+    """The `send` of one response: holds back http.response.start until the first body chunk shows how big the body is."""
+
+    def __init__(self, middleware: CompressionMiddleware, send: Send, encoding: str | None):
+        self.middleware = middleware
+        self.send_downstream = send
+        self.encoding = encoding
+        self.start: Message | None = None
+        self.compressor: Compressor | None = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send_downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is not None:
+            # Next chunk of a compressed stream
+            if more_body:
+                data = self.compressor.compress(body) + self.compressor.flush()
+            else:
+                data = self.compressor.compress(body) + self.compressor.finish()
+            await self.send_downstream({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        # First body chunk: decide now
+        start, self.start = self.start, None
+        headers = MutableHeaders(scope=start)
+        compressible = _is_compressible(start, headers)
+        if compressible:
+            # Caches must keep the compressed and uncompressed variants apart
+            headers.add_vary_header("Accept-Encoding")
+        if not compressible or self.encoding is None or (not more_body and len(body) < self.middleware.minimum_size):
+            self.passthrough = True
+            await self.send_downstream(start)
+            await self.send_downstream(message)
+            return
+
+        self.compressor = self.middleware.compressor(self.encoding)
+        headers["Content-Encoding"] = self.encoding
+        # A strong ETag promises identical bytes, which the compressed body no longer is
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        if more_body:
+            # The final length isn't known before the end of the stream
+            del headers["Content-Length"]
+            data = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            data = self.compressor.compress(body) + self.compressor.finish()
+            headers["Content-Length"] = str(len(data))
+        await self.send_downstream(start)
+        await self.send_downstream({"type": "http.response.body", "body": data, "more_body": more_body})
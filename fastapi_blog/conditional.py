@@ -0,0 +1,126 @@
+"""Conditional GET for the JSON API: ETag and Last-Modified validators, 304 Not Modified.
+
+Posts, users and user_stats rows carry an updated_at, bumped by every UPDATE (see models.updated_at_column).
+GET /api/posts, /api/posts/{post_id} and /api/users/{user_id} derive the validators of a response
+from the versions of the rows it is built from, right after the query and *before* serializing:
+
+- ETag: weak, a hash of the representation (the URL: fields=, excerpt=, cursor=, ...) and of the
+  id and updated_at of every row in it. Weak because compression.py may send the body gzip or
+  brotli encoded: the same representation, but not the same bytes.
+- Last-Modified: the newest updated_at
+
+A client sending a matching If-None-Match (or, without one, an If-Modified-Since not older than
+Last-Modified) gets a 304 with no body: nothing is serialized, and nothing is sent but headers.
+The response cache keeps the validators next to the body (see pack/unpack), so a cache hit
+answers a 304 without the database at all.
+"""
+
+import hashlib
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Iterable
+
+from fastapi import Request, Response, status
+
+
+def as_utc(value: datetime) -> datetime:
+    # SQLite hands DateTime(timezone=True) columns back as naive datetimes, stored in UTC
+    return value.replace(tzinfo=UTC) if value.tzinfo is None else value.astimezone(UTC)
+
+
+@dataclass(frozen=True)
+class Validators:
+    etag: str
+    last_modified: datetime | None = None
+
+    def headers(self) -> dict[str, str]:
+        # no-cache: clients may store the response but must revalidate it (cheap, thanks to the validators)
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+
+def validators_for(representation: str, versions: Iterable[tuple[Any, ...]]) -> Validators:
+    """
+    Build the validators of a response from the versions of its rows.
+
+    Args:
+        representation: What, besides the rows, changes the body (the request URL)
+        versions: One tuple per row, e.g. (post.id, post.updated_at, author.updated_at). None timestamps are allowed.
+
+    Example:
+        validators_for("/api/posts/1", [(1, datetime(2026, 10, 17, 12, 0))])
+        -> Validators(etag='W/"3f2a..."', last_modified=datetime(2026, 10, 17, 12, 0, tzinfo=UTC))
+    """
+    digest = hashlib.sha256(representation.encode())
+    newest = None
+    for version in versions:
+        parts = []
+        for value in version:
+            if isinstance(value, datetime):
+                value = as_utc(value)
+                if newest is None or value > newest:
+                    newest = value
+                value = value.isoformat()
+            parts.append(str(value))
+        digest.update(("\n" + ",".join(parts)).encode())
+    # Last-Modified has a one second resolution
+    return Validators(f'W/"{digest.hexdigest()[:20]}"', newest.replace(microsecond=0) if newest else None)
+
+
+def _opaque_tag(etag: str) -> str:
+    # Weak comparison (RFC 9110 8.8.3.2): W/"x" and "x" match
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(request: Request, validators: Validators, use_if_modified_since: bool = True) -> bool:
+    """
+    True if the client's copy is still current.
+
+    If-None-Match wins over If-Modified-Since when both are sent (RFC 9110 13.2.2).
+    `use_if_modified_since=False` for responses whose Last-Modified can't see every change
+    (a list doesn't get newer when one of its rows is deleted).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        etag = _opaque_tag(validators.etag)
+        return any(_opaque_tag(candidate) == etag for candidate in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or not use_if_modified_since or validators.last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        # An invalid date is ignored
+        return False
+    return validators.last_modified <= as_utc(since)
+
+
+def respond(request: Request, body: bytes, validators: Validators, use_if_modified_since: bool = True) -> Response:
+    """The JSON response with its validators, or a bodyless 304 if the client already has it."""
+    if is_not_modified(request, validators, use_if_modified_since):
+        return not_modified(validators)
+    return Response(content=body, media_type="application/json", headers=validators.headers())
+
+
+def not_modified(validators: Validators) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators.headers())
+
+
+# CACHED RESPONSES ###################################################
+# Cached as '<etag>\n<last-modified HTTP date, or nothing>\n<body>', so a hit has its validators at hand
+def pack(validators: Validators, body: bytes) -> bytes:
+    last_modified = format_datetime(validators.last_modified, usegmt=True) if validators.last_modified else ""
+    return f"{validators.etag}\n{last_modified}\n".encode() + body
+
+
+def unpack(cached: bytes) -> tuple[Validators, bytes]:
+    etag, _, rest = cached.partition(b"\n")
+    last_modified, _, body = rest.partition(b"\n")
+    return Validators(etag.decode(), parsedate_to_datetime(last_modified.decode()) if last_modified else None), body
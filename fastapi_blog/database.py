@@ -1,23 +1,313 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import logging
+import re
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Literal, NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from config import Settings, db_pool_size_per_worker, get_settings
 
-SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./blog.db"
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-)
+# Get the base directory (where main.py and alembic.ini are located)
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def build_engine(settings: Settings, database_url: str | None = None) -> AsyncEngine:
+    """
+    Create the async engine for the configured database (or for `database_url`, e.g. a read replica).
+
+    - SQLite: WAL journal and tuned pragmas applied on every new connection
+    - Postgres (asyncpg): a sized connection pool with pre-ping and recycling
+
+    The pool is per process: with several workers, its size is this worker's share (see db_pool_size_per_worker).
+    """
+    url = make_url(database_url or settings.database_url)
+    pool_size, max_overflow = db_pool_size_per_worker(settings)
+    pool_options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+    if url.get_backend_name() == "sqlite":
+        # In-memory databases use a single shared connection, pool sizing doesn't apply to them
+        in_memory = url.database in (None, "", ":memory:")
+        # A local file can't drop the connection like a network server can, so pre-ping would only add a round trip
+        pool_options["pool_pre_ping"] = False
+        engine = create_async_engine(
+            url,
+            echo=settings.db_echo,
+            connect_args={"check_same_thread": False},
+            **({} if in_memory else pool_options),
+        )
+        _install_sqlite_pragmas(engine, settings, in_memory)
+        return engine
+
+    if url.get_backend_name() == "postgresql":
+        return create_async_engine(
+            url,
+            echo=settings.db_echo,
+            connect_args={
+                "command_timeout": settings.postgres_command_timeout,
+                "server_settings": {"application_name": "fastapi_blog"},
+            },
+            **pool_options,
+        )
+
+    return create_async_engine(url, echo=settings.db_echo, **pool_options)
+
+
+def _install_sqlite_pragmas(engine: AsyncEngine, settings: Settings, in_memory: bool) -> None:
+    pragmas = {
+        "synchronous": settings.sqlite_synchronous,
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        # A negative cache_size is a size in KiB rather than a number of pages
+        "cache_size": -settings.sqlite_cache_size_kib,
+        "mmap_size": settings.sqlite_mmap_size,
+        "foreign_keys": "ON",
+    }
+    if not in_memory:
+        # WAL needs a real file (it keeps a -wal file next to the database)
+        pragmas = {"journal_mode": settings.sqlite_journal_mode, **pragmas}
+
+    # The pragmas are per connection, so they are set every time the pool opens a new one
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+engine = build_engine(get_settings())
 
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+# READ REPLICAS ###################################################
+class ReplicaSet:
+    """
+    Read replica engines, handed out round robin.
+
+    A replica whose connection fails is marked down and skipped for `retry_seconds`, then tried
+    again. When every replica is down, reads go to the primary.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], retry_seconds: float):
+        self.engines = engines
+        self.retry_seconds = retry_seconds
+        self.session_factories = [async_sessionmaker(e, class_=AsyncSession, expire_on_commit=False) for e in engines]
+        self._down_until = [0.0] * len(engines)
+        self._next = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def pick(self) -> int | None:
+        """Index of the next healthy replica, or None when there is none."""
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            index = self._next % len(self.engines)
+            self._next += 1
+            if self._down_until[index] <= now:
+                return index
+        return None
+
+    def mark_down(self, index: int, reason: object) -> None:
+        if self._down_until[index] <= time.monotonic():
+            logger.warning("Read replica %s is down, retrying in %.0fs: %s", self.describe(index), self.retry_seconds, reason)
+        self._down_until[index] = time.monotonic() + self.retry_seconds
+
+    def describe(self, index: int) -> str:
+        return self.engines[index].url.render_as_string(hide_password=True)
+
+    def status(self) -> list[dict[str, object]]:
+        now = time.monotonic()
+        return [{"url": self.describe(index), "healthy": self._down_until[index] <= now} for index in range(len(self.engines))]
+
+    async def dispose(self) -> None:
+        for replica_engine in self.engines:
+            await replica_engine.dispose()
+
+
+replicas = ReplicaSet(
+    [build_engine(get_settings(), url) for url in get_settings().database_replica_urls],
+    get_settings().replica_retry_seconds,
+)
+
+# True while handling a request from a client that wrote recently. Set by ReadYourWritesMiddleware.
+_reads_from_primary: ContextVar[bool] = ContextVar("reads_from_primary", default=False)
+
+# Holds the time (Unix seconds) until which the client reads from the primary
+READ_YOUR_WRITES_COOKIE = "blog_primary_until"
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware that sends a client's reads to the primary for a short while after it writes.
+
+    Replicas lag behind the primary a little. Without this, a user who just published a post could
+    be redirected to a page read from a replica that doesn't have it yet. A successful write
+    (anything but GET/HEAD/OPTIONS) sets a short-lived cookie, and while it's valid get_read_db
+    hands out primary sessions.
+    """
+
+    def __init__(self, app: ASGIApp, window_seconds: float):
+        self.app = app
+        self.window_seconds = window_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        primary_until = 0.0
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                try:
+                    primary_until = float(cookie_parser(value.decode("latin-1")).get(READ_YOUR_WRITES_COOKIE, 0))
+                except ValueError:
+                    pass
+        token = _reads_from_primary.set(primary_until > time.time())
+        is_write = scope["method"] not in ("GET", "HEAD", "OPTIONS")
+
+        async def send_with_cookie(message: Message) -> None:
+            if is_write and message["type"] == "http.response.start" and message["status"] < 400:
+                expires = int(time.time() + self.window_seconds) + 1
+                cookie = f"{READ_YOUR_WRITES_COOKIE}={expires}; Max-Age={int(self.window_seconds) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                MutableHeaders(scope=message).append("set-cookie", cookie)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _reads_from_primary.reset(token)
+
+
 class Base(DeclarativeBase):
     pass
 
+
+class SchemaRevisionError(RuntimeError):
+    pass
+
+
+async def check_schema_revision(engine: AsyncEngine) -> str:
+    """
+    Confirm the database is migrated to the latest revision.
+
+    This only reads the alembic_version table, it never changes the schema. Migrations
+    are applied separately with 'alembic upgrade head' before the workers start.
+
+    Returns:
+        The current (head) revision
+
+    Raises:
+        SchemaRevisionError: If the database is missing migrations (or is ahead of this code)
+    """
+    # Imported here: alembic takes a good part of the import time, and only the startup needs it
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    head = ScriptDirectory.from_config(Config(str(BASE_DIR / "alembic.ini"))).get_current_head()
+    async with engine.connect() as conn:
+        current = await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+
+    if current != head:
+        raise SchemaRevisionError(
+            f"Database schema is at revision {current!r} but the code expects {head!r}. "
+            "Run 'alembic upgrade head' (a database created before migrations existed needs 'alembic stamp 0001' first)."
+        )
+    return head
+
+class ConstraintViolation(NamedTuple):
+    kind: Literal["unique", "foreign_key", "other"]
+    column: str | None  # For unique violations: the (first) column of the constraint, e.g. "username"
+
+
+def constraint_violation(exc: IntegrityError) -> ConstraintViolation:
+    """
+    Work out which constraint a write violated, from the database driver's error.
+
+    Lets the write endpoints INSERT/UPDATE straight away and rely on the unique and foreign key
+    constraints, instead of running a SELECT first to check (which races under concurrency anyway).
+
+    Example:
+        SQLite "UNIQUE constraint failed: users.username" -> ConstraintViolation("unique", "username")
+    """
+    orig = exc.orig
+    message = str(orig)
+    # asyncpg errors carry the SQLSTATE code (23505 unique_violation, 23503 foreign_key_violation)
+    sqlstate = getattr(orig, "sqlstate", None)
+
+    if sqlstate == "23505" or message.startswith("UNIQUE constraint failed"):
+        if sqlstate == "23505":
+            # e.g. 'Key (username)=(alice) already exists.' on the original asyncpg exception
+            match = re.search(r"Key \(([^,)]+)", getattr(orig.__cause__, "detail", None) or message)
+            column = match.group(1).strip('" ') if match else None
+        else:
+            # e.g. 'UNIQUE constraint failed: users.username' (or 'users.a, users.b' for composite constraints)
+            column = message.partition(":")[2].split(",")[0].strip().rpartition(".")[2] or None
+        return ConstraintViolation("unique", column)
+
+    if sqlstate == "23503" or message.startswith("FOREIGN KEY constraint failed"):
+        return ConstraintViolation("foreign_key", None)
+    return ConstraintViolation("other", None)
+
+
 # Returns a new database session for each request (each request gets her own session). The 'with' statement ensures that the session is properly closed after the request is processed, even if an error occurs. This is important for preventing database connection leaks and ensuring that resources are managed efficiently.
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
 
+# Same as get_db, for endpoints that only read: the session is bound to a read replica when there are any.
+# Falls back to the primary when no replica is healthy, or when the client wrote in the last few seconds.
+# The endpoints must not fill the shared caches with what they read from a replica (see is_replica_session).
+async def get_read_db():
+    index = None if _reads_from_primary.get() else replicas.pick()
+    session = None
+    if index is not None:
+        session = replicas.session_factories[index](info={"replica": True})
+        try:
+            # Check out the connection now, so a replica that is down costs a fallback rather than an error
+            await session.connection()
+        except (DBAPIError, OSError) as exc:
+            await session.close()
+            replicas.mark_down(index, exc)
+            session, index = None, None
+    if session is None:
+        session = AsyncSessionLocal()
+
+    async with session:
+        try:
+            yield session
+        except DBAPIError as exc:
+            # The replica went away while the request was using it
+            if index is not None and exc.connection_invalidated:
+                replicas.mark_down(index, exc)
+            raise
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    """
+    Whether the session reads from a replica (see get_read_db).
+
+    What it reads can lag behind the primary, so it must not fill the shared response and page caches.
+    After a write invalidates an entry, the next read would otherwise put the old rows back, and every
+    client would get them until the entry expires. Responses read from a replica are served, not cached.
+    """
+    return session.info.get("replica", False)
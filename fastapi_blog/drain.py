@@ -0,0 +1,88 @@
+"""Graceful shutdown: wait for the requests in flight before closing the database pool.
+
+The lifespan handler calls `in_flight.drain()` first thing on shutdown. From then on new requests
+are turned away with a 503 (and `Connection: close`, so clients reconnect to another worker),
+and shutdown waits until the requests already running have sent their response, or until
+BLOG_SHUTDOWN_DRAIN_TIMEOUT_SECONDS. Only then are the image pool and the engine disposed,
+so no request loses its database connection half way through.
+"""
+
+import asyncio
+import logging
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightRequests:
+    """Counts the HTTP requests being handled by this worker."""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def started(self) -> None:
+        self.count += 1
+        self._idle.clear()
+
+    def finished(self) -> None:
+        self.count -= 1
+        if self.count == 0:
+            self._idle.set()
+
+    def resume(self) -> None:
+        # Accept requests again (the app is started again in the same process, e.g. by tests)
+        self.draining = False
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Stop accepting requests and wait for the running ones to finish.
+
+        Returns:
+            True if every request finished, False if some were still running after `timeout` seconds
+        """
+        self.draining = True
+        if self.count:
+            logger.info("Shutting down, waiting for %d request(s) in flight", self.count)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except TimeoutError:
+            logger.warning("Shutting down with %d request(s) still running after %.1fs", self.count, timeout)
+            return False
+        return True
+
+
+in_flight = InFlightRequests()
+
+
+class DrainMiddleware:
+    """ASGI middleware that keeps `in_flight` up to date, and refuses new requests once draining."""
+
+    def __init__(self, app: ASGIApp, tracker: InFlightRequests = in_flight):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.tracker.draining:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [(b"content-type", b"text/plain"), (b"connection", b"close"), (b"retry-after", b"1")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b"Server is shutting down"})
+            return
+
+        self.tracker.started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tracker.finished()
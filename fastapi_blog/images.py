@@ -0,0 +1,181 @@
+"""Profile picture handling: streaming uploads to disk and thumbnail generation."""
+
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+import anyio
+from fastapi import UploadFile
+
+from config import get_settings
+
+# Square WebP thumbnails generated for every upload (pixels)
+THUMBNAIL_SIZES = (32, 64, 256)
+
+# Magic bytes -> file extension. We trust the file content, not the client's content_type header.
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": ".png",
+    b"\xff\xd8\xff": ".jpg",
+    b"GIF87a": ".gif",
+    b"GIF89a": ".gif",
+}
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
+class UnsupportedImageError(ValueError):
+    pass
+
+
+class SavedUpload(NamedTuple):
+    path: Path
+    sha256: str  # Hex digest of the content
+    size: int  # Bytes
+
+
+def detect_image_type(header: bytes) -> str | None:
+    """
+    Detect the image format from the first bytes of a file.
+
+    Returns:
+        The file extension (e.g. ".png"), or None if the bytes are not a supported image
+    """
+    # WebP: "RIFF" <4 byte size> "WEBP"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+async def save_upload(file: UploadFile, destination: Path) -> SavedUpload:
+    """
+    Stream an uploaded image to disk in chunks, without blocking the event loop, hashing it on the way.
+
+    - Rejects files whose first bytes are not a supported image format
+    - Stops reading (and removes the partial file) as soon as the size limit is exceeded
+    - The extension of the saved file comes from the detected format
+
+    Args:
+        file: The uploaded file
+        destination: Where to save it. The suffix is replaced by the detected one.
+
+    Returns:
+        The path of the saved file, its SHA-256 and its size
+
+    Raises:
+        UnsupportedImageError: If the file is not a PNG, JPEG, GIF or WebP image
+        UploadTooLargeError: If the file is bigger than BLOG_UPLOAD_MAX_BYTES
+    """
+    settings = get_settings()
+    first_chunk = await file.read(settings.upload_chunk_size)
+    extension = detect_image_type(first_chunk)
+    if extension is None:
+        raise UnsupportedImageError("Only PNG, JPEG, GIF and WebP images are allowed")
+
+    destination = destination.with_suffix(extension)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    written = 0
+    digest = hashlib.sha256()
+    try:
+        # anyio runs the blocking file writes in a worker thread
+        async with await anyio.open_file(destination, "wb") as buffer:
+            chunk = first_chunk
+            while chunk:
+                written += len(chunk)
+                if written > settings.upload_max_bytes:
+                    raise UploadTooLargeError(f"File is too large (limit is {settings.upload_max_bytes:,} bytes)")
+                digest.update(chunk)
+                await buffer.write(chunk)
+                chunk = await file.read(settings.upload_chunk_size)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+
+    return SavedUpload(destination, digest.hexdigest(), written)
+
+
+def verify_image(path: Path) -> None:
+    """
+    Check that Pillow can read the image, without decoding the pixels. Quick enough to run during the
+    upload request, so corrupted files are rejected there rather than in the thumbnails job.
+
+    Raises:
+        UnsupportedImageError: If the file is not a readable image
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as exc:
+        raise UnsupportedImageError("The uploaded file is not a valid image") from exc
+
+
+def thumbnail_filename(image_file: str, size: int) -> str:
+    """
+    Name of the thumbnail of an image at the given size, in the same directory.
+
+    Example:
+        thumbnail_filename("3f/a9/3fa9c1.png", 64) -> "3f/a9/3fa9c1_64.webp"
+    """
+    path = PurePosixPath(image_file)
+    return str(path.with_name(f"{path.stem}_{size}.webp"))
+
+
+def generate_thumbnails(source: Path, sizes: tuple[int, ...] = THUMBNAIL_SIZES) -> list[Path]:
+    """
+    Create square WebP thumbnails next to the source image.
+
+    CPU heavy, so it is meant to run in the process pool (see `create_thumbnails`).
+
+    Raises:
+        UnsupportedImageError: If Pillow can't decode the image (e.g. corrupted file with valid magic bytes)
+    """
+    # Imported here so the web workers don't pay for Pillow until an upload happens
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as image:
+            # Apply the camera orientation, then work in a mode WebP can save
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            paths = []
+            for size in sizes:
+                thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+                path = source.with_name(thumbnail_filename(source.name, size))
+                thumbnail.save(path, "WEBP", quality=85, method=4)
+                paths.append(path)
+            return paths
+    except (UnidentifiedImageError, OSError) as exc:
+        raise UnsupportedImageError("The uploaded file is not a valid image") from exc
+
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    # Created on first use, so workers that never handle an upload don't spawn extra processes
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=get_settings().image_pool_workers)
+    return _pool
+
+
+async def create_thumbnails(source: Path) -> list[Path]:
+    """Generate the thumbnails of `source` in the process pool, keeping the event loop free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_pool(), generate_thumbnails, source)
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
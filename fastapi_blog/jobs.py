@@ -0,0 +1,324 @@
+"""Background job queue, stored in the database (the jobs table).
+
+Slow side effects of a request (thumbnails, notifications, cache warming, ...) don't run in the
+request handler. The handler enqueues a job and returns, a separate worker process runs it:
+
+    await jobs.enqueue(db, "profile_thumbnails", {"user_id": 1, "image_file": "abc.png"})
+    await db.commit()  # The job is committed (or rolled back) together with the request's changes
+
+Handlers are async functions registered under a name, they get their own session:
+
+    @jobs.handler("profile_thumbnails")
+    async def profile_thumbnails(db: AsyncSession, payload: dict) -> None: ...
+
+The worker (`python -m jobs`, or `python -m serve --with-jobs`):
+
+- claims due jobs in one UPDATE ... RETURNING (FOR UPDATE SKIP LOCKED on Postgres, so several
+  workers never run the same job), and runs at most BLOG_JOBS_CONCURRENCY at a time
+- retries a failed job with exponential backoff, up to its max_attempts, then marks it failed.
+  Raise PermanentJobError for failures that retrying can't fix.
+- cancels jobs running longer than BLOG_JOBS_TIMEOUT_SECONDS, and requeues jobs left "running"
+  by a worker that died
+- on SIGTERM/SIGINT stops claiming jobs and waits for the running ones
+
+GET /api/admin/jobs shows the queue (counts per status and kind, oldest due job, recent failures).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import signal
+import socket
+from datetime import UTC, datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import models.models as models
+from config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[AsyncSession, dict[str, Any]], Awaitable[None]]
+
+_handlers: dict[str, JobHandler] = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying can't help (e.g. invalid payload). The job fails straight away."""
+
+
+def handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    """Register the function handling the jobs of a kind."""
+
+    def register(function: JobHandler) -> JobHandler:
+        _handlers[kind] = function
+        return function
+
+    return register
+
+
+def utcnow() -> datetime:
+    return datetime.now(UTC)
+
+
+# ENQUEUE ###################################################
+async def enqueue(
+    db: AsyncSession,
+    kind: str,
+    payload: dict[str, Any],
+    delay_seconds: float = 0,
+    max_attempts: int | None = None,
+) -> int:
+    """
+    Add a job to the queue, in the session's transaction. It only becomes visible to the worker on commit.
+
+    Args:
+        payload: JSON-serializable arguments for the handler
+        delay_seconds: Don't run the job before this many seconds
+
+    Returns:
+        The job id
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No job handler registered for {kind!r}")
+    now = utcnow()
+    result = await db.execute(
+        insert(models.Job)
+        .values(
+            kind=kind,
+            payload=payload,
+            status="queued",
+            attempts=0,
+            max_attempts=max_attempts or get_settings().jobs_max_attempts,
+            run_after=now + timedelta(seconds=delay_seconds),
+            created_at=now,
+        )
+        .returning(models.Job.id)
+    )
+    return result.scalar_one()
+
+
+def retry_delay(attempts: int, settings: Settings) -> float:
+    # Exponential backoff with a little jitter, so jobs that failed together don't all retry together
+    delay = min(settings.jobs_retry_base_seconds * 2 ** (attempts - 1), settings.jobs_retry_max_seconds)
+    return delay * (1 + random.random() * 0.1)
+
+
+# QUEUE STATUS ###################################################
+async def queue_status(db: AsyncSession, recent_failures: int = 20) -> dict[str, Any]:
+    """Counts per status and kind, the oldest due job and the latest failures. For the admin endpoint."""
+    job = models.Job
+    rows = (await db.execute(select(job.kind, job.status, func.count()).group_by(job.kind, job.status))).all()
+    counts: dict[str, int] = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+    by_kind: dict[str, dict[str, int]] = {}
+    for kind, status, count in rows:
+        counts[status] = counts.get(status, 0) + count
+        by_kind.setdefault(kind, {})[status] = count
+
+    oldest_due = await db.scalar(select(func.min(job.run_after)).where(job.status == "queued", job.run_after <= utcnow()))
+    failures = (
+        await db.execute(
+            select(job.id, job.kind, job.attempts, job.last_error, job.finished_at)
+            .where(job.status == "failed")
+            .order_by(job.finished_at.desc())
+            .limit(recent_failures)
+        )
+    ).all()
+    return {
+        "counts": counts,
+        "by_kind": by_kind,
+        "oldest_due_job_waiting_seconds": (utcnow() - oldest_due.replace(tzinfo=UTC)).total_seconds() if oldest_due else 0,
+        "recent_failures": [failure._asdict() for failure in failures],
+    }
+
+
+async def retry_failed_job(db: AsyncSession, job_id: int) -> bool:
+    """Queue a failed job again, with a fresh set of attempts. Returns False if there is no such failed job."""
+    result = await db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "failed")
+        .values(status="queued", attempts=0, run_after=utcnow(), finished_at=None, locked_by=None)
+        .returning(models.Job.id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+# WORKER ###################################################
+class Worker:
+    """Claims due jobs and runs them, at most `concurrency` at a time."""
+
+    def __init__(self, session_factory: async_sessionmaker, settings: Settings, concurrency: int | None = None):
+        self.session_factory = session_factory
+        self.settings = settings
+        self.concurrency = concurrency or settings.jobs_concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._last_cleanup = float("-inf")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Run until stop() is called, then wait for the jobs in progress."""
+        logger.info("Job worker %s started (concurrency %d)", self.worker_id, self.concurrency)
+        while not self._stopping.is_set():
+            await self.maintenance()
+            claimed = await self.run_due_jobs()
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.settings.jobs_poll_interval_seconds)
+                except TimeoutError:
+                    pass
+        if self._running:
+            logger.info("Job worker stopping, waiting for %d running job(s)", len(self._running))
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def run_due_jobs(self) -> int:
+        """Claim as many due jobs as there are free slots and start them. Returns the number claimed."""
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            # Wait for a slot rather than polling the table
+            await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+            return 1
+        async with self.session_factory() as db:
+            jobs = await self.claim(db, free)
+        for job in jobs:
+            task = asyncio.create_task(self.execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        return len(jobs)
+
+    async def run_until_empty(self) -> None:
+        """Run jobs until none is due (for scripts and benchmarks)."""
+        while await self.run_due_jobs() or self._running:
+            if self._running:
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+
+    async def claim(self, db: AsyncSession, limit: int) -> list[Any]:
+        job = models.Job
+        now = utcnow()
+        due = (
+            select(job.id)
+            .where(job.status == "queued", job.run_after <= now)
+            .order_by(job.run_after, job.id)
+            .limit(limit)
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            # Concurrent workers skip the rows another one is claiming instead of waiting for them
+            due = due.with_for_update(skip_locked=True)
+        result = await db.execute(
+            update(job)
+            .where(job.id.in_(due.scalar_subquery()))
+            .values(status="running", attempts=job.attempts + 1, started_at=now, locked_by=self.worker_id)
+            .returning(job.id, job.kind, job.payload, job.attempts, job.max_attempts)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = result.all()
+        await db.commit()
+        return jobs
+
+    async def execute(self, job: Any) -> None:
+        function = _handlers.get(job.kind)
+        try:
+            if function is None:
+                raise PermanentJobError(f"No job handler registered for {job.kind!r}")
+            async with self.session_factory() as db:
+                await asyncio.wait_for(function(db, job.payload), self.settings.jobs_timeout_seconds)
+                await db.commit()
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            permanent = isinstance(exc, PermanentJobError) or job.attempts >= job.max_attempts
+            if permanent:
+                logger.error("Job %d (%s) failed after %d attempt(s): %s", job.id, job.kind, job.attempts, error)
+                await self.finish(job.id, status="failed", last_error=error)
+            else:
+                delay = retry_delay(job.attempts, self.settings)
+                logger.warning("Job %d (%s) failed, retrying in %.1fs: %s", job.id, job.kind, delay, error)
+                await self.finish(
+                    job.id, status="queued", last_error=error, run_after=utcnow() + timedelta(seconds=delay), finished_at=None
+                )
+        else:
+            await self.finish(job.id, status="succeeded", last_error=None)
+
+    async def finish(self, job_id: int, **values: Any) -> None:
+        values.setdefault("finished_at", utcnow())
+        async with self.session_factory() as db:
+            await db.execute(update(models.Job).where(models.Job.id == job_id).values(locked_by=None, **values))
+            await db.commit()
+
+    async def maintenance(self) -> None:
+        """Once a minute: requeue jobs abandoned by dead workers, delete old finished jobs."""
+        loop_time = asyncio.get_running_loop().time()
+        if loop_time - self._last_cleanup < 60:
+            return
+        self._last_cleanup = loop_time
+        job = models.Job
+        now = utcnow()
+        async with self.session_factory() as db:
+            # Twice the timeout: a live worker has cancelled its job by then
+            abandoned = await db.execute(
+                update(job)
+                .where(job.status == "running", job.started_at < now - timedelta(seconds=2 * self.settings.jobs_timeout_seconds))
+                .values(status="queued", run_after=now, locked_by=None, last_error="Abandoned by its worker")
+                .returning(job.id)
+            )
+            requeued = abandoned.scalars().all()
+            if requeued:
+                logger.warning("Requeued %d job(s) abandoned by a worker: %s", len(requeued), requeued)
+            await db.execute(
+                delete(job).where(
+                    or_(job.status == "succeeded", job.status == "failed"),
+                    job.finished_at < now - timedelta(hours=self.settings.jobs_retention_hours),
+                )
+            )
+            await db.commit()
+
+
+async def _stop_when_orphaned(worker: Worker) -> None:
+    # When the parent dies, the process is re-parented and getppid() changes
+    parent = os.getppid()
+    while os.getppid() == parent:
+        await asyncio.sleep(1)
+    worker.stop()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Run background jobs from the jobs table.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Jobs run at the same time (default: BLOG_JOBS_CONCURRENCY)")
+    parser.add_argument("--exit-with-parent", action="store_true", help="Stop when the parent process exits (used by serve.py)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from cache import cache
+    from database import AsyncSessionLocal, engine
+    from images import shutdown_image_pool
+    import tasks  # noqa: F401 - registers the handlers
+
+    worker = Worker(AsyncSessionLocal, get_settings(), args.concurrency)
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, worker.stop)
+
+    if args.exit_with_parent:
+        asyncio.create_task(_stop_when_orphaned(worker))
+
+    # Handlers invalidate cache tags. The bus carries the invalidations to the web workers (see pubsub.py).
+    await cache.bus.start(cache.apply_remote_invalidation)
+    try:
+        await worker.run()
+    finally:
+        await cache.bus.close()
+        shutdown_image_pool()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # Run the main() of the imported `jobs` module, the one tasks.py registers its handlers in (not this __main__ copy)
+    import jobs
+
+    asyncio.run(jobs.main())
@@ -0,0 +1,238 @@
+"""Live feed of post changes, as Server-Sent Events: GET /api/posts/stream.
+
+The post write paths publish an event once their change is committed:
+
+    await live.publish_post("post_created", row)
+
+and every client streaming the feed receives it:
+
+    id: 1760712345123-3f2a9c1d-42
+    event: post_created
+    data: {"title": "...", "id": 7, "user_id": 3, ..., "excerpt": "...", "reading_time_minutes": 2}
+
+One Broadcaster per worker process:
+- fans every event out to the subscribers' queues without waiting for any of them. The SSE frame
+  is encoded once and shared by all the subscribers.
+- a subscriber whose queue is full (BLOG_LIVE_QUEUE_SIZE events behind) is a slow consumer: it is
+  dropped and its stream ends. The client reconnects and resumes with Last-Event-ID.
+- keeps the last BLOG_LIVE_BUFFER_SIZE events in a ring buffer, replayed to a client reconnecting
+  with Last-Event-ID. If that event has left the buffer, the client gets a "reset" event instead:
+  it missed events, and should reload GET /api/posts.
+- with several workers, events travel between them over a bus (see pubsub.py), so the clients
+  of every worker see every write. Event ids are unique across workers: time, worker, counter.
+
+Events carry the fields of the post lists (the stored excerpt, no body), the full post is at /api/posts/{id}.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from config import Settings, get_settings
+from projections import LIST_FIELDS, post_item_serializer, row_to_item
+from pubsub import LocalBus, MessageBus, build_bus
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LiveEvent:
+    id: str
+    type: str
+    data: str  # JSON
+    frame: bytes  # The event as sent on the stream, encoded once for every subscriber
+
+    @classmethod
+    def create(cls, id: str, type: str, data: str) -> "LiveEvent":
+        return cls(id, type, data, f"id: {id}\nevent: {type}\ndata: {data}\n\n".encode())
+
+
+class Subscriber:
+    """One client's stream: a bounded queue of events. None in the queue ends the stream."""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue[LiveEvent | None] = asyncio.Queue(maxsize=queue_size)
+        self.backlog: list[LiveEvent] = []  # Missed events, sent before the queue (see Broadcaster.subscribe)
+        self.dropped = False
+
+    def close(self) -> None:
+        # Room for the end marker, whatever is still queued (the client resumes from what it received)
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class Broadcaster:
+    """
+    Fans the events of this worker (and, through the bus, of the others) out to the subscribers.
+
+    Args:
+        buffer_size: Recent events kept for the clients resuming with Last-Event-ID
+        queue_size: Events a subscriber may lag behind before it is dropped
+        max_subscribers: Beyond, subscribe() raises TooManySubscribersError
+    """
+
+    def __init__(self, buffer_size: int, queue_size: int, max_subscribers: int, bus: MessageBus | None = None):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.bus = bus or LocalBus()
+        self.buffer: deque[LiveEvent] = deque(maxlen=buffer_size)
+        self.subscribers: set[Subscriber] = set()
+        self.dropped_subscribers = 0
+        self.closed = False
+        self._origin = uuid.uuid4().hex[:8]
+        self._counter = itertools.count(1)
+
+    def _next_id(self) -> str:
+        # Milliseconds first, so ids from different workers still read in (roughly) chronological order
+        return f"{time.time_ns() // 1_000_000}-{self._origin}-{next(self._counter)}"
+
+    async def publish(self, type: str, data: str) -> LiveEvent:
+        """Send an event (`data` is JSON) to the subscribers of every worker. Call after the change is committed."""
+        event = LiveEvent.create(self._next_id(), type, data)
+        self.deliver(event)
+        await self.bus.publish({"id": event.id, "type": event.type, "data": event.data})
+        return event
+
+    def deliver(self, event: LiveEvent) -> None:
+        """Buffer the event and queue it for every subscriber of this worker, dropping the ones that can't keep up."""
+        self.buffer.append(event)
+        slow = []
+        for subscriber in self.subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                slow.append(subscriber)
+        for subscriber in slow:
+            self._drop(subscriber)
+        if slow:
+            logger.info("Dropped %d live feed subscriber(s) more than %d events behind", len(slow), self.queue_size)
+
+    def apply_remote_event(self, message: dict[str, Any]) -> None:
+        """An event published by another worker. The bus handler, see pubsub.py."""
+        self.deliver(LiveEvent.create(message["id"], message["type"], message["data"]))
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        subscriber.dropped = True
+        self.subscribers.discard(subscriber)
+        self.dropped_subscribers += 1
+        subscriber.close()
+
+    def missed_events(self, last_event_id: str) -> list[LiveEvent] | None:
+        """The buffered events after `last_event_id`, or None if it is no longer (or never was) in the buffer."""
+        for index in range(len(self.buffer) - 1, -1, -1):
+            if self.buffer[index].id == last_event_id:
+                return list(itertools.islice(self.buffer, index + 1, None))
+        return None
+
+    def subscribe(self, last_event_id: str | None = None) -> Subscriber:
+        """
+        Register a subscriber. Resuming after `last_event_id`, it starts with the buffered events it missed,
+        or with a "reset" event if they have left the buffer.
+
+        Raises:
+            TooManySubscribersError: If max_subscribers are already streaming, or the broadcaster is closed
+        """
+        if self.closed or len(self.subscribers) >= self.max_subscribers:
+            raise TooManySubscribersError()
+        subscriber = Subscriber(self.queue_size)
+        if last_event_id:
+            # Read in the same step as the subscription: a later event goes to the queue only, never to both
+            missed = self.missed_events(last_event_id)
+            if missed is None:
+                # Its id is the newest one here, the client resumes from it once it has reloaded the posts
+                subscriber.backlog = [LiveEvent.create(self.buffer[-1].id if self.buffer else "", "reset", "{}")]
+            else:
+                subscriber.backlog = missed
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: Subscriber, heartbeat_seconds: float, retry_ms: int) -> AsyncIterator[bytes]:
+        """
+        The SSE body of one subscriber: the missed events first, then the live ones until the stream is
+        closed (slow consumer, shutdown) or the client goes away.
+        """
+        try:
+            # How long EventSource waits before reconnecting
+            yield f"retry: {retry_ms}\n\n".encode()
+            for event in subscriber.backlog:
+                yield event.frame
+            subscriber.backlog = []
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), heartbeat_seconds)
+                except TimeoutError:
+                    # A comment line: keeps proxies from closing an idle connection
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event.frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def close(self) -> None:
+        """End every stream (on shutdown, so the requests can finish and the clients reconnect elsewhere)."""
+        self.closed = True
+        for subscriber in list(self.subscribers):
+            self.unsubscribe(subscriber)
+            subscriber.close()
+
+    def resume(self) -> None:
+        # Accept subscribers again (the app is started again in the same process, e.g. by tests)
+        self.closed = False
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "subscribers": len(self.subscribers),
+            "dropped_subscribers": self.dropped_subscribers,
+            "buffered_events": len(self.buffer),
+            "bus": self.bus.name,
+        }
+
+
+# PUBLISHING ###################################################
+async def publish_post(type: str, row: Any) -> None:
+    """
+    A post_created or post_updated event.
+
+    Args:
+        row: The post with its author, as returned by the write (see projections.post_returning_columns)
+    """
+    # Like the items of GET /api/posts. Without the bodies, events stay small enough for the bus (see pubsub.MAX_DATAGRAM_BYTES).
+    item = row_to_item(row, LIST_FIELDS)
+    await broadcaster.publish(type, post_item_serializer.dump_json(item).decode())
+
+
+async def publish_post_deleted(post_id: int, user_id: int) -> None:
+    await broadcaster.publish("post_deleted", json.dumps({"id": post_id, "user_id": user_id}))
+
+
+async def publish_posts_imported(count: int) -> None:
+    # One event for a whole bulk import: thousands of post_created would overflow every subscriber's queue
+    await broadcaster.publish("posts_imported", json.dumps({"count": count}))
+
+
+def build_broadcaster(settings: Settings) -> Broadcaster:
+    return Broadcaster(
+        settings.live_buffer_size,
+        settings.live_queue_size,
+        settings.live_max_subscribers,
+        build_bus(settings, "live:events"),
+    )
+
+
+broadcaster = build_broadcaster(get_settings())
@@ -1,84 +1,279 @@
 from fastapi import FastAPI, HTTPException, Request, status, Depends
 from contextlib import asynccontextmanager
 from typing import Annotated
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exception_handlers import (http_exception_handler, request_validation_exception_handler)
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 import models.models as models
-from database import Base, engine, get_db
+from jinja2 import FileSystemBytecodeCache
+from database import ReadYourWritesMiddleware, SchemaRevisionError, check_schema_revision, engine, get_read_db, is_replica_session, replicas
+from images import shutdown_image_pool
+from assets import CachedStaticFiles, asset_url, static_manifest
 from pathlib import Path
-from routers import users, posts
+from routers import admin, users, posts
+from cache import CacheBackend, get_cache, POSTS_LIST_TAG, post_tag, user_tag, user_posts_tag, user_stats_tag
+from cache import cache as response_cache
+from render_cache import FragmentCacheExtension, cache_page, fragment_cache, get_cached_page
+from pagination import DEFAULT_PAGE_SIZE, build_page, decode_cursor, paginate_posts
+from projections import WITHOUT_BODIES
+import search
+from config import db_pool_size_per_worker, get_settings
+from metrics import MetricsMiddleware, TimedTemplate, instrument_engine, metrics
+from drain import DrainMiddleware, in_flight
+from compression import CompressionMiddleware
+from live import broadcaster
+import admission
+from admission import AdmissionMiddleware
+from warmup import precompile_templates, prime_pool, readiness, warm_routes
 
 
-# Create the database tables
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    settings = get_settings()
+    readiness.reset()
+    # Startup - the schema is managed by migrations (alembic upgrade head), here we only confirm it's up to date
+    with readiness.phase("schema_check"):
+        await check_schema_revision(engine)
+        # A replica that can't be reached or isn't migrated yet starts out of rotation (retried later)
+        for index, replica_engine in enumerate(replicas.engines):
+            try:
+                await check_schema_revision(replica_engine)
+            except (SchemaRevisionError, DBAPIError, OSError) as exc:
+                replicas.mark_down(index, exc)
+    # Fingerprint the static files so templates can emit content-hashed, immutable URLs
+    with readiness.phase("static_manifest"):
+        static_manifest.build()
+    in_flight.resume()
+    # Receive the cache invalidations of the other workers (see pubsub.py)
+    await response_cache.bus.start(response_cache.apply_remote_invalidation)
+    # Live feed: accept streams again, and receive the events published by the other workers (see live.py)
+    broadcaster.resume()
+    await broadcaster.bus.start(broadcaster.apply_remote_event)
+    # Warm-up, so the first requests don't pay for it (see warmup.py)
+    with readiness.phase("templates"):
+        precompile_templates(templates.env)
+    if settings.warmup_enabled:
+        with readiness.phase("pool"):
+            connections = settings.warmup_connections or db_pool_size_per_worker(settings)[0]
+            await prime_pool(engine, connections)
+            for index, replica_engine in enumerate(replicas.engines):
+                try:
+                    await prime_pool(replica_engine, connections)
+                except (DBAPIError, OSError) as exc:
+                    replicas.mark_down(index, exc)
+        # Last: the requests run through everything set up above
+        with readiness.phase("requests"):
+            await warm_routes(app, settings.warmup_paths, settings.warmup_base_url)
+    readiness.mark_ready()
     yield
-    # Shutdown code can be added here if needed (e.g., closing database connections, cleaning up resources, etc.)
+    readiness.reset()
+    # Shutdown - the live feed streams never finish on their own: end them first, their clients reconnect
+    # to another worker and resume with Last-Event-ID
+    await broadcaster.close()
+    # Let the requests in flight finish before closing what they use (see drain.py)
+    await in_flight.drain(settings.shutdown_drain_timeout_seconds)
+    await broadcaster.bus.close()
+    await response_cache.bus.close()
+    shutdown_image_pool()
+    await replicas.dispose()
     await engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 
+# Per-request query count, SQL/render/serialization times -> Server-Timing header and /metrics
+settings = get_settings()
+instrument_engine(engine)
+for replica_engine in replicas.engines:
+    instrument_engine(replica_engine)
+app.add_middleware(
+    MetricsMiddleware,
+    query_count_threshold=settings.query_count_warning_threshold,
+    server_timing=settings.server_timing_enabled,
+)
+# With read replicas: a client that just wrote reads from the primary for a few seconds (see database.get_read_db)
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware, window_seconds=settings.read_your_writes_seconds)
+# Outside the metrics, so Server-Timing covers the handler and not the compression of its response
+if settings.compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+# Rate limits and load shedding, before any work is done for the request (see admission.py)
+app.add_middleware(
+    AdmissionMiddleware,
+    limiters=admission.limiters,
+    rate_limits=admission.build_rate_limits(settings),
+    rate_limiter=admission.rate_limiter,
+    queue_timeout=settings.admission_queue_timeout_seconds,
+)
+# Outermost, so that every request is counted until its response is fully sent
+app.add_middleware(DrainMiddleware)
+
 # Include routers
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(posts.router, prefix="/api/posts", tags=["posts"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 
 # Get the base directory (where main.py is located)
 BASE_DIR = Path(__file__).resolve().parent
 
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+app.mount("/static", CachedStaticFiles(directory=BASE_DIR / "static", manifest=static_manifest), name="static")
 
-app.mount("/media", StaticFiles(directory=str(BASE_DIR / "media")), name="media")
+# Media files are named after their content (see media.py) and never rewritten, so they can be cached forever.
+# With BLOG_MEDIA_BACKEND=s3 the pictures are served by the bucket instead (see storage.py).
+app.mount("/media", CachedStaticFiles(directory=BASE_DIR / "media", immutable=True), name="media")
 
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates.env.globals["asset_url"] = asset_url
+# Adds the render time of every page to the request's timings (see metrics.py)
+templates.env.template_class = TimedTemplate
+# {% cache %} tag for rendered fragments (post cards). Dropped together with the response cache entries on writes.
+templates.env.add_extension(FragmentCacheExtension)
+templates.env.fragment_cache = fragment_cache
+# Compiled templates kept on disk: a restarted worker loads them instead of compiling them (see warmup.py)
+if settings.template_cache_dir:
+    template_cache_dir = BASE_DIR / settings.template_cache_dir
+    template_cache_dir.mkdir(parents=True, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(str(template_cache_dir))
+response_cache.add_invalidation_listener(fragment_cache.invalidate_tags)
+
+# Prometheus metrics (scraped by the monitoring, not meant for visitors)
+@app.get("/metrics", include_in_schema=False, name="metrics")
+async def get_metrics(cache: Annotated[CacheBackend, Depends(get_cache)]):
+    body = metrics.render({"responses": cache.snapshot(), "fragments": fragment_cache.snapshot()}, admission.limiters)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+# Readiness probe for the load balancer: 200 once the worker has warmed up, 503 while it is shutting down
+# (draining requests get a 503 from DrainMiddleware before reaching this)
+@app.get("/ready", include_in_schema=False, name="ready")
+async def get_readiness():
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
 
 # Templates routes ###########################################
+
 # Home and Posts List
 
 ## home
 @app.get("/", include_in_schema=False, name="home")
 @app.get("/posts", include_in_schema=False, name="posts")
-async def home(request: Request, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.Post).options(selectinload(models.Post.author)))
-    posts = result.scalars().all()
-    return templates.TemplateResponse(
+async def home(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+    cursor: str | None = None,
+    q: str | None = None,
+):
+    # Search box submitted: show ranked matches instead of the feed
+    if q and q.strip():
+        try:
+            results = await search.search_posts(db, q[:200], cursor, DEFAULT_PAGE_SIZE)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page link")
+        more_url = (
+            str(request.url_for("home").include_query_params(q=q, cursor=results.next_cursor))
+            if results.next_cursor
+            else None
+        )
+        return templates.TemplateResponse(
+            request,
+            "home.html",
+            {"hits": results.hits, "query": q, "title": f"Search: {q[:50]}", "older_url": more_url, "newer_url": None},
+        )
+
+    cache_key = f"html:home:{cursor}"
+    cached = await get_cached_page(request, cache, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        page_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page link")
+
+    # The cards show the stored excerpt: the bodies stay in the database (raiseload: a template reading them fails loudly)
+    stmt = paginate_posts(
+        select(models.Post).options(selectinload(models.Post.author), *WITHOUT_BODIES), page_cursor, DEFAULT_PAGE_SIZE
+    )
+    result = await db.execute(stmt)
+    page = build_page(list(result.scalars().all()), page_cursor, DEFAULT_PAGE_SIZE)
+
+    # Links for the "Older posts" / "Newer posts" buttons at the bottom of the feed
+    home_url = request.url_for("home")
+    older_url = str(home_url.include_query_params(cursor=page.next_cursor)) if page.next_cursor else None
+    newer_url = str(home_url.include_query_params(cursor=page.prev_cursor)) if page.prev_cursor else None
+
+    response = templates.TemplateResponse(
         request,
         "home.html",
-        {"posts": posts, "title": "Home"},
+        {"posts": page.items, "title": "Home", "older_url": older_url, "newer_url": newer_url},
     )
+    tags = {POSTS_LIST_TAG}
+    for post in page.items:
+        tags.update((post_tag(post.id), user_tag(post.user_id)))
+    return await cache_page(request, cache, cache_key, response, tags, from_replica=is_replica_session(db))
 
 
 ## post_page
 @app.get("/posts/{post_id}", include_in_schema=False, name="post")
-async def post_page(request: Request, post_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+async def post_page(
+    request: Request,
+    post_id: int,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+):
+    cache_key = f"html:post:{post_id}"
+    cached = await get_cached_page(request, cache, cache_key)
+    if cached is not None:
+        return cached
+
     result = await db.execute(select(models.Post).options(selectinload(models.Post.author)).where(models.Post.id == post_id))
     post = result.scalars().first()
     if post:
         title = post.title[:50]
-        return templates.TemplateResponse(
+        response = templates.TemplateResponse(
             request,
             "post.html",
             {"post": post, "title": title},
         )
+        return await cache_page(
+            request, cache, cache_key, response, (post_tag(post.id), user_tag(post.user_id)), from_replica=is_replica_session(db)
+        )
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
 
 ## user_posts_page
+# The post count and latest activity come from the user's counters (user_stats), the posts are paginated like the feed
 @app.get("/users/{user_id}/posts", include_in_schema=False, name="user_posts")
 async def user_posts_page(
     request: Request,
     user_id: int,
-    db: Annotated[AsyncSession, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+    cursor: str | None = None,
 ):
+    cache_key = f"html:user_posts:{user_id}:{cursor}"
+    cached = await get_cached_page(request, cache, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        page_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page link")
+
+    # User.stats is a joined relationship: the counters come with the user, in the same query
     result = await db.execute(select(models.User).where(models.User.id == user_id))
     user = result.scalars().first()
     if not user:
@@ -87,13 +282,29 @@ async def user_posts_page(
             detail="User not found",
         )
 
-    result = await db.execute(select(models.Post).where(models.Post.user_id == user_id))
-    posts = result.scalars().all()
-    return templates.TemplateResponse(
+    # Post.author of every post is the user above, already in the session: no query for it
+    stmt = paginate_posts(select(models.Post).options(*WITHOUT_BODIES).where(models.Post.user_id == user_id), page_cursor, DEFAULT_PAGE_SIZE)
+    result = await db.execute(stmt)
+    page = build_page(list(result.scalars().all()), page_cursor, DEFAULT_PAGE_SIZE)
+
+    page_url = request.url_for("user_posts", user_id=user_id)
+    older_url = str(page_url.include_query_params(cursor=page.next_cursor)) if page.next_cursor else None
+    newer_url = str(page_url.include_query_params(cursor=page.prev_cursor)) if page.prev_cursor else None
+
+    response = templates.TemplateResponse(
         request,
         "user_posts.html",
-        {"posts": posts, "user": user, "title": f"{user.username}'s Posts"},
+        {
+            "posts": page.items,
+            "user": user,
+            "stats": user.stats,
+            "title": f"{user.username}'s Posts",
+            "older_url": older_url,
+            "newer_url": newer_url,
+        },
     )
+    tags = {user_tag(user_id), user_posts_tag(user_id), user_stats_tag(user_id), *(post_tag(post.id) for post in page.items)}
+    return await cache_page(request, cache, cache_key, response, tags, from_replica=is_replica_session(db))
 
 
 # StarletteHTTPException Handler
@@ -120,6 +331,8 @@ async def general_http_exception_handler(
             "message": message,
         },
         status_code=exception.status_code,
+        # e.g. Retry-After on the 429 and 503 of admission.py
+        headers=exception.headers,
     )
 
 
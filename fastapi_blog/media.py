@@ -0,0 +1,185 @@
+"""Profile picture files: content addressing, reference counts and garbage collection.
+
+An uploaded picture is stored under the SHA-256 of its content (storage.py decides where):
+
+    3f/a9/3fa9c1...e2.png          the picture (two levels of fan-out, so no directory grows huge)
+    3f/a9/3fa9c1...e2_64.webp      its thumbnails (see images.thumbnail_filename)
+
+- the same picture uploaded twice, or by two users, is stored once and gets its thumbnails once
+- a key names one content forever, so the files are served as immutable
+- the media_files table counts the users pointing at each picture. The upload adds a reference to
+  the new picture and releases the old one, in the transaction that changes users.image_file.
+- a picture left without references is deleted, with its thumbnails, by a media_gc job (see tasks.py)
+  BLOG_MEDIA_GC_GRACE_SECONDS later: pages cached until then still show it. If it is uploaded
+  again in the meantime, the job finds it referenced and leaves it.
+
+`python -m media sweep` cleans up what the jobs don't see: files without a media_files row (an
+upload that failed after storing its file) and pictures whose job was lost, once older than the
+grace period. `--dry-run` only lists them.
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models.models as models
+from images import THUMBNAIL_SIZES, thumbnail_filename
+from storage import MediaStorage
+
+logger = logging.getLogger(__name__)
+
+media_files = models.MediaFile.__table__
+
+
+def content_key(digest: str, extension: str) -> str:
+    """
+    Key of a picture, from the hex SHA-256 of its content and its extension.
+
+    Example:
+        content_key("3fa9c1...e2", ".png") -> "3f/a9/3fa9c1...e2.png"
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def image_keys(key: str) -> list[str]:
+    """The picture and its thumbnails."""
+    return [key, *(thumbnail_filename(key, size) for size in THUMBNAIL_SIZES)]
+
+
+# REFERENCES ###################################################
+async def add_reference(db: AsyncSession, key: str, size: int | None = None) -> None:
+    """One more user of the picture stored under `key` (registered on its first use)."""
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(media_files).values(key=key, refcount=1, size=size, created_at=models.utcnow())
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[media_files.c.key],
+            # A picture waiting for its garbage collection is back in use
+            set_={"refcount": media_files.c.refcount + 1, "orphaned_at": None},
+        )
+    )
+
+
+async def release_reference(db: AsyncSession, key: str) -> bool:
+    """
+    One user less for the picture stored under `key`.
+
+    Returns:
+        True if that was the last one: the caller schedules its garbage collection (see tasks.enqueue_media_gc)
+    """
+    result = await db.execute(
+        update(media_files)
+        .where(media_files.c.key == key, media_files.c.refcount > 0)
+        .values(
+            refcount=media_files.c.refcount - 1,
+            orphaned_at=case((media_files.c.refcount == 1, models.utcnow()), else_=None),
+        )
+        .returning(media_files.c.refcount)
+    )
+    return result.scalar_one_or_none() == 0
+
+
+# GARBAGE COLLECTION ###################################################
+async def collect(db: AsyncSession, storage: MediaStorage, key: str, grace_seconds: float) -> bool:
+    """
+    Delete the picture stored under `key` and its thumbnails, if it has had no reference for `grace_seconds`.
+
+    The row is deleted first and committed last: if the files can't be deleted, the row stays and the
+    job is retried. An upload of the same picture meanwhile waits for the row lock, then registers it
+    again and stores the file again (see routers/users.py).
+
+    Returns:
+        True if the files were deleted
+    """
+    cutoff = models.utcnow() - timedelta(seconds=grace_seconds)
+    result = await db.execute(
+        delete(media_files)
+        .where(media_files.c.key == key, media_files.c.refcount == 0, media_files.c.orphaned_at <= cutoff)
+        .returning(media_files.c.key)
+    )
+    if result.scalar_one_or_none() is None:
+        # In use again, not orphaned long enough, or already collected
+        await db.rollback()
+        return False
+    await storage.delete(*image_keys(key))
+    await db.commit()
+    return True
+
+
+async def sweep(db: AsyncSession, storage: MediaStorage, grace_seconds: float, dry_run: bool = False) -> dict[str, int]:
+    """
+    Delete the orphaned pictures whose media_gc job never ran, and the stored files nothing knows about.
+    Only files older than `grace_seconds`, so uploads in progress are left alone.
+
+    Returns:
+        How many pictures and stray files were deleted (or would be, with dry_run)
+    """
+    cutoff = models.utcnow() - timedelta(seconds=grace_seconds)
+    orphaned = (
+        await db.execute(select(media_files.c.key).where(media_files.c.refcount == 0, media_files.c.orphaned_at <= cutoff))
+    ).scalars().all()
+    collected = 0
+    for key in orphaned:
+        if dry_run:
+            logger.info("Would collect %s", key)
+            collected += 1
+        elif await collect(db, storage, key, grace_seconds):
+            collected += 1
+
+    # Known pictures, plus the ones users point at (whatever the table says)
+    known = set((await db.execute(select(media_files.c.key))).scalars())
+    known.update((await db.execute(select(models.User.image_file).where(models.User.image_file.is_not(None)))).scalars())
+    kept = {image_key for key in known for image_key in image_keys(key)}
+    stray = [file.key for file in await storage.list_files() if file.key not in kept and file.modified <= cutoff]
+    for key in stray:
+        logger.info("%s stray file %s", "Would delete" if dry_run else "Deleting", key)
+    if stray and not dry_run:
+        await storage.delete(*stray)
+    return {"collected": collected, "stray_files": len(stray)}
+
+
+async def usage(db: AsyncSession) -> dict[str, Any]:
+    """Stored pictures, references to them, and the bytes saved by storing identical uploads once."""
+    row = (
+        await db.execute(
+            select(
+                func.count(),
+                func.coalesce(func.sum(media_files.c.refcount), 0),
+                func.count().filter(media_files.c.refcount == 0),
+                func.coalesce(func.sum(media_files.c.size), 0),
+                func.coalesce(func.sum((media_files.c.refcount - 1) * media_files.c.size).filter(media_files.c.refcount > 1), 0),
+            )
+        )
+    ).one()
+    return {"files": row[0], "references": row[1], "orphaned": row[2], "bytes": row[3], "deduplicated_bytes": row[4]}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Delete unused profile picture files.")
+    parser.add_argument("command", choices=["sweep"])
+    parser.add_argument("--grace-seconds", type=float, default=None, help="Only older files (default: BLOG_MEDIA_GC_GRACE_SECONDS)")
+    parser.add_argument("--dry-run", action="store_true", help="List what would be deleted, delete nothing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from config import get_settings
+    from database import AsyncSessionLocal, engine
+    from storage import media_storage
+
+    grace_seconds = args.grace_seconds if args.grace_seconds is not None else get_settings().media_gc_grace_seconds
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await sweep(db, media_storage, grace_seconds, args.dry_run)
+        print(f"{'would delete' if args.dry_run else 'deleted'} {result['collected']} orphaned picture(s) and {result['stray_files']} stray file(s)")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
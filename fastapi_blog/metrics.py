@@ -0,0 +1,344 @@
+"""Per-request performance instrumentation.
+
+For every HTTP request the middleware collects:
+
+- the number of SQL queries and the time spent running them (engine events)
+- the time spent waiting for a pooled connection (session events)
+- the time spent rendering templates (a timed Jinja2 Template class)
+- the time spent serializing response bodies (`with timed("serialize"):` around dump_json calls)
+
+The numbers go out in two places:
+
+- a `Server-Timing` header on the response, visible in the browser dev tools:
+      Server-Timing: db;dur=3.1;desc="4 queries", pool;dur=0.1, render;dur=5.2, serialize;dur=0.4, total;dur=9.9
+- the Prometheus text format served at /metrics: latency histograms per route name, queries per
+  request, pool checkout wait, requests over the query threshold and the cache counters
+
+Requests running more queries than BLOG_QUERY_COUNT_WARNING_THRESHOLD are logged with a warning,
+which is usually the first sign of an N+1 pattern (a query per row instead of one query for the page).
+
+The metrics are kept per process: with several workers, each one reports its own numbers.
+"""
+
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+# Queries per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Fields of the cache snapshots that only ever grow
+CACHE_COUNTERS = ("hits", "misses", "evictions", "invalidations")
+# Fields of the admission snapshots (see admission.ConcurrencyLimiter.snapshot)
+ADMISSION_FIELDS = (
+    ("admitted", "counter", "Requests let through, by route class"),
+    ("shed", "counter", "Requests turned away with a 503 after waiting too long for a slot, by route class"),
+    ("rate_limited", "counter", "Requests turned away with a 429 by the per-client rate limit, by route class"),
+    ("running", "gauge", "Requests running, by route class"),
+    ("waiting", "gauge", "Requests waiting for a slot, by route class"),
+    ("concurrency", "gauge", "Concurrency limit, by route class (0 = no limit)"),
+)
+
+
+# PER REQUEST TIMINGS ###################################################
+@dataclass
+class RequestTimings:
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    render_seconds: float = 0.0
+    serialize_seconds: float = 0.0
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Format the timings as a Server-Timing header value (durations in milliseconds)."""
+        return ", ".join(
+            (
+                f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_queries} queries"',
+                f"pool;dur={self.pool_wait_seconds * 1000:.2f}",
+                f"render;dur={self.render_seconds * 1000:.2f}",
+                f"serialize;dur={self.serialize_seconds * 1000:.2f}",
+                f"total;dur={total_seconds * 1000:.2f}",
+            )
+        )
+
+
+# Timings of the request being handled. Set by the middleware; None outside of a request (startup, scripts).
+_current_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> RequestTimings | None:
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(part: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to one part of the current request's timings.
+
+    Example:
+        with timed("serialize"):
+            body = serializer.dump_json(payload)
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = f"{part}_seconds"
+        setattr(timings, attribute, getattr(timings, attribute) + time.perf_counter() - start)
+
+
+# PROMETHEUS ###################################################
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.request_latency: dict[tuple[str, str], Histogram] = {}  # (route, method) -> seconds
+        self.request_queries: dict[str, Histogram] = {}  # route -> queries per request
+        self.requests: dict[tuple[str, str, int], int] = {}  # (route, method, status) -> count
+        self.query_threshold_exceeded: dict[str, int] = {}  # route -> count
+        self.pool_wait = Histogram(POOL_WAIT_BUCKETS)
+
+    def observe_request(self, route: str, method: str, status_code: int, seconds: float, timings: RequestTimings) -> None:
+        self.request_latency.setdefault((route, method), Histogram(LATENCY_BUCKETS)).observe(seconds)
+        self.request_queries.setdefault(route, Histogram(QUERY_COUNT_BUCKETS)).observe(timings.db_queries)
+        key = (route, method, status_code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def observe_query_threshold_exceeded(self, route: str) -> None:
+        self.query_threshold_exceeded[route] = self.query_threshold_exceeded.get(route, 0) + 1
+
+    def render(self, caches: dict[str, dict[str, Any]] | None = None, admission: dict[str, Any] | None = None) -> str:
+        """
+        Render every metric as Prometheus text.
+
+        Args:
+            caches: Cache snapshots by cache name (see CacheBackend.snapshot), exported as counters and gauges
+            admission: Concurrency limiters by route class (see admission.limiters): queue wait, admitted and shed requests
+        """
+        lines: list[str] = []
+
+        self._render_histograms(
+            lines,
+            "blog_request_duration_seconds",
+            "Time to handle a request, by route name",
+            {(("route", route), ("method", method)): histogram for (route, method), histogram in self.request_latency.items()},
+        )
+        self._render_histograms(
+            lines,
+            "blog_request_db_queries",
+            "SQL queries run per request, by route name",
+            {(("route", route),): histogram for route, histogram in self.request_queries.items()},
+        )
+        self._render_histograms(
+            lines,
+            "blog_db_pool_wait_seconds",
+            "Time spent waiting for a database connection from the pool",
+            {(): self.pool_wait},
+        )
+
+        lines += ["# HELP blog_requests_total Requests handled, by route name and status", "# TYPE blog_requests_total counter"]
+        for (route, method, status_code), count in sorted(self.requests.items()):
+            lines.append(f"blog_requests_total{_labels({'route': route, 'method': method, 'status': status_code})} {count}")
+
+        lines += [
+            "# HELP blog_requests_query_threshold_exceeded_total Requests that ran more SQL queries than the threshold",
+            "# TYPE blog_requests_query_threshold_exceeded_total counter",
+        ]
+        for route, count in sorted(self.query_threshold_exceeded.items()):
+            lines.append(f"blog_requests_query_threshold_exceeded_total{_labels({'route': route})} {count}")
+
+        if admission:
+            self._render_histograms(
+                lines,
+                "blog_admission_queue_wait_seconds",
+                "Time requests waited for a concurrency slot, by route class",
+                {(("class", name),): limiter.queue_wait for name, limiter in admission.items()},
+            )
+            for field, kind, help_text in ADMISSION_FIELDS:
+                metric = f"blog_admission_{field}_total" if kind == "counter" else f"blog_admission_{field}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+                for name, limiter in sorted(admission.items()):
+                    lines.append(f"{metric}{_labels({'class': name})} {limiter.snapshot()[field]}")
+
+        # Every numeric field of the snapshots becomes one metric with a "cache" label
+        samples: dict[str, list[str]] = {}
+        for cache_name, snapshot in (caches or {}).items():
+            for name, value in snapshot.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                samples.setdefault(name, []).append(f"{_labels({'cache': cache_name})} {value}")
+        for name, values in samples.items():
+            # hits/misses/... only ever grow, entries/bytes go up and down
+            if name in CACHE_COUNTERS:
+                metric, kind = f"blog_cache_{name}_total", "counter"
+            else:
+                metric, kind = f"blog_cache_{name}", "gauge"
+            lines.append(f"# TYPE {metric} {kind}")
+            lines += [f"{metric}{value}" for value in values]
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines: list[str], name: str, help_text: str, histograms: dict[tuple, Histogram]) -> None:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for label_pairs, histogram in sorted(histograms.items()):
+            labels = dict(label_pairs)
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+metrics = Metrics()
+
+
+# INSTRUMENTATION HOOKS ###################################################
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Count the queries run on this engine, and time them, for the request that runs them."""
+
+    # The sync events run inside SQLAlchemy's greenlet, which shares the request's contextvars
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start_times"].pop()
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.db_queries += 1
+            timings.db_seconds += time.perf_counter() - start
+
+
+# A session asks the pool for a connection right after it starts its transaction, and gets it
+# just before `after_begin`. The gap between the two is the time spent waiting for the pool.
+@event.listens_for(Session, "after_transaction_create")
+def _session_transaction_created(session, transaction):
+    if transaction.parent is None:
+        session.info["transaction_started_at"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_begin")
+def _session_connection_acquired(session, transaction, connection):
+    started_at = session.info.pop("transaction_started_at", None)
+    if started_at is None:
+        return
+    waited = time.perf_counter() - started_at
+    metrics.pool_wait.observe(waited)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.pool_wait_seconds += waited
+
+
+class TimedTemplate(Template):
+    """Jinja2 template that adds its render time to the current request. Set as `env.template_class`."""
+
+    def render(self, *args, **kwargs) -> str:
+        with timed("render"):
+            return super().render(*args, **kwargs)
+
+
+# MIDDLEWARE ###################################################
+def route_name(scope: Scope) -> str:
+    # The route matched by the router (a name, never the raw path, to keep the number of series bounded)
+    route = scope.get("route")
+    if getattr(route, "name", None):
+        return route.name
+    # Mounted apps (static files, media) are labelled with the path they're mounted at
+    if scope.get("endpoint") is not None and scope.get("root_path"):
+        return scope["root_path"]
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that collects the timings of each request and records them.
+
+    Args:
+        query_count_threshold: Log a warning for requests running more queries than this (0 disables it)
+        server_timing: Add the Server-Timing header to responses
+    """
+
+    def __init__(self, app: ASGIApp, query_count_threshold: int = 0, server_timing: bool = True):
+        self.app = app
+        self.query_count_threshold = query_count_threshold
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timings(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current_timings.reset(token)
+            route = route_name(scope)
+            metrics.observe_request(route, scope["method"], status_code, time.perf_counter() - start, timings)
+            if self.query_count_threshold and timings.db_queries > self.query_count_threshold:
+                metrics.observe_query_threshold_exceeded(route)
+                logger.warning(
+                    "%s %s (route %s) ran %d SQL queries (threshold %d), possible N+1",
+                    scope["method"],
+                    scope["path"],
+                    route,
+                    timings.db_queries,
+                    self.query_count_threshold,
+                )
@@ -0,0 +1,64 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.engine import Connection
+
+import models.models  # noqa: F401 - registers the models on Base.metadata for autogenerate
+from config import get_settings
+from database import Base, build_engine
+from search import SEARCH_TABLE_PREFIXES
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def include_name(name, type_, parent_names) -> bool:
+    # The full-text search tables are managed by hand in migrations, not by the models
+    if type_ == "table" and name is not None and name.startswith(SEARCH_TABLE_PREFIXES):
+        return False
+    return True
+
+
+def run_migrations_offline() -> None:
+    """Emit the migration SQL to stdout instead of running it ('alembic upgrade head --sql')."""
+    context.configure(
+        url=get_settings().database_url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+        include_name=include_name,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    # render_as_batch lets ALTER TABLE style migrations work on SQLite (table is copied and swapped)
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=True,
+        include_name=include_name,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online() -> None:
+    # Same engine setup as the app (pragmas, pool), so migrations see the database exactly like the app does
+    engine = build_engine(get_settings())
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
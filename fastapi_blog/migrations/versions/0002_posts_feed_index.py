@@ -0,0 +1,41 @@
+"""Composite (date_posted, id) index for keyset pagination of the feed
+
+Built online: CREATE INDEX CONCURRENTLY on Postgres, so writes to posts are not
+blocked while it builds. SQLite has no concurrent build, but in WAL mode readers
+keep working while the index is created.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from typing import Sequence
+
+from alembic import op
+
+
+revision: str = "0002"
+down_revision: str | Sequence[str] | None = "0001"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction, so step out of the migration transaction for it
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_posts_date_posted_id",
+            "posts",
+            ["date_posted", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_posts_date_posted_id",
+            table_name="posts",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,44 @@
+"""Full-text search index for posts
+
+SQLite: FTS5 virtual table posts_fts (rowid = posts.id).
+Postgres: posts_search table with a weighted tsvector per post and a GIN index.
+Both are filled from the existing posts here and kept in sync by the app (see search.py).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from typing import Sequence
+
+from alembic import op
+
+
+revision: str = "0004"
+down_revision: str | Sequence[str] | None = "0003"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "CREATE TABLE posts_search ("
+            "post_id INTEGER PRIMARY KEY REFERENCES posts (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        )
+        op.execute(
+            "INSERT INTO posts_search (post_id, document) "
+            "SELECT id, setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B') "
+            "FROM posts"
+        )
+        op.execute("CREATE INDEX ix_posts_search_document ON posts_search USING GIN (document)")
+    else:
+        op.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(title, content, tokenize = 'porter unicode61')")
+        op.execute("INSERT INTO posts_fts (rowid, title, content) SELECT id, title, content FROM posts")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TABLE posts_search")
+    else:
+        op.execute("DROP TABLE posts_fts")
@@ -0,0 +1,38 @@
+"""Denormalized per-user post counters (user_stats)
+
+Filled from the existing posts here, then kept up to date by the app (see user_stats.py).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0005"
+down_revision: str | Sequence[str] | None = "0004"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("post_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_posted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("total_content_chars", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.execute(
+        "INSERT INTO user_stats (user_id, post_count, last_posted_at, total_content_chars) "
+        "SELECT user_id, COUNT(*), MAX(date_posted), SUM(LENGTH(content)) FROM posts GROUP BY user_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_stats")
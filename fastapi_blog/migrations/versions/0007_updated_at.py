@@ -0,0 +1,52 @@
+"""Row versions: updated_at on posts, users and user_stats
+
+The API derives its ETag and Last-Modified headers from them (see conditional.py).
+Existing posts get their date_posted, the other rows the time of the migration.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from datetime import UTC, datetime
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0007"
+down_revision: str | Sequence[str] | None = "0006"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = ("posts", "users", "user_stats")
+
+
+def upgrade() -> None:
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    for table_name in TABLES:
+        if sqlite:
+            # SQLite only adds a NOT NULL column with a constant default, and making it NOT NULL later means
+            # copying the tables, which the foreign keys to users don't allow. The placeholder is overwritten below.
+            column = sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default="1970-01-01 00:00:00.000000")
+        else:
+            column = sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True)
+        op.add_column(table_name, column)
+
+    now = datetime.now(UTC)
+    for table_name in TABLES:
+        table = sa.table(table_name, sa.column("updated_at", sa.DateTime(timezone=True)))
+        if table_name == "posts":
+            op.execute(table.update().values(updated_at=sa.literal_column("date_posted")))
+        else:
+            op.execute(table.update().values(updated_at=now))
+
+    if not sqlite:
+        for table_name in TABLES:
+            op.alter_column(table_name, "updated_at", existing_type=sa.DateTime(timezone=True), nullable=False)
+
+
+def downgrade() -> None:
+    # Plain ALTER TABLE ... DROP COLUMN (SQLite >= 3.35), no batch copy of the tables
+    for table_name in TABLES:
+        op.drop_column(table_name, "updated_at")
@@ -0,0 +1,48 @@
+"""Reference-counted profile picture files (media_files)
+
+Pictures already in use get a row with one reference per user. Their files keep their old
+names (e.g. "930a4eaa_test.jpg"), new uploads are stored under the hash of their content.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from datetime import UTC, datetime
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0008"
+down_revision: str | Sequence[str] | None = "0007"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    media_files = op.create_table(
+        "media_files",
+        sa.Column("key", sa.String(length=200), nullable=False),
+        sa.Column("refcount", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("orphaned_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index(op.f("ix_media_files_orphaned_at"), "media_files", ["orphaned_at"])
+
+    users = sa.table("users", sa.column("image_file", sa.String()))
+    op.execute(
+        media_files.insert().from_select(
+            ["key", "refcount", "created_at"],
+            sa.select(users.c.image_file, sa.func.count(), sa.literal(datetime.now(UTC), sa.DateTime(timezone=True)))
+            .where(users.c.image_file.is_not(None))
+            .group_by(users.c.image_file),
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_media_files_orphaned_at"), table_name="media_files")
+    op.drop_table("media_files")
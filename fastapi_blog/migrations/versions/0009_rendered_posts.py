@@ -0,0 +1,50 @@
+"""Rendered post bodies: content_html, excerpt, reading_time_minutes, render_version on posts
+
+Filled by the write paths from now on (see rendering.py). Existing posts get a provisional
+excerpt (the start of their Markdown) here, and their rendering from the backfill, to run
+after the upgrade:
+
+    python -m rendering
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0009"
+down_revision: str | Sequence[str] | None = "0008"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+COLUMNS = ("content_html", "excerpt", "reading_time_minutes", "render_version")
+
+# rendering.EXCERPT_CHARS (not imported: a migration must keep doing what it did when it was written)
+EXCERPT_CHARS = 300
+
+
+def upgrade() -> None:
+    op.add_column("posts", sa.Column("content_html", sa.Text(), nullable=True))
+    op.add_column("posts", sa.Column("excerpt", sa.Text(), nullable=True))
+    op.add_column("posts", sa.Column("reading_time_minutes", sa.Integer(), nullable=True))
+    op.add_column("posts", sa.Column("render_version", sa.Integer(), nullable=True))
+
+    posts = sa.table("posts", sa.column("content", sa.Text()), sa.column("excerpt", sa.Text()))
+    op.execute(
+        posts.update().values(
+            excerpt=sa.case(
+                (sa.func.length(posts.c.content) > EXCERPT_CHARS, sa.func.substr(posts.c.content, 1, EXCERPT_CHARS - 1, type_=sa.Text()) + "…"),
+                else_=posts.c.content,
+            )
+        )
+    )
+
+
+def downgrade() -> None:
+    # Plain ALTER TABLE ... DROP COLUMN (SQLite >= 3.35), no batch copy of the table
+    for column in reversed(COLUMNS):
+        op.drop_column("posts", column)
@@ -1,12 +1,36 @@
 # Needed for forward references in type hints (e.g., User and Post referencing each other) for earlier Python versions. In Python 3.10+, this is not strictly necessary, but it can still be useful for clarity.
 from __future__ import annotations
 
+import hashlib
 from datetime import UTC, datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import JSON, Boolean, DateTime, ForeignKey, Index, Integer, String, Text, false
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database import Base
+from images import THUMBNAIL_SIZES, thumbnail_filename
+from assets import static_manifest
+from storage import media_storage
+
+
+def profile_image_path(image_file: str | None) -> str:
+    """URL of a profile picture. Shared by User.image_path and the lean list queries (see projections.py)."""
+    if image_file:
+        return media_storage.url(image_file)
+    # Content-hashed URL, so the default avatar shown on every page is cached by browsers for good
+    return f"/static/{static_manifest.hashed_path('profile_pics/default.png')}"
+
+
+def utcnow() -> datetime:
+    return datetime.now(UTC)
+
+
+def updated_at_column() -> Mapped[datetime]:
+    """
+    Version of a row: set on INSERT, bumped on every UPDATE (onupdate also fires for Core update() statements).
+    The API's ETag and Last-Modified headers are derived from it (see conditional.py).
+    """
+    return mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
 
 
 class User(Base):
@@ -20,20 +44,75 @@ class User(Base):
         nullable=True,
         default=None,
     )
+    # True once WebP thumbnails have been generated for image_file (pictures uploaded before thumbnails existed have none)
+    image_has_thumbnails: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false(), nullable=False)
+    updated_at: Mapped[datetime] = updated_at_column()
 
     # One-to-many relationship with Post. User linked to the author field in Post
     posts: Mapped[list[Post]] = relationship(back_populates="author", cascade="all, delete-orphan")
+    # Counters kept up to date by the post write paths (None until the user's first post). Joined, so it never costs a query of its own.
+    stats: Mapped[UserStats | None] = relationship(lazy="joined", cascade="all, delete-orphan")
 
     # This is a computed property and not a column in the database.
     @property
     def image_path(self) -> str:
-        if self.image_file:
-            return f"/media/profile_pics/{self.image_file}"
-        return "/static/profile_pics/default.png"
+        return profile_image_path(self.image_file)
+
+    def image_path_for(self, size: int) -> str:
+        """
+        URL of the smallest thumbnail that is at least `size` pixels wide, so templates
+        don't ship the full-size original to show a 40px avatar.
+
+        Falls back to the original image when there are no thumbnails.
+        """
+        if not self.image_file or not self.image_has_thumbnails:
+            return self.image_path
+        thumbnail_size = next((s for s in THUMBNAIL_SIZES if s >= size), THUMBNAIL_SIZES[-1])
+        return media_storage.url(thumbnail_filename(self.image_file, thumbnail_size))
+
+    @property
+    def image_version(self) -> str:
+        # Changes whenever the avatar changes. Part of the template fragment cache keys (see render_cache.py).
+        return f"{self.image_file}:{self.image_has_thumbnails}"
+
+
+class UserStats(Base):
+    """
+    Per-user counters, denormalized from the posts table so pages can show them without COUNT/MAX/SUM over posts.
+
+    Updated in the same transaction as every post write (see user_stats.py). `python -m user_stats`
+    rebuilds the whole table from the posts, in case it ever drifts.
+    """
+
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    post_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    last_posted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    total_content_chars: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    updated_at: Mapped[datetime] = updated_at_column()
+
+
+class MediaFile(Base):
+    """
+    A stored profile picture (see media.py): how many users point at it, and since when nobody does.
+
+    The file is deleted, with its thumbnails, once refcount has been 0 for BLOG_MEDIA_GC_GRACE_SECONDS.
+    """
+
+    __tablename__ = "media_files"
+
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)  # Same as users.image_file
+    refcount: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    size: Mapped[int | None] = mapped_column(Integer, nullable=True)  # Bytes (unknown for pictures uploaded before this table)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
+    orphaned_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, index=True)  # When refcount dropped to 0
 
 
 class Post(Base):
     __tablename__ = "posts"
+    # Composite index backing keyset pagination of the feed (see pagination.py)
+    __table_args__ = (Index("ix_posts_date_posted_id", "date_posted", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     title: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -47,7 +126,46 @@ class Post(Base):
         DateTime(timezone=True),
         default=lambda: datetime.now(UTC),
     )
+    updated_at: Mapped[datetime] = updated_at_column()
+    # Rendered from content on every write (see rendering.py). NULL for posts written before, until `python -m rendering` has run.
+    content_html: Mapped[str | None] = mapped_column(Text, nullable=True)  # Sanitized HTML
+    excerpt: Mapped[str | None] = mapped_column(Text, nullable=True)  # Plain text, what the lists show instead of the content
+    reading_time_minutes: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    render_version: Mapped[int | None] = mapped_column(Integer, nullable=True)  # rendering.RENDER_VERSION of the stored rendering
 
     # Many-to-one relationship with User. Post linked to the posts field in User
     author: Mapped[User] = relationship(back_populates="posts")
 
+    @property
+    def updated_marker(self) -> str:
+        # Changes whenever the fields shown by the post cards change. Part of the template fragment cache keys (see render_cache.py).
+        # Not the content: the lists don't load it.
+        # A digest, not hash(): string hashes are salted per process, this is the same in every worker and after a restart
+        card = "\x1f".join((self.title, self.excerpt or "", str(self.reading_time_minutes)))
+        return hashlib.blake2b(card.encode(), digest_size=8).hexdigest()
+
+
+class Job(Base):
+    """
+    A background job: a slow side effect of a request, run later by the job worker (see jobs.py).
+
+    Stored in the database so queued jobs survive restarts, and are enqueued in the same
+    transaction as the change that needs them.
+    """
+
+    __tablename__ = "jobs"
+    # The worker claims the oldest due jobs: WHERE status = 'queued' AND run_after <= now ORDER BY run_after
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(100), nullable=False)  # Name of the handler, e.g. "profile_thumbnails"
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="queued", server_default="queued", nullable=False)  # queued, running, succeeded, failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False)
+    run_after: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)  # Not before (retries are pushed back)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    locked_by: Mapped[str | None] = mapped_column(String(200), nullable=True)  # Worker running it ("host:pid")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
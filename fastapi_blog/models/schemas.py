@@ -1,5 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel,EmailStr, ConfigDict,Field
+from typing import Any
+from pydantic import BaseModel,EmailStr, ConfigDict,Field, field_validator
 
 # USERS ###################################################
 class User(BaseModel):
@@ -10,7 +11,7 @@ class UserCreate(User):
     pass
 # TODO: add password field to UserCreate and handle hashing in the endpoint logic
 
-class UserResponse(User):
+class AuthorResponse(User):
     # TODO: exclude email from UserResponse if we don't want to expose it in API responses
     # 'model_config' -> Enables Pydantic to read data from SQLAlchemy models directly, allowing us to return SQLAlchemy model instances in our API responses without needing to convert them to Python dictionaries first.
     model_config = ConfigDict(from_attributes=True)
@@ -18,6 +19,22 @@ class UserResponse(User):
     image_file: str | None
     image_path: str
 
+class UserStatsResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    post_count: int = 0
+    last_posted_at: datetime | None = None
+    total_content_chars: int = 0
+
+# The author embedded in posts is an AuthorResponse, so post listings don't carry the stats of every author
+class UserResponse(AuthorResponse):
+    stats: UserStatsResponse = Field(default_factory=UserStatsResponse)
+
+    @field_validator("stats", mode="before")
+    @classmethod
+    def no_stats_yet(cls, value: Any) -> Any:
+        # Users without posts have no user_stats row
+        return UserStatsResponse() if value is None else value
+
 class UserUpdate(BaseModel):
     email: EmailStr | None = Field(default=None, max_length=120)    
 
@@ -39,5 +56,62 @@ class PostResponse(Post):
     id: int
     user_id: int
     date_posted: datetime
-    author: UserResponse
+    author: AuthorResponse
+    # Rendered from content when the post is written (None for older posts until the backfill has run)
+    content_html: str | None = None  # Sanitized HTML of the Markdown content
+    excerpt: str | None = None  # Plain text. The lists ship it instead of content and content_html.
+    reading_time_minutes: int | None = None
+
+# A post in the search results: the excerpt and reading time, never the bodies
+class PostSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    title: str
+    id: int
+    user_id: int
+    date_posted: datetime
+    author: AuthorResponse
+    excerpt: str | None = None
+    reading_time_minutes: int | None = None
+
+# A post in the lists (see projections.py). fields= picks the fields returned (by default projections.LIST_FIELDS:
+# all but the bodies), so any of them can be missing from an item. Same order as PostResponse.
+class PostListItem(BaseModel):
+    title: str | None = None
+    content: str | None = None
+    id: int | None = None
+    user_id: int | None = None
+    date_posted: datetime | None = None
+    author: AuthorResponse | None = None
+    content_html: str | None = None
+    excerpt: str | None = None
+    reading_time_minutes: int | None = None
+
+
+class BulkImportError(BaseModel):
+    line: int
+    detail: Any  # A message, or a list of validation errors like in 422 responses
+
+class BulkImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[BulkImportError]
+
+
+class PostSearchHit(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    post: PostSummary
+    rank: float  # Lower is a better match
+    snippet: str  # HTML-escaped excerpt, matched terms wrapped in <mark>
+
+class PostSearchPage(BaseModel):
+    items: list[PostSearchHit]
+    next_cursor: str | None
+    next: str | None
 
+class PostPage(BaseModel):
+    # A single page of the cursor-paginated feed. The cursors are opaque, clients just pass them back as '?cursor='
+    items: list[PostListItem]
+    next_cursor: str | None
+    prev_cursor: str | None
+    next: str | None  # Ready-to-follow URL for the next (older) page
+    prev: str | None  # Ready-to-follow URL for the previous (newer) page
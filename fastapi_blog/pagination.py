@@ -0,0 +1,130 @@
+"""Keyset (cursor) pagination helpers for the posts feed.
+
+Pages are keyed on (date_posted, id) instead of OFFSET, so fetching page 10,000
+costs the same as fetching page 1: the database seeks straight into the
+composite index `ix_posts_date_posted_id` and reads `limit + 1` rows.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Literal
+
+from sqlalchemy import Select, tuple_
+
+import models.models as models
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# "older" walks towards the end of the feed (next page), "newer" walks back towards the top (previous page)
+Direction = Literal["older", "newer"]
+
+
+@dataclass(frozen=True)
+class Cursor:
+    date_posted: datetime
+    id: int
+    direction: Direction
+
+
+@dataclass
+class Page:
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def encode_token(payload: dict) -> str:
+    """Turn a small JSON payload into an opaque, URL-safe cursor string."""
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token: str) -> dict:
+    """
+    Reverse of `encode_token`.
+
+    Raises:
+        ValueError: If the token is not valid base64 encoded JSON
+    """
+    try:
+        # Restore the base64 padding we stripped in encode_token
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid cursor")
+    return payload
+
+
+def encode_cursor(post: models.Post, direction: Direction) -> str:
+    """Encode the position of a post into an opaque, URL-safe cursor string."""
+    return encode_token({"d": post.date_posted.isoformat(), "i": post.id, "v": direction[0]})
+
+
+def decode_cursor(token: str) -> Cursor:
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed or has been tampered with
+    """
+    payload = decode_token(token)
+    try:
+        direction: Direction = {"o": "older", "n": "newer"}[payload["v"]]
+        return Cursor(
+            date_posted=datetime.fromisoformat(payload["d"]),
+            id=int(payload["i"]),
+            direction=direction,
+        )
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def paginate_posts(stmt: Select, cursor: Cursor | None, limit: int) -> Select:
+    """
+    Apply keyset filtering, ordering and the page-size limit to a posts query.
+
+    We always fetch one extra row so `build_page` can tell whether another page exists
+    without running a separate COUNT(*) query.
+    """
+    key = tuple_(models.Post.date_posted, models.Post.id)
+
+    if cursor is None:
+        stmt = stmt.order_by(models.Post.date_posted.desc(), models.Post.id.desc())
+    elif cursor.direction == "older":
+        stmt = stmt.where(key < (cursor.date_posted, cursor.id)).order_by(
+            models.Post.date_posted.desc(), models.Post.id.desc()
+        )
+    else:
+        # Walking backwards: read ascending from the cursor, build_page flips the rows back to newest-first
+        stmt = stmt.where(key > (cursor.date_posted, cursor.id)).order_by(
+            models.Post.date_posted.asc(), models.Post.id.asc()
+        )
+
+    return stmt.limit(limit + 1)
+
+
+def build_page(rows: list[models.Post], cursor: Cursor | None, limit: int) -> Page:
+    """Trim the extra look-ahead row and compute the cursors for the neighbouring pages."""
+    has_more = len(rows) > limit
+    items = list(rows[:limit])
+
+    if cursor is not None and cursor.direction == "newer":
+        items.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = cursor is not None, has_more
+
+    if not items:
+        return Page(items=[], next_cursor=None, prev_cursor=None)
+
+    return Page(
+        items=items,
+        next_cursor=encode_cursor(items[-1], "older") if has_older else None,
+        prev_cursor=encode_cursor(items[0], "newer") if has_newer else None,
+    )
@@ -0,0 +1,177 @@
+"""Lean projections for the post list endpoints.
+
+Instead of hydrating `Post` and `User` ORM objects (plus a second selectinload query for the
+authors) and letting Pydantic validate every object via `from_attributes`, the list endpoints:
+
+1. select only the columns they need, authors included, in a single joined query
+2. build plain dicts from the rows
+3. serialize them with a TypeAdapter over TypedDicts: pydantic-core's compiled serializer,
+   with no per-row model validation
+
+The lists ship the stored excerpt and reading time of each post (see rendering.py) rather than its
+body: LIST_FIELDS. The lists that need ORM objects (the HTML pages, the search results) load them
+WITHOUT_BODIES. Clients can ask for other fields with `fields=` (e.g. `fields=id,title,author`
+or `fields=title,content`), and cut the content with `excerpt=` (truncate `content` to N
+characters, done in SQL so full bodies never leave the database).
+"""
+
+from datetime import datetime
+from typing import Any, NotRequired, TypedDict
+
+from pydantic import TypeAdapter
+from sqlalchemy import Select, func, literal_column, select
+from sqlalchemy.orm import defer
+
+import models.models as models
+from rendering import ELLIPSIS
+
+# Fields of PostResponse, in the same order, so lean responses look exactly like the full ones
+POST_FIELDS = ("title", "content", "id", "user_id", "date_posted", "author", "content_html", "excerpt", "reading_time_minutes")
+
+# Default fields of the lists: no bodies, the excerpt shows what the post is about
+LIST_FIELDS = tuple(field for field in POST_FIELDS if field not in ("content", "content_html"))
+
+# Loader options for the lists of Post objects: everything but the bodies (reading one anyway raises)
+WITHOUT_BODIES = (defer(models.Post.content, raiseload=True), defer(models.Post.content_html, raiseload=True))
+
+
+class AuthorItem(TypedDict):
+    username: str
+    email: str
+    id: int
+    image_file: str | None
+    image_path: str
+
+
+class PostItem(TypedDict):
+    title: NotRequired[str]
+    content: NotRequired[str]
+    id: NotRequired[int]
+    user_id: NotRequired[int]
+    date_posted: NotRequired[datetime]
+    author: NotRequired[AuthorItem]
+    content_html: NotRequired[str | None]
+    excerpt: NotRequired[str | None]
+    reading_time_minutes: NotRequired[int | None]
+
+
+class PostPageBody(TypedDict):
+    items: list[PostItem]
+    next_cursor: str | None
+    prev_cursor: str | None
+    next: str | None
+    prev: str | None
+
+
+post_page_serializer = TypeAdapter(PostPageBody)
+post_item_serializer = TypeAdapter(PostItem)
+
+
+def parse_fields(fields: str | None, default: tuple[str, ...] = POST_FIELDS) -> tuple[str, ...]:
+    """
+    Parse the `fields=` query parameter, `default` when it is not given.
+
+    Example:
+        parse_fields("id, title,author") -> ("title", "id", "author")
+
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    if not fields:
+        return default
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(POST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}. Allowed: {', '.join(POST_FIELDS)}")
+    return tuple(field for field in POST_FIELDS if field in requested)
+
+
+def select_post_rows(fields: tuple[str, ...], excerpt: int | None) -> Select:
+    """
+    Build the column-only query for a list of posts.
+
+    id and date_posted are always selected, the pagination cursors are built from them, and
+    updated_at (plus author_updated_at with the author), the ETag of the response is built from them.
+    The users table is only joined when the author is requested.
+    """
+    columns: list[Any] = [
+        models.Post.id.label("id"),
+        models.Post.date_posted.label("date_posted"),
+        models.Post.updated_at.label("updated_at"),
+    ]
+    if "title" in fields:
+        columns.append(models.Post.title.label("title"))
+    if "content" in fields:
+        if excerpt is None:
+            columns.append(models.Post.content.label("content"))
+        else:
+            columns.append(func.substr(models.Post.content, 1, excerpt).label("content"))
+            columns.append((func.length(models.Post.content) > excerpt).label("truncated"))
+    if "user_id" in fields or "author" in fields:
+        columns.append(models.Post.user_id.label("user_id"))
+    for field in ("content_html", "excerpt", "reading_time_minutes"):
+        if field in fields:
+            columns.append(getattr(models.Post, field).label(field))
+
+    stmt = select(*columns)
+    if "author" in fields:
+        stmt = stmt.add_columns(
+            models.User.username.label("author_username"),
+            models.User.email.label("author_email"),
+            models.User.image_file.label("author_image_file"),
+            models.User.image_has_thumbnails.label("author_image_has_thumbnails"),
+            models.User.updated_at.label("author_updated_at"),
+        ).join(models.User, models.User.id == models.Post.user_id)
+    return stmt
+
+
+def post_returning_columns() -> list[Any]:
+    """
+    Columns of a post and its author for `INSERT/UPDATE ... RETURNING`, so a write gets everything
+    its response needs in the same round trip. The rows work with `row_to_item(row, POST_FIELDS)`.
+
+    RETURNING can only name columns of the table being written, so the author comes from scalar
+    subqueries (primary key lookups) correlated to the written row.
+    """
+    # Spelled out: SQLAlchemy doesn't correlate subqueries in RETURNING with the table of the INSERT/UPDATE
+    written_user_id = literal_column(f"{models.Post.__tablename__}.user_id")
+
+    def author_column(column: Any, label: str) -> Any:
+        return select(column).where(models.User.id == written_user_id).scalar_subquery().label(label)
+
+    return [
+        models.Post.id.label("id"),
+        models.Post.date_posted.label("date_posted"),
+        models.Post.title.label("title"),
+        models.Post.content.label("content"),
+        models.Post.user_id.label("user_id"),
+        models.Post.content_html.label("content_html"),
+        models.Post.excerpt.label("excerpt"),
+        models.Post.reading_time_minutes.label("reading_time_minutes"),
+        author_column(models.User.username, "author_username"),
+        author_column(models.User.email, "author_email"),
+        author_column(models.User.image_file, "author_image_file"),
+    ]
+
+
+def row_versions(row: Any) -> tuple[Any, ...]:
+    """The versions of a post row and of its author (when joined), for conditional.validators_for."""
+    return (row.id, row.updated_at, getattr(row, "author_updated_at", None))
+
+
+def row_to_item(row: Any, fields: tuple[str, ...]) -> PostItem:
+    item: dict[str, Any] = {}
+    for field in fields:
+        if field == "author":
+            item["author"] = {
+                "username": row.author_username,
+                "email": row.author_email,
+                "id": row.user_id,
+                "image_file": row.author_image_file,
+                "image_path": models.profile_image_path(row.author_image_file),
+            }
+        elif field == "content" and getattr(row, "truncated", False):
+            item["content"] = row.content.rstrip() + ELLIPSIS
+        else:
+            item[field] = getattr(row, field)
+    return item  # type: ignore[return-value]
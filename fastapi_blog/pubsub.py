@@ -0,0 +1,226 @@
+"""Messages between worker processes: cache invalidations, live feed events.
+
+Each worker keeps state of its own (the in-memory response cache, the template fragment cache,
+the subscribers of the live feed). What happens in one worker has to reach the others:
+
+- cache.py publishes the tags it invalidates, so the other workers drop the same entries instead
+  of serving the old content until it expires
+- live.py publishes the post events, so the clients streaming from any worker see every write
+
+Each of them has a bus of its own (a channel), and each worker handles the messages published
+by the others:
+
+- LocalBus: a single process, nobody else to tell (the default with one worker)
+- UnixSocketBus: the workers of one machine, over Unix datagram sockets in a shared directory.
+  No extra service needed, it's what `python -m serve --workers N` uses without Redis.
+- RedisBus: workers on any number of machines, over a Redis pub/sub channel
+
+Messages are JSON values. Delivery is best effort (like Redis pub/sub itself): a worker that is
+restarting can miss a message. The TTL of the cache entries bounds how long it may serve stale
+content, live feed clients get a "reset" event when they missed too much (see live.py).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+from config import Settings, worker_count
+
+logger = logging.getLogger(__name__)
+
+# Called with each message published by another worker (a decoded JSON value)
+MessageHandler = Callable[[Any], None]
+
+# Datagrams stay well under the default socket buffer size: publishers keep their messages smaller
+# (the cache splits big invalidations with split_tags, live events carry an excerpt of the post)
+MAX_DATAGRAM_BYTES = 32 * 1024
+
+
+class MessageBus:
+    """Interface shared by all buses."""
+
+    name = "base"
+
+    async def start(self, handler: MessageHandler) -> None:
+        """Start receiving the messages of the other workers. Called once, from the app's lifespan."""
+
+    async def publish(self, message: Any) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalBus(MessageBus):
+    """Single process: the publisher already handled its message itself, there is no one else to tell."""
+
+    name = "local"
+
+    async def publish(self, message: Any) -> None:
+        return None
+
+
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    def __init__(self, handler: MessageHandler, channel: str):
+        self.handler = handler
+        self.channel = channel
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning("Ignoring a malformed message on %s", self.channel)
+            return
+        self.handler(message)
+
+
+class UnixSocketBus(MessageBus):
+    """
+    Workers of one machine, each listening on `<directory>/<channel>.<pid>.sock`.
+
+    Publishing sends a datagram to every other socket of the channel in the directory. Sockets left
+    behind by workers that died are removed the first time a message can't be delivered to them.
+    """
+
+    name = "unix"
+
+    def __init__(self, directory: Path, channel: str):
+        self.directory = directory
+        self.channel = channel
+        self.path = directory / f"{channel}.{os.getpid()}.sock"
+        self._transport: asyncio.DatagramTransport | None = None
+        self._sender: socket.socket | None = None
+
+    async def start(self, handler: MessageHandler) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        # Bound here rather than with local_addr=, which uvloop only accepts for IP sockets
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(str(self.path))
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: _DatagramReceiver(handler, self.channel), sock=receiver)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+    async def publish(self, message: Any) -> None:
+        if self._sender is None:
+            return
+        peers = [peer for peer in self.directory.glob(f"{self.channel}.*.sock") if peer != self.path]
+        if not peers:
+            return
+        payload = json.dumps(message).encode()
+        if len(payload) > MAX_DATAGRAM_BYTES:
+            logger.error("Message of %d bytes dropped on %s, the limit is %d", len(payload), self.channel, MAX_DATAGRAM_BYTES)
+            return
+        for peer in peers:
+            try:
+                self._sender.sendto(payload, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody listening any more: a worker that exited without cleaning up
+                peer.unlink(missing_ok=True)
+            except BlockingIOError:
+                logger.warning("Message dropped on %s, worker socket %s is full", self.channel, peer.name)
+
+    async def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        if self._sender is not None:
+            self._sender.close()
+        self.path.unlink(missing_ok=True)
+
+
+class RedisBus(MessageBus):
+    """
+    Workers on any number of machines, over the Redis pub/sub channel `blog:<channel>`.
+
+    Every message carries the id of the publishing worker, so workers skip their own messages.
+    """
+
+    name = "redis"
+
+    def __init__(self, client: Any, channel: str):
+        self.client = client
+        self.channel = f"blog:{channel}"
+        self.origin = uuid.uuid4().hex
+        self._pubsub: Any = None
+        self._listener: asyncio.Task | None = None
+
+    async def start(self, handler: MessageHandler) -> None:
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: MessageHandler) -> None:
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            try:
+                data = json.loads(message["data"])
+            except ValueError:
+                logger.warning("Ignoring a malformed message on %s", self.channel)
+                continue
+            if data.get("origin") != self.origin:
+                handler(data["message"])
+
+    async def publish(self, message: Any) -> None:
+        await self.client.publish(self.channel, json.dumps({"origin": self.origin, "message": message}))
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+
+
+def split_tags(tags: tuple[str, ...]) -> list[list[str]]:
+    """Split a list of tags into batches whose JSON stays under MAX_DATAGRAM_BYTES."""
+    batches: list[list[str]] = []
+    batch: list[str] = []
+    size = 2
+    for tag in tags:
+        tag_size = len(json.dumps(tag)) + 2
+        if batch and size + tag_size > MAX_DATAGRAM_BYTES:
+            batches.append(batch)
+            batch, size = [], 2
+        batch.append(tag)
+        size += tag_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_bus(settings: Settings, channel: str, redis_client: Any = None) -> MessageBus:
+    """
+    Create the bus selected in the settings (BLOG_CACHE_INVALIDATION_BUS) for a channel.
+
+    Args:
+        channel: Keeps the messages of different publishers apart, e.g. "cache:invalidations"
+        redis_client: The Redis cache's client, reused by the Redis bus when there is one
+    """
+    kind = settings.cache_invalidation_bus
+    if kind == "auto":
+        if settings.cache_backend == "redis":
+            kind = "redis"
+        elif worker_count(settings) > 1:
+            kind = "unix"
+        else:
+            kind = "local"
+
+    if kind == "redis":
+        if redis_client is None:
+            # Optional dependency - only needed with the Redis bus (pip install 'fastapi-blog[redis]')
+            import redis.asyncio as redis
+
+            redis_client = redis.from_url(settings.redis_url)
+        return RedisBus(redis_client, channel)
+    if kind == "unix":
+        # serve.py gives each deployment a directory of its own. Without it, workers started by the same parent share one.
+        directory = settings.invalidation_socket_dir or os.path.join(tempfile.gettempdir(), f"fastapi_blog-{os.getppid()}")
+        return UnixSocketBus(Path(directory), channel.replace(":", "-"))
+    return LocalBus()
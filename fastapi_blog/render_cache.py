@@ -0,0 +1,206 @@
+"""Caching of rendered HTML.
+
+Fragment cache - a `{% cache %}` template tag that stores a rendered block in a memory-bounded LRU:
+
+    {% cache "post_card", post.id, post.updated_marker, post.author.image_version tags=["post:" ~ post.id] %}
+        ... expensive markup ...
+    {% endcache %}
+
+    The positional values form the key, so the block is re-rendered as soon as one of them changes.
+    They should cover everything the block shows: a block rendered from a replica that lags behind
+    then lands under its own, older key, and is never served for fresh data.
+    `tags` link the entry to the response cache tags (see cache.py): when a write endpoint
+    invalidates "post:3", every fragment tagged "post:3" is dropped as well.
+
+Page cache - whole rendered pages for anonymous GET requests, stored in the response cache
+together with an ETag, so repeat visitors get a 304 without the page being rendered or even sent.
+"""
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Iterable
+
+from fastapi import Request, Response
+from fastapi.responses import HTMLResponse
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import CacheBackend
+from config import get_settings
+from warmup import skips_response_cache
+
+
+# FRAGMENT CACHE ###################################################
+@dataclass
+class FragmentStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+class FragmentCache:
+    """
+    In-process LRU of rendered template fragments, bounded by the total size of the stored HTML.
+
+    Rendering is synchronous, so unlike the response cache this one has a sync API.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.stats = FragmentStats()
+        self._entries: OrderedDict[tuple, tuple[str, tuple[str, ...]]] = OrderedDict()  # key -> (html, tags)
+        self._tags: dict[str, set[tuple]] = {}
+        self._size = 0
+
+    def get(self, key: tuple) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry[0]
+
+    def set(self, key: tuple, rendered: str, tags: Iterable[str] = ()) -> None:
+        if len(rendered) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        tags = tuple(tags)
+        self._entries[key] = (rendered, tags)
+        self._size += len(rendered)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            for key in self._tags.pop(tag, set()):
+                if key in self._entries:
+                    self._remove(key)
+                    self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self._size = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**asdict(self.stats), "entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+    def _remove(self, key: tuple) -> None:
+        rendered, tags = self._entries.pop(key)
+        self._size -= len(rendered)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the `{% cache key, ... tags=[...] %}...{% endcache %}` tag to a Jinja2 environment."""
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        # Set to a FragmentCache to enable caching. With None the blocks are simply rendered every time.
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key_parts.append(parser.parse_expression())
+        tags = nodes.List([])
+        if parser.stream.skip_if("name:tags"):
+            parser.stream.expect("assign")
+            tags = parser.parse_expression()
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        # The template name and line number keep two {% cache %} blocks with the same values apart
+        key = nodes.List([nodes.Const(parser.name), nodes.Const(lineno), *key_parts])
+        return nodes.CallBlock(self.call_method("_render_cached", [key, tags]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key: list, tags: list, caller) -> Markup:
+        fragment_cache: FragmentCache | None = self.environment.fragment_cache
+        if fragment_cache is None:
+            return caller()
+        cache_key = tuple(key)
+        cached = fragment_cache.get(cache_key)
+        if cached is not None:
+            return Markup(cached)
+        rendered = caller()
+        fragment_cache.set(cache_key, str(rendered), tags)
+        return rendered
+
+
+fragment_cache = FragmentCache(get_settings().fragment_cache_max_bytes)
+
+
+# PAGE CACHE ###################################################
+def is_anonymous(request: Request) -> bool:
+    # Pages for logged-in visitors may be personalized, so only requests without credentials are cached
+    return "authorization" not in request.headers and not request.cookies
+
+
+def _is_cacheable(request: Request) -> bool:
+    # Nor the warm-up requests to no real host (see warmup.py): no visitor would ask for their entries
+    return is_anonymous(request) and not skips_response_cache(request)
+
+
+def _page_key(request: Request, key: str) -> str:
+    # Pages contain absolute URLs (url_for), so the same page served under another host is a different entry
+    return f"{key}@{request.base_url}"
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (value.strip() for value in if_none_match.split(","))
+
+
+def _page_response(request: Request, body: bytes, etag: str) -> Response:
+    # no-cache: browsers may store the page but must revalidate it (cheap, thanks to the ETag)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
+
+async def get_cached_page(request: Request, cache: CacheBackend, key: str) -> Response | None:
+    """
+    Return the cached page (or a 304 if the client already has it), or None on a miss.
+
+    The cached value is '<etag>\\n<html>', so a hit doesn't need to hash the page again.
+    """
+    if not _is_cacheable(request):
+        return None
+    cached = await cache.get(_page_key(request, key))
+    if cached is None:
+        return None
+    etag, _, body = cached.partition(b"\n")
+    return _page_response(request, body, etag.decode())
+
+
+async def cache_page(
+    request: Request, cache: CacheBackend, key: str, response: Response, tags: Iterable[str], from_replica: bool = False
+) -> Response:
+    """
+    Store a freshly rendered page and return it with its ETag (or a 304 if the client already has it).
+
+    A page rendered `from_replica` is only returned: the replica may lag behind the write that just
+    invalidated the entry (see database.is_replica_session).
+    """
+    body = bytes(response.body)
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:20]}"'
+    if _is_cacheable(request) and not from_replica:
+        await cache.set(_page_key(request, key), etag.encode() + b"\n" + body, tags=tags)
+    return _page_response(request, body, etag)
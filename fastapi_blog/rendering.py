@@ -0,0 +1,202 @@
+"""Write-time rendering of post bodies: Markdown in, stored HTML, excerpt and reading time out.
+
+Post content is Markdown. The write paths (create, update, bulk import) render it once and store
+the results next to it, in the posts table:
+
+    content_html            sanitized HTML, shown as is by the post page
+    excerpt                 plain text, at most EXCERPT_CHARS, shipped by the lists instead of the content
+    reading_time_minutes    at WORDS_PER_MINUTE
+    render_version          RENDER_VERSION at the time
+
+so no view ever renders Markdown, or loads whole bodies to show a list.
+
+Sanitized by construction: raw HTML in the Markdown is escaped, not passed through, and links or
+images to javascript:, vbscript:, file: and data: (other than images) URLs are left as text.
+Links get rel="nofollow ugc noopener".
+
+Posts written before rendering existed, or with an older RENDER_VERSION (bump it whenever the
+output changes), are rendered by a backfill, a batch of posts at a time spread over a process pool:
+
+    python -m rendering --batch-size 500 --workers 4
+"""
+
+import argparse
+import asyncio
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, NamedTuple
+
+from markdown_it import MarkdownIt
+from markdown_it.token import Token
+
+RENDER_VERSION = 1
+EXCERPT_CHARS = 300
+WORDS_PER_MINUTE = 200
+
+# Marks text cut short (excerpts, and the excerpt= mode of the list endpoints)
+ELLIPSIS = "…"
+
+
+class RenderedPost(NamedTuple):
+    content_html: str
+    excerpt: str
+    reading_time_minutes: int
+
+
+def _link_open(self: Any, tokens: list[Token], idx: int, options: Any, env: Any) -> str:
+    # Links in user content: no endorsement for search engines, no window.opener for the target
+    tokens[idx].attrSet("rel", "nofollow ugc noopener")
+    return self.renderToken(tokens, idx, options, env)
+
+
+# CommonMark with tables and ~~strikethrough~~, raw HTML off
+markdown = MarkdownIt("commonmark", {"html": False}).enable(["table", "strikethrough"])
+markdown.add_render_rule("link_open", _link_open)
+
+
+def plain_text(tokens: list[Token]) -> str:
+    """The text of parsed Markdown, without markup, on one line."""
+    parts: list[str] = []
+    for token in tokens:
+        if token.type == "inline":
+            for child in token.children or []:
+                if child.type in ("text", "code_inline"):
+                    parts.append(child.content)
+                elif child.type in ("softbreak", "hardbreak"):
+                    parts.append(" ")
+        elif token.type in ("code_block", "fence"):
+            parts.append(token.content)
+        # Every block ends a word
+        parts.append(" ")
+    return " ".join("".join(parts).split())
+
+
+def make_excerpt(text: str, max_chars: int = EXCERPT_CHARS) -> str:
+    """
+    Cut text at a word boundary.
+
+    Example:
+        make_excerpt("Cutting words in half", 12) -> "Cutting…"
+    """
+    if len(text) <= max_chars:
+        return text
+    cut = text[: max_chars - len(ELLIPSIS) + 1]
+    # The last word only if it ends right at the cut (a single overlong word is cut anyway)
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" .,;:-") + ELLIPSIS
+
+
+def render_post(content: str) -> RenderedPost:
+    """Render a post body. CPU bound: a few milliseconds for a long article."""
+    tokens = markdown.parse(content)
+    text = plain_text(tokens)
+    words = len(text.split())
+    return RenderedPost(
+        content_html=markdown.renderer.render(tokens, markdown.options, {}),
+        excerpt=make_excerpt(text),
+        reading_time_minutes=max(1, math.ceil(words / WORDS_PER_MINUTE)),
+    )
+
+
+def rendered_columns(content: str) -> dict[str, Any]:
+    """The posts columns rendered from `content`, for an INSERT or UPDATE."""
+    return {**render_post(content)._asdict(), "render_version": RENDER_VERSION}
+
+
+def render_many(contents: list[str]) -> list[dict[str, Any]]:
+    # One call per chunk of posts, so the process pool pickles a list rather than a post at a time
+    return [rendered_columns(content) for content in contents]
+
+
+# BACKFILL ###################################################
+async def backfill(db: Any, pool: ProcessPoolExecutor, workers: int, batch_size: int = 500) -> int:
+    """
+    Render the posts that have no rendering of the current RENDER_VERSION, `batch_size` per transaction,
+    each batch split over the `workers` processes of `pool`.
+
+    A post edited while its batch was rendering keeps the rendering of its edit: the UPDATE only
+    applies to the version of the row that was read, and such a row isn't counted.
+
+    After each batch, the cached lists and pages showing its posts are invalidated (in every worker,
+    through the cache's bus), since they show the excerpt and reading time.
+
+    Returns:
+        The number of posts rendered
+    """
+    # Here rather than at the top: the pool's processes import this module, and only need the renderer
+    from sqlalchemy import bindparam, or_, select, update
+
+    import models.models as models
+    from cache import POSTS_LIST_TAG, cache, post_tag
+
+    posts = models.Post.__table__
+    stale = or_(posts.c.render_version.is_(None), posts.c.render_version < RENDER_VERSION)
+    store = (
+        update(posts)
+        .where(posts.c.id == bindparam("b_id"), posts.c.updated_at == bindparam("b_updated_at"))
+        .values({column: bindparam(column) for column in (*RenderedPost._fields, "render_version")})
+    )
+    # Whether the driver reports the rows matched by a whole executemany (SQLite does, asyncpg doesn't)
+    counts_executemany = db.bind.dialect.supports_sane_multi_rowcount
+    loop = asyncio.get_running_loop()
+    rendered = 0
+    last_id = 0
+    while True:
+        rows = (
+            await db.execute(
+                select(posts.c.id, posts.c.content, posts.c.updated_at)
+                .where(posts.c.id > last_id, stale)
+                .order_by(posts.c.id)
+                .limit(batch_size)
+            )
+        ).all()
+        if not rows:
+            return rendered
+        last_id = rows[-1].id
+
+        chunk_size = math.ceil(len(rows) / workers)
+        chunks = [rows[start : start + chunk_size] for start in range(0, len(rows), chunk_size)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, render_many, [row.content for row in chunk]) for chunk in chunks)
+        )
+        values = [
+            {"b_id": row.id, "b_updated_at": row.updated_at, **columns}
+            for chunk, chunk_columns in zip(chunks, results)
+            for row, columns in zip(chunk, chunk_columns)
+        ]
+        # Only the rows still at the version that was read are updated, and counted
+        if counts_executemany:
+            rendered += (await db.execute(store, values)).rowcount
+        else:
+            for value in values:
+                rendered += (await db.execute(store, value)).rowcount
+        await db.commit()
+        await cache.invalidate_tags(POSTS_LIST_TAG, *(post_tag(row.id) for row in rows))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Render the posts whose stored HTML, excerpt and reading time are missing or outdated.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Posts per transaction")
+    parser.add_argument("--workers", type=int, default=None, help="Rendering processes (default: one per CPU core)")
+    args = parser.parse_args()
+
+    from cache import cache
+    from database import AsyncSessionLocal, engine
+
+    workers = args.workers or os.cpu_count() or 1
+    # The backfill invalidates cache tags. The bus carries the invalidations to the web workers (see pubsub.py).
+    await cache.bus.start(cache.apply_remote_invalidation)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            async with AsyncSessionLocal() as db:
+                rendered = await backfill(db, pool, workers, args.batch_size)
+        print(f"rendered {rendered} posts (render version {RENDER_VERSION})")
+    finally:
+        await cache.bus.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
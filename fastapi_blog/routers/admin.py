@@ -0,0 +1,59 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import CacheBackend, get_cache
+from render_cache import fragment_cache
+from database import get_db, replicas
+import admission
+import jobs
+import media
+from live import broadcaster
+from storage import media_storage
+
+router = APIRouter()
+
+
+# API routes - Admin ###########################################
+# CACHE STATS (hits / misses / evictions / invalidations)
+@router.get("/cache")
+async def get_cache_stats(cache: Annotated[CacheBackend, Depends(get_cache)]):
+    return {"responses": cache.snapshot(), "fragments": fragment_cache.snapshot()}
+
+
+# READ REPLICAS (healthy or skipped after a failure)
+@router.get("/replicas")
+async def get_replica_status():
+    return {"replicas": replicas.status()}
+
+
+# ADMISSION CONTROL (per route class: requests running, waiting, admitted, shed and rate limited in this worker)
+@router.get("/admission")
+async def get_admission_status():
+    return admission.snapshot()
+
+
+# LIVE FEED (subscribers of this worker, slow ones dropped, events buffered for resuming)
+@router.get("/live")
+async def get_live_feed_status():
+    return broadcaster.snapshot()
+
+
+# MEDIA FILES (stored pictures, references, orphans waiting for garbage collection, bytes saved by deduplication)
+@router.get("/media")
+async def get_media_usage(db: Annotated[AsyncSession, Depends(get_db)]):
+    return {"backend": media_storage.name, **await media.usage(db)}
+
+
+# BACKGROUND JOBS (counts per status and kind, oldest due job, recent failures)
+@router.get("/jobs")
+async def get_job_queue_status(db: Annotated[AsyncSession, Depends(get_db)]):
+    return await jobs.queue_status(db)
+
+
+# RETRY A FAILED JOB
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+    if not await jobs.retry_failed_job(db, job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Failed job not found")
+    await db.commit()
+    return {"id": job_id, "status": "queued"}
@@ -1,12 +1,36 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
+from database import constraint_violation, get_db, get_read_db, is_replica_session
 import models.models as models
 import models.schemas as schemas
-from sqlalchemy.orm import selectinload
 from pathlib import Path
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, build_page, decode_cursor, paginate_posts
+from cache import CacheBackend, get_cache, POSTS_LIST_TAG, post_tag, user_tag, user_posts_tag, user_stats_tag
+import search
+import user_stats
+import bulk
+import live
+import rendering
+import anyio
+from config import get_settings
+from metrics import timed
+from warmup import skips_response_cache
+from conditional import is_not_modified, not_modified, pack, respond, unpack, validators_for
+from projections import (
+    LIST_FIELDS,
+    POST_FIELDS,
+    parse_fields,
+    post_item_serializer,
+    post_page_serializer,
+    post_returning_columns,
+    row_to_item,
+    row_versions,
+    select_post_rows,
+)
 
 router = APIRouter()
 
@@ -15,121 +39,373 @@ BASE_DIR = Path(__file__).resolve().parent
 
 
 # API routes - Posts ###########################################
-# GET ALL POSTS
-@router.get("", response_model=list[schemas.PostResponse])
-async def get_posts(db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.Post).options(selectinload(models.Post.author)))
-    posts = result.scalars().all()
-    return posts
+# GET ALL POSTS (cursor paginated, newest first)
+# Without the bodies by default (LIST_FIELDS: the stored excerpt instead, see rendering.py)
+# Optional: fields=id,title,author (only return these fields), excerpt=200 (cut content, when requested, to 200 characters)
+@router.get("", response_model=schemas.PostPage)
+async def get_posts(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    fields: str | None = None,
+    excerpt: Annotated[int | None, Query(ge=1, le=10_000)] = None,
+):
+    # The full URL is the key: it holds the cursor, limit, fields and excerpt, and the host used to build the next/prev links
+    cache_key = f"api:posts:{request.url}"
+    # Except for a warm-up request to no real host: no client would ask for its entry (see warmup.py)
+    cacheable = not skips_response_cache(request)
+    cached = await cache.get(cache_key) if cacheable else None
+    if cached is not None:
+        validators, body = unpack(cached)
+        return respond(request, body, validators, use_if_modified_since=False)
+
+    try:
+        page_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        selected_fields = parse_fields(fields, LIST_FIELDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    # Lean path: one joined, column-only query and no ORM objects (see projections.py)
+    stmt = paginate_posts(select_post_rows(selected_fields, excerpt), page_cursor, limit)
+    result = await db.execute(stmt)
+    page = build_page(list(result.all()), page_cursor, limit)
+
+    # Validators from the versions of the rows, before any serialization (see conditional.py). The cursors
+    # are part of the representation: whether there is a next page doesn't show in the rows of this one.
+    # Only the ETag is trusted for a 304, Last-Modified doesn't change when a post of the page is deleted.
+    validators = validators_for(
+        f"{request.url} {page.next_cursor} {page.prev_cursor}", [row_versions(row) for row in page.items]
+    )
+    if is_not_modified(request, validators, use_if_modified_since=False):
+        return not_modified(validators)
+
+    with timed("serialize"):
+        body = post_page_serializer.dump_json({
+            "items": [row_to_item(row, selected_fields) for row in page.items],
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+            "next": str(request.url.include_query_params(cursor=page.next_cursor)) if page.next_cursor else None,
+            "prev": str(request.url.include_query_params(cursor=page.prev_cursor)) if page.prev_cursor else None,
+        })
+    # Tag the page with every post and author on it, so editing any of them drops this page
+    tags = {POSTS_LIST_TAG}
+    for row in page.items:
+        tags.add(post_tag(row.id))
+        if "author" in selected_fields:
+            tags.add(user_tag(row.user_id))
+    # Never what a replica returned: it may predate the write that just invalidated the entry (see is_replica_session)
+    if cacheable and not is_replica_session(db):
+        await cache.set(cache_key, pack(validators, body), tags=tags)
+    return Response(content=body, media_type="application/json", headers=validators.headers())
+
+# SEARCH POSTS (full-text, best matches first). Declared before "/{post_id}" so "search" isn't read as a post id
+@router.get("/search", response_model=schemas.PostSearchPage)
+async def search_posts(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):
+    try:
+        page = await search.search_posts(db, q, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    return {
+        "items": page.hits,
+        "next_cursor": page.next_cursor,
+        "next": str(request.url.include_query_params(cursor=page.next_cursor)) if page.next_cursor else None,
+    }
+
+# LIVE FEED - Server-Sent Events: post_created, post_updated, post_deleted, posts_imported (see live.py)
+# Reconnecting clients resume after their Last-Event-ID (header, or ?last_event_id= for the first connection)
+@router.get("/stream", response_class=StreamingResponse)
+async def stream_posts(request: Request, last_event_id: str | None = None):
+    settings = get_settings()
+    try:
+        subscriber = live.broadcaster.subscribe(request.headers.get("last-event-id") or last_event_id)
+    except live.TooManySubscribersError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many live feed clients, retry later")
+    return StreamingResponse(
+        live.broadcaster.stream(subscriber, settings.live_heartbeat_seconds, settings.live_retry_ms),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx would otherwise hold the events back in its buffers
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# BULK IMPORT - NDJSON body, one PostCreate per line (see bulk.py)
+@router.post("/bulk", response_model=schemas.BulkImportReport, openapi_extra=bulk.ndjson_request_body(schemas.PostCreate))
+async def bulk_create_posts(request: Request, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]):
+    settings = get_settings()
+    report = bulk.ImportReport()
+    authors: set[int] = set()
+
+    async def before_insert(batch: list[dict]) -> None:
+        # The whole batch in one trip to a worker thread
+        rendered = await anyio.to_thread.run_sync(rendering.render_many, [values["content"] for values in batch])
+        for values, columns in zip(batch, rendered):
+            values.update(columns)
+
+    async def after_insert(db: AsyncSession, rows: list) -> None:
+        await search.index_new_posts(db, rows)
+        authors.update(await user_stats.record_posts_created(db, rows))
+
+    def describe_violation(exc: IntegrityError) -> str:
+        if constraint_violation(exc).kind == "foreign_key":
+            return "User not found"
+        return str(exc.orig)
+
+    await bulk.bulk_insert(
+        db,
+        bulk.read_ndjson_lines(request.stream(), settings.bulk_max_line_bytes, report),
+        schemas.PostCreate,
+        models.Post,
+        [models.Post.id, models.Post.title, models.Post.content, models.Post.user_id, models.Post.date_posted],
+        settings.bulk_batch_size,
+        report,
+        describe_violation,
+        after_insert,
+        before_insert,
+    )
+    if report.inserted:
+        await cache.invalidate_tags(
+            POSTS_LIST_TAG,
+            *(user_posts_tag(user_id) for user_id in authors),
+            *(user_stats_tag(user_id) for user_id in authors),
+        )
+        await live.publish_posts_imported(report.inserted)
+    return report.summary()
+
+# EXPORT - every post as NDJSON, streamed (same fields= option as GET ALL POSTS). Declared before "/{post_id}" too.
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts(db: Annotated[AsyncSession, Depends(get_read_db)], fields: str | None = None):
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    return StreamingResponse(
+        bulk.export_posts(db, selected_fields, get_settings().bulk_batch_size),
+        media_type=bulk.NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": 'attachment; filename="posts.ndjson"'},
+    )
 
 # GET SINGLE POST
 @router.get("/{post_id}", response_model=schemas.PostResponse)
-async def get_post(post_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.Post).options(selectinload(models.Post.author)).where(models.Post.id == post_id))
-    post = result.scalars().first()
-    if post:
-        return post
-    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+async def get_post(
+    post_id: int,
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+):
+    cache_key = f"api:post:{post_id}"
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        validators, body = unpack(cached)
+        return respond(request, body, validators)
+
+    # Lean path like the list: one joined, column-only query, with the versions of the post and its author
+    result = await db.execute(select_post_rows(POST_FIELDS, None).where(models.Post.id == post_id))
+    post = result.one_or_none()
+    if post is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+    validators = validators_for(f"post:{post_id}", [row_versions(post)])
+    if is_not_modified(request, validators):
+        return not_modified(validators)
+    with timed("serialize"):
+        body = post_item_serializer.dump_json(row_to_item(post, POST_FIELDS))
+    if not is_replica_session(db):
+        await cache.set(cache_key, pack(validators, body), tags=(post_tag(post.id), user_tag(post.user_id)))
+    return Response(content=body, media_type="application/json", headers=validators.headers())
 
 # CREATE POST
 @router.post("", response_model=schemas.PostResponse, status_code=status.HTTP_201_CREATED)
-async def create_post(post: schemas.PostCreate, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.User).where(models.User.id == post.user_id))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
+async def create_post(post: schemas.PostCreate, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]):
+    # Markdown rendered once, here, and stored with the post (see rendering.py). In a worker thread: long posts take a few ms.
+    rendered = await anyio.to_thread.run_sync(rendering.rendered_columns, post.content)
+    # No SELECT for the user first: the foreign key rejects unknown users, and INSERT ... RETURNING
+    # hands back the new post with its author in the same round trip
+    try:
+        result = await db.execute(
+            insert(models.Post)
+            .values(title=post.title, content=post.content, user_id=post.user_id, **rendered)
+            .returning(*post_returning_columns())
         )
-
-    new_post = models.Post(
-        title=post.title,
-        content=post.content,
-        user_id=post.user_id,
-    )
-    db.add(new_post)
+        new_post = result.one()
+    except IntegrityError as exc:
+        await db.rollback()
+        if constraint_violation(exc).kind == "foreign_key":
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found",
+            )
+        raise
+    await search.index_post(db, new_post, new=True)
+    await user_stats.record_posts_created(db, [new_post])
     await db.commit()
-    await db.refresh(new_post, attribute_names=["author"])  # Refresh the new_post instance to get the auto-generated 'id' and load the 'author' relationship for the response  
-    return new_post
+    # A new post shifts every page of the feed and the author's list of posts, and changes the author's counters
+    await cache.invalidate_tags(POSTS_LIST_TAG, user_posts_tag(new_post.user_id), user_stats_tag(new_post.user_id))
+    await live.publish_post("post_created", new_post)
+    return row_to_item(new_post, POST_FIELDS)
 
 ## UPDATE POST - FULL UPDATE
 @router.put("/{post_id}", response_model=schemas.PostResponse)
-async def update_post_full(post_id: int, post_data: schemas.PostCreate, db: Annotated[AsyncSession, Depends(get_db)]): 
+async def update_post_full(post_id: int, post_data: schemas.PostCreate, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]): 
      # TODO: add authentication and check if the current user is the author of the post before allowing updates
-    # Get the post to update   
-    result = await db.execute(select(models.Post).where(models.Post.id == post_id))
-    post = result.scalars().first()   
-    # Get the user to ensure the provided user_id is valid
-    result = await db.execute(select(models.User).where(models.User.id == post_data.user_id))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
-        )   
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    if user.id != post.user_id:
+    # Update all fields of the post, only if it belongs to the given user
+    # The counters go first, they need the old content length. If the post isn't updated, nothing is committed.
+    rendered = await anyio.to_thread.run_sync(rendering.rendered_columns, post_data.content)
+    await user_stats.record_post_content_changed(db, post_id, post_data.content)
+    result = await db.execute(
+        update(models.Post)
+        .where(models.Post.id == post_id, models.Post.user_id == post_data.user_id)
+        .values(title=post_data.title, content=post_data.content, **rendered)
+        .returning(*post_returning_columns())
+        .execution_options(synchronize_session=False)
+    )
+    post = result.one_or_none()
+    if post is None:
+        # Nothing was updated: find out why (unknown user, unknown post, or someone else's post)
+        user_exists, owner_id = (
+            await db.execute(
+                select(
+                    select(models.User.id).where(models.User.id == post_data.user_id).exists(),
+                    select(models.Post.user_id).where(models.Post.id == post_id).scalar_subquery(),
+                )
+            )
+        ).one()
+        if not user_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found",
+            )
+        if owner_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only update your own posts",
-        )    
-   
-    # Update all fields of the post
-    post.title = post_data.title
-    post.content = post_data.content
+        )
 
+    await search.index_post(db, post)
     await db.commit()
-    await db.refresh(post, attribute_names=["author"])  # Refresh the post instance to load the updated 'author' relationship for the response
-    return post
+    await cache.invalidate_tags(post_tag(post.id), user_stats_tag(post.user_id))
+    await live.publish_post("post_updated", post)
+    return row_to_item(post, POST_FIELDS)
     
 
 ## UPDATE POST - PARTIAL UPDATE
 @router.patch("/{post_id}", response_model=schemas.PostResponse)
-async def update_post_partial(post_id: int, post_data: schemas.PostUpdate, db: Annotated[AsyncSession, Depends(get_db)]):
+async def update_post_partial(post_id: int, post_data: schemas.PostUpdate, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]):
     # TODO: add authentication and check if the current user is the author of the post before allowing updates
-    result = await db.execute(select(models.Post).where(models.Post.id == post_id))
-    post = result.scalars().first() 
-    
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found") 
-
     # Update post fields if they are provided in the update request
     update_data = post_data.model_dump(exclude_unset=True)  #Exclude unprovided fields - Get only the fields that were provided in the request
-    
-
-    for key, value in update_data.items():
-        setattr(post, key, value)
 
-    await db.commit()
-    await db.refresh(post, attribute_names=["author"])  # Refresh the post instance to load the updated 'author' relationship for the response
-    return post
-
-## GET ALL POSTS BY USER
-@router.get("/{user_id}/posts", response_model=list[schemas.PostResponse])
-async def get_user_posts(user_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.User).where(models.User.id == user_id))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
+    if update_data:
+        if "content" in update_data:
+            # Before the UPDATE, the counters need the old content length
+            await user_stats.record_post_content_changed(db, post_id, update_data["content"])
+            update_data.update(await anyio.to_thread.run_sync(rendering.rendered_columns, update_data["content"]))
+        result = await db.execute(
+            update(models.Post)
+            .where(models.Post.id == post_id)
+            .values(**update_data)
+            .returning(*post_returning_columns())
+            .execution_options(synchronize_session=False)
         )
+    else:
+        # Nothing to change, just return the post as it is
+        result = await db.execute(select_post_rows(POST_FIELDS, None).where(models.Post.id == post_id))
+    post = result.one_or_none()
+    if post is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
-    result = await db.execute(select(models.Post).options(selectinload(models.Post.author)).where(models.Post.user_id == user_id))
-    posts = result.scalars().all()
-    return posts
+    if update_data:
+        await search.index_post(db, post)
+        await db.commit()
+        await cache.invalidate_tags(post_tag(post.id), user_stats_tag(post.user_id))
+        await live.publish_post("post_updated", post)
+    return row_to_item(post, POST_FIELDS)
+
+## GET ALL POSTS BY USER (cursor paginated, newest first, like GET ALL POSTS)
+# Same cursor=, limit=, fields= and excerpt= options (and default fields) as GET ALL POSTS
+@router.get("/{user_id}/posts", response_model=schemas.PostPage)
+async def get_user_posts(
+    request: Request,
+    user_id: int,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    fields: str | None = None,
+    excerpt: Annotated[int | None, Query(ge=1, le=10_000)] = None,
+):
+    # The full URL is the key, as for GET ALL POSTS: the host is part of the next/prev links
+    cache_key = f"api:user_posts:{user_id}:{request.url}"
+    cacheable = not skips_response_cache(request)
+    cached = await cache.get(cache_key) if cacheable else None
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    try:
+        page_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        selected_fields = parse_fields(fields, LIST_FIELDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    # Keyset pagination on (date_posted, id), as on the user's page: one page at a time, however prolific the user
+    stmt = paginate_posts(select_post_rows(selected_fields, excerpt).where(models.Post.user_id == user_id), page_cursor, limit)
+    result = await db.execute(stmt)
+    page = build_page(list(result.all()), page_cursor, limit)
+    # Only when there are no posts do we need to know whether the user exists at all
+    if not page.items:
+        user = await db.execute(select(models.User.id).where(models.User.id == user_id))
+        if user.scalar_one_or_none() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found",
+            )
+
+    with timed("serialize"):
+        body = post_page_serializer.dump_json({
+            "items": [row_to_item(row, selected_fields) for row in page.items],
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+            "next": str(request.url.include_query_params(cursor=page.next_cursor)) if page.next_cursor else None,
+            "prev": str(request.url.include_query_params(cursor=page.prev_cursor)) if page.prev_cursor else None,
+        })
+    tags = {user_tag(user_id), user_posts_tag(user_id), *(post_tag(row.id) for row in page.items)}
+    if cacheable and not is_replica_session(db):
+        await cache.set(cache_key, body, tags=tags)
+    return Response(content=body, media_type="application/json")
 
 # DELETE POST
 @router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_post(post_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+async def delete_post(post_id: int, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]):
     # TODO: add authentication and check if the current user is the author of the post before allowing deletion
-    result = await db.execute(select(models.Post).where(models.Post.id == post_id))
-    post = result.scalars().first()
-    if not post:
+    result = await db.execute(
+        delete(models.Post)
+        .where(models.Post.id == post_id)
+        .returning(models.Post.user_id, models.Post.date_posted, func.length(models.Post.content))
+        .execution_options(synchronize_session=False)
+    )
+    deleted = result.one_or_none()
+    if deleted is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    await db.delete(post)
+    user_id, date_posted, content_chars = deleted
+    await search.remove_post(db, post_id)
+    await user_stats.record_post_deleted(db, user_id, date_posted, content_chars)
     await db.commit()
+    await cache.invalidate_tags(post_tag(post_id), POSTS_LIST_TAG, user_posts_tag(user_id), user_stats_tag(user_id))
+    await live.publish_post_deleted(post_id, user_id)
     return 
 
 
@@ -1,86 +1,138 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, UploadFile
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from database import constraint_violation, get_db, get_read_db, is_replica_session
 import models.models as models
 import models.schemas as schemas
-import shutil
-from utils import generate_unique_filename
+from images import THUMBNAIL_SIZES, UnsupportedImageError, UploadTooLargeError, save_upload, thumbnail_filename, verify_image
+import anyio
+import media
+import tasks
+from storage import media_storage
+from cache import CacheBackend, get_cache, user_stats_tag, user_tag
+from metrics import timed
+from conditional import is_not_modified, not_modified, pack, respond, unpack, validators_for
+import bulk
+from config import get_settings
 from pathlib import Path
+import secrets
+import tempfile
 
 router = APIRouter()
 
 # Get the base directory (where main.py is located)
 BASE_DIR = Path(__file__).resolve().parent
 
+# Maps a unique constraint violation on users to the same 400 the endpoints used to return after a pre-check SELECT
+def _duplicate_user_error(exc: IntegrityError) -> HTTPException:
+    violation = constraint_violation(exc)
+    if violation.kind == "unique" and violation.column == "username":
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already exists")
+    if violation.kind == "unique" and violation.column == "email":
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists")
+    raise exc
+
+
 # API routes - Users ###########################################
 # CREATE USER
 @router.post("", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(user: schemas.UserCreate, db: Annotated[AsyncSession, Depends(get_db)]):
-    username_exists = await db.execute(
-        select(models.User).where(models.User.username == user.username)
-    )
-    username_exists = username_exists.scalar_one_or_none()
-    if username_exists:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="Username already exists")
-    email_result = await db.execute(
-        select(models.User).where(models.User.email == user.email)
-    )
-    email_exists = email_result.scalar_one_or_none()
-    if email_exists:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="Email already exists")
-
-    new_user = models.User(username=user.username,email=user.email)
-    # Stage the new user data for insert
-    db.add(new_user)
-    # Execute and save the new user to the DB
-    await db.commit()
-    # Reloads the new_user instance with the data from the DB, including the auto-generated 'id' field, so we can return it in the response
-    await db.refresh(new_user)
+    # The unique constraints on username and email do the duplicate checks, so two concurrent
+    # sign-ups with the same name can't both get through. RETURNING gives back the new row,
+    # including the auto-generated 'id', without a second query.
+    try:
+        result = await db.execute(
+            insert(models.User).values(username=user.username, email=user.email).returning(models.User)
+        )
+        new_user = result.scalar_one()
+        # RETURNING doesn't load relationships. A brand new user has no posts, so no counters yet.
+        set_committed_value(new_user, "stats", None)
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        raise _duplicate_user_error(exc)
     return new_user
 
+# BULK IMPORT - NDJSON body, one UserCreate per line (see bulk.py)
+@router.post("/bulk", response_model=schemas.BulkImportReport, openapi_extra=bulk.ndjson_request_body(schemas.UserCreate))
+async def bulk_create_users(request: Request, db: Annotated[AsyncSession, Depends(get_db)]):
+    settings = get_settings()
+    report = bulk.ImportReport()
+    await bulk.bulk_insert(
+        db,
+        bulk.read_ndjson_lines(request.stream(), settings.bulk_max_line_bytes, report),
+        schemas.UserCreate,
+        models.User,
+        [models.User.id],
+        settings.bulk_batch_size,
+        report,
+        lambda exc: _duplicate_user_error(exc).detail,
+    )
+    return report.summary()
+
 # GET USER BY ID
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-async def get_user(user_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+async def get_user(
+    user_id: int,
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
+):
+    cache_key = f"api:user:{user_id}"
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        validators, body = unpack(cached)
+        return respond(request, body, validators)
+
     user = await db.execute(select(models.User).where(models.User.id == user_id))
     user = user.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+    # The embedded stats have a version of their own: a new post changes them, not the users row
+    validators = validators_for(f"user:{user_id}", [(user.id, user.updated_at, user.stats.updated_at if user.stats else None)])
+    if is_not_modified(request, validators):
+        return not_modified(validators)
+    with timed("serialize"):
+        body = schemas.UserResponse.model_validate(user).model_dump_json().encode()
+    if not is_replica_session(db):
+        await cache.set(cache_key, pack(validators, body), tags=(user_tag(user.id), user_stats_tag(user.id)))
+    return Response(content=body, media_type="application/json", headers=validators.headers())
 
 # UPDATE USER
 @router.patch("/{user_id}", response_model=schemas.UserResponse)
-async def update_user(user_id: int, user_data: schemas.UserUpdate, db: Annotated[AsyncSession, Depends(get_db)]):
-    user = await db.execute(select(models.User).where(models.User.id == user_id))
-    user = user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
+async def update_user(user_id: int, user_data: schemas.UserUpdate, db: Annotated[AsyncSession, Depends(get_db)], cache: Annotated[CacheBackend, Depends(get_cache)]):
     update_data = user_data.model_dump(exclude_unset=True)
-
-    # Check if email is being updated and if it already exists for another user
-    if "email" in update_data:
-        email_result = await db.execute(
-            select(models.User).where(
-                models.User.email == update_data["email"],
-                models.User.id != user_id
-            )
+    if not update_data:
+        user = await db.execute(select(models.User).where(models.User.id == user_id))
+        user = user.scalar_one_or_none()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        return user
+
+    # An email already used by another user is rejected by the unique constraint
+    try:
+        result = await db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(**update_data)
+            .returning(models.User)
+            # RETURNING doesn't run the joined load of the counters
+            .options(selectinload(models.User.stats))
         )
-        email_exists = email_result.scalar_one_or_none()
-        if email_exists:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already exists"
-            )
-
-    for key, value in update_data.items():
-        setattr(user, key, value)
+        user = result.scalar_one_or_none()
+    except IntegrityError as exc:
+        await db.rollback()
+        raise _duplicate_user_error(exc)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     await db.commit()
-    await db.refresh(user)
+    # Drops the user itself and every cached post/page that embeds this user as the author
+    await cache.invalidate_tags(user_tag(user.id))
     return user
 
 # UPLOAD PROFILE PICTURE
@@ -89,14 +141,19 @@ async def upload_profile_picture(
     user_id: int,
     file: UploadFile,
     db: Annotated[AsyncSession, Depends(get_db)],
+    cache: Annotated[CacheBackend, Depends(get_cache)],
 ):
     """
     Upload a profile picture for a user.
 
     This endpoint demonstrates proper file handling with:
-    - Filename sanitization (removes spaces, special characters)
-    - File type validation (only images allowed)
-    - Unique filename generation (prevents collisions)
+    - File type validation by magic bytes (only PNG, JPEG, GIF and WebP images allowed)
+    - Streaming to a temporary file in chunks with a size limit (doesn't block the event loop)
+    - Content-addressed storage (see media.py): the file is named after the SHA-256 of its content,
+      so a picture uploaded again (by anyone) is stored once and keeps its thumbnails
+    - The user's previous picture released, and deleted later if nobody else uses it
+    - 32/64/256px WebP thumbnails generated by a background job (see tasks.py), pages use
+      the original picture until they are ready
     """
     # Get the user
     result = await db.execute(select(models.User).where(models.User.id == user_id))
@@ -104,27 +161,48 @@ async def upload_profile_picture(
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    # Validate file type
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Only image files are allowed"
-        )
-
-    # Generate a unique, sanitized filename
-    # This prevents: spaces, special chars, path traversal, and filename collisions
-    unique_filename = generate_unique_filename(file.filename or "profile.png")
+    # Stream the file to a temporary file, hashing it (the extension is set from the detected image type)
+    try:
+        upload = await save_upload(file, Path(tempfile.gettempdir()) / f"blog-upload-{secrets.token_hex(8)}")
+    except UnsupportedImageError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    except UploadTooLargeError as exc:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(exc))
+
+    try:
+        try:
+            await anyio.to_thread.run_sync(verify_image, upload.path)
+        except UnsupportedImageError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+        key = media.content_key(upload.sha256, upload.path.suffix)
+        if key != user.image_file:
+            # Stored before the commit, so a committed image_file always has its file
+            if not await media_storage.exists(key):
+                await media_storage.put(key, upload.path)
+            await media.add_reference(db, key, upload.size)
+            if user.image_file and await media.release_reference(db, user.image_file):
+                await tasks.enqueue_media_gc(db, user.image_file)
+
+            # Update the user's image fields. A picture seen before already has its thumbnails, otherwise
+            # the thumbnails job is committed with the change, and runs once the response is sent.
+            has_thumbnails = await media_storage.exists(thumbnail_filename(key, THUMBNAIL_SIZES[-1]))
+            user.image_file = key
+            user.image_has_thumbnails = has_thumbnails
+            if not has_thumbnails:
+                await tasks.enqueue_profile_thumbnails(db, user.id, key)
+            await db.commit()
+
+            # The garbage collection of an earlier, orphaned copy may have deleted the file between the
+            # check above and the commit (see media.collect). Store it again, and its thumbnails.
+            if not await media_storage.exists(key):
+                await media_storage.put(key, upload.path)
+                await tasks.enqueue_profile_thumbnails(db, user.id, key)
+                await db.commit()
+    finally:
+        upload.path.unlink(missing_ok=True)
 
-    # Save the file to the media/profile_pics directory
-    file_path = BASE_DIR / "media" / "profile_pics" / unique_filename
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Update the user's image_file field
-    user.image_file = unique_filename
-    await db.commit()
     await db.refresh(user)
+    await cache.invalidate_tags(user_tag(user.id))
 
     return user
\ No newline at end of file
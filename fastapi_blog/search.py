@@ -0,0 +1,201 @@
+"""Full-text search over posts.
+
+- SQLite: FTS5 virtual table `posts_fts` (porter stemming), ranked with BM25
+- Postgres: `posts_search` table with a weighted tsvector per post and a GIN index, ranked with ts_rank_cd
+
+Both are side tables kept in sync by the write endpoints in routers/posts.py (`index_post` /
+`remove_post`), inside the same transaction as the change to the post itself.
+
+Results are paginated with a keyset cursor on (score, id). Lower scores are better on both
+databases (BM25 is negative in SQLite, and we negate ts_rank_cd on Postgres).
+"""
+
+import html
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import models.models as models
+from pagination import decode_token, encode_token
+from projections import WITHOUT_BODIES
+
+# Side tables that live outside the SQLAlchemy models (ignored by alembic autogenerate)
+SEARCH_TABLE_PREFIXES = ("posts_fts", "posts_search")
+
+# The database wraps matched terms in these control characters. They are swapped for <mark>
+# tags *after* HTML-escaping the snippet, so post content can never inject markup.
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+@dataclass
+class SearchHit:
+    post: models.Post
+    rank: float
+    snippet: str  # HTML-safe, matched terms wrapped in <mark>
+
+
+@dataclass
+class SearchPage:
+    hits: list[SearchHit]
+    next_cursor: str | None
+
+
+def _dialect(db: AsyncSession) -> str:
+    return db.get_bind().dialect.name
+
+
+def _fts5_query(q: str) -> str | None:
+    """
+    Turn free text from the search box into a safe FTS5 MATCH expression.
+
+    Every word is quoted (so FTS5 operators and punctuation in the input can't cause syntax
+    errors), all words must match, and the last one is a prefix match for search-as-you-type.
+
+    Example:
+        _fts5_query('fastapi "async" tut') -> '"fastapi" "async" "tut"*'
+    """
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _render_snippet(raw: str) -> str:
+    return html.escape(raw).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+# INDEX SYNC ###################################################
+_PG_UPSERT = text(
+    "INSERT INTO posts_search (post_id, document) VALUES (:id, "
+    "setweight(to_tsvector('english', :title), 'A') || setweight(to_tsvector('english', :content), 'B')) "
+    "ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document"
+)
+_FTS_INSERT = text("INSERT INTO posts_fts (rowid, title, content) VALUES (:id, :title, :content)")
+
+
+async def index_post(db: AsyncSession, post: Any, new: bool = False) -> None:
+    """
+    Add or refresh the search entry of a post. Call once the post has its id, before commit.
+
+    Args:
+        post: Anything with id, title and content (a Post, or a row returned by INSERT/UPDATE ... RETURNING)
+        new: The post was just created, so there is no old entry to replace
+    """
+    params = {"id": post.id, "title": post.title, "content": post.content}
+    if _dialect(db) == "postgresql":
+        await db.execute(_PG_UPSERT, params)
+    else:
+        if not new:
+            await db.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), params)
+        await db.execute(_FTS_INSERT, params)
+
+
+async def index_new_posts(db: AsyncSession, posts: list[Any]) -> None:
+    """Add the search entries of many just-created posts in a single executemany. Call before commit."""
+    if not posts:
+        return
+    params = [{"id": post.id, "title": post.title, "content": post.content} for post in posts]
+    await db.execute(_PG_UPSERT if _dialect(db) == "postgresql" else _FTS_INSERT, params)
+
+
+async def remove_post(db: AsyncSession, post_id: int) -> None:
+    """Remove the search entry of a deleted post. Call before commit."""
+    if _dialect(db) == "postgresql":
+        await db.execute(text("DELETE FROM posts_search WHERE post_id = :id"), {"id": post_id})
+    else:
+        await db.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), {"id": post_id})
+
+
+# QUERIES ###################################################
+def encode_search_cursor(hit: SearchHit) -> str:
+    return encode_token({"s": hit.rank, "i": hit.post.id})
+
+
+def decode_search_cursor(token: str) -> tuple[float, int]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    payload = decode_token(token)
+    try:
+        return float(payload["s"]), int(payload["i"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+async def search_posts(db: AsyncSession, q: str, cursor: str | None, limit: int) -> SearchPage:
+    """
+    Ranked full-text search over post titles (weighted higher) and contents.
+
+    Runs in three cheap steps: rank the matches and take one page of ids, build snippets only
+    for that page, then load the posts (with authors, without bodies: the snippets stand for them) for the page.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    after = decode_search_cursor(cursor) if cursor else None
+    postgres = _dialect(db) == "postgresql"
+
+    if postgres:
+        match_param = q
+        ranked = (
+            "SELECT post_id AS id, -ts_rank_cd(document, query) AS score "
+            "FROM posts_search, websearch_to_tsquery('english', :q) AS query WHERE document @@ query"
+        )
+    else:
+        match_param = _fts5_query(q)
+        if match_param is None:
+            return SearchPage(hits=[], next_cursor=None)
+        # Title matches weigh 10x more than content matches
+        ranked = "SELECT rowid AS id, bm25(posts_fts, 10.0, 1.0) AS score FROM posts_fts WHERE posts_fts MATCH :q"
+
+    sql = f"SELECT id, score FROM ({ranked}) AS matches"
+    params: dict = {"q": match_param, "limit": limit + 1}
+    if after is not None:
+        sql += " WHERE score > :after_score OR (score = :after_score AND id > :after_id)"
+        params.update(after_score=after[0], after_id=after[1])
+    sql += " ORDER BY score, id LIMIT :limit"
+
+    rows = (await db.execute(text(sql), params)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return SearchPage(hits=[], next_cursor=None)
+    ids = [row.id for row in rows]
+
+    # Snippets only for the rows on this page
+    if postgres:
+        snippet_sql = text(
+            "SELECT id, ts_headline('english', content, websearch_to_tsquery('english', :q), :options) AS snippet "
+            "FROM posts WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        snippet_params = {
+            "q": match_param,
+            "ids": ids,
+            "options": f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=10, MaxFragments=2",
+        }
+    else:
+        snippet_sql = text(
+            "SELECT rowid AS id, snippet(posts_fts, 1, :start, :end, '…', 24) AS snippet "
+            "FROM posts_fts WHERE posts_fts MATCH :q AND rowid IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        snippet_params = {"q": match_param, "ids": ids, "start": _MARK_START, "end": _MARK_END}
+    snippets = {row.id: row.snippet for row in (await db.execute(snippet_sql, snippet_params)).all()}
+
+    result = await db.execute(
+        select(models.Post).options(selectinload(models.Post.author), *WITHOUT_BODIES).where(models.Post.id.in_(ids))
+    )
+    posts = {post.id: post for post in result.scalars().all()}
+
+    hits = [
+        SearchHit(post=posts[row.id], rank=row.score, snippet=_render_snippet(snippets.get(row.id) or ""))
+        for row in rows
+        if row.id in posts
+    ]
+    return SearchPage(hits=hits, next_cursor=encode_search_cursor(hits[-1]) if has_more and hits else None)
@@ -0,0 +1,93 @@
+"""
+Production entry point: several uvicorn worker processes sharing one port.
+
+    python -m serve                       # BLOG_WORKERS workers (default 1)
+    python -m serve --workers 0           # one worker per CPU core
+    python -m serve --workers 4 --port 8080
+
+Every worker is a separate process with its own event loop, connection pool and in-memory caches:
+
+- each worker's pool gets its share of the database connections (see config.db_pool_size_per_worker)
+- cache invalidations are passed between the workers (see pubsub.py): over Unix sockets in a
+  directory created here for this run, or over Redis pub/sub with BLOG_CACHE_BACKEND=redis
+- on SIGTERM/SIGINT each worker stops accepting connections and finishes the requests in flight
+  (see drain.py) before closing its pool
+- with --with-jobs, a background job worker (`python -m jobs`, see jobs.py) runs alongside
+  and is stopped with the web workers
+
+Migrations are not run here: apply them with 'alembic upgrade head' before starting the workers.
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import uvicorn
+
+from config import get_settings, worker_count
+
+# Not imported from database.py: this process only supervises the workers, it has no use for an engine
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, 0 = one per CPU core (default: BLOG_WORKERS)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--with-jobs", action="store_true", help="Also run a background job worker")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    if args.workers is not None:
+        settings = settings.model_copy(update={"workers": args.workers})
+    workers = worker_count(settings)
+
+    # The workers read their settings from the environment: they all size their pools for `workers`
+    # processes, and find each other's sockets in the same directory
+    os.environ["BLOG_WORKERS"] = str(workers)
+    # The job worker is one more process whose cache invalidations the web workers must receive
+    processes = workers + (1 if args.with_jobs else 0)
+    if processes > 1 and settings.cache_invalidation_bus == "auto" and settings.cache_backend != "redis":
+        os.environ["BLOG_CACHE_INVALIDATION_BUS"] = "unix"
+    socket_dir = None
+    if processes > 1 and not settings.invalidation_socket_dir:
+        socket_dir = tempfile.mkdtemp(prefix="fastapi_blog-")
+        os.environ["BLOG_INVALIDATION_SOCKET_DIR"] = socket_dir
+
+    # With a single worker, the app is imported into this process: it must see the settings above
+    get_settings.cache_clear()
+
+    job_worker = None
+    if args.with_jobs:
+        job_worker = subprocess.Popen([sys.executable, "-m", "jobs", "--exit-with-parent"], cwd=BASE_DIR)
+
+    # uvicorn re-raises SIGTERM once it has shut down: exit normally then, so the cleanup below runs
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        uvicorn.run(
+            "main:app",
+            app_dir=str(BASE_DIR),
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            log_level=args.log_level,
+            # Closing the connections is bounded like the drain itself, then the lifespan shutdown runs
+            timeout_graceful_shutdown=int(settings.shutdown_drain_timeout_seconds),
+        )
+    finally:
+        if job_worker is not None:
+            job_worker.terminate()
+            job_worker.wait()
+        if socket_dir is not None:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
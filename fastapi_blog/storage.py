@@ -0,0 +1,272 @@
+"""Where the profile picture files live: a local directory, or an S3-compatible bucket.
+
+Both backends store files under keys like "3f/a9/3fa9c1...e2.png" (see media.py for how the keys
+are made and when files are deleted) and give the URL a browser loads them from:
+
+    await media_storage.put(key, path)      # the file at `path`, stored under `key`
+    await media_storage.get(key, path)      # and back to a local file
+    media_storage.url(key)                  # "/media/profile_pics/3f/a9/3fa9c1...e2.png"
+
+BLOG_MEDIA_BACKEND picks one:
+
+- "local": media/profile_pics/ in the project directory, served by the app under /media. Files are
+  written to a temporary name, then renamed, so a reader never sees half a file.
+- "s3": a bucket of AWS S3 or of any S3-compatible server (MinIO, Ceph, R2, ...) set with
+  BLOG_MEDIA_S3_ENDPOINT_URL, needs the `s3` extra (boto3). Credentials come from the usual AWS
+  environment variables or files. The pictures are served by the bucket (or a CDN in front of it,
+  BLOG_MEDIA_PUBLIC_URL), not by the app.
+"""
+
+import mimetypes
+import os
+import shutil
+import tempfile
+from datetime import UTC, datetime
+from pathlib import Path, PurePosixPath
+from typing import Any, NamedTuple
+
+import anyio
+
+from config import Settings, get_settings
+
+# Get the base directory (where main.py is located)
+BASE_DIR = Path(__file__).resolve().parent
+PROFILE_PICS_DIR = BASE_DIR / "media" / "profile_pics"
+
+# A key names one content forever (see media.py), so whoever serves the files may cache them for good
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StoredFile(NamedTuple):
+    key: str
+    size: int
+    modified: datetime
+
+
+class MediaStorage:
+    """A store of files by key. Keys are relative POSIX paths ("3f/a9/3fa9c1...e2.png")."""
+
+    name = "base"
+
+    async def put(self, key: str, source: Path) -> None:
+        """Store the file at `source` under `key`, replacing the file already there."""
+        raise NotImplementedError
+
+    async def get(self, key: str, destination: Path) -> None:
+        """Copy the file stored under `key` to `destination`."""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        """Delete the files stored under `keys`. Missing ones are ignored."""
+        raise NotImplementedError
+
+    async def list_files(self) -> list[StoredFile]:
+        """Every stored file. Meant for maintenance (see media.sweep), not for requests."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        """URL the file is served from."""
+        raise NotImplementedError
+
+
+def check_key(key: str) -> PurePosixPath:
+    """
+    Raises:
+        ValueError: If the key could point outside of the storage (absolute, "..", empty)
+    """
+    path = PurePosixPath(key)
+    if not key or path.is_absolute() or any(part in ("", ".", "..") for part in key.split("/")):
+        raise ValueError(f"Invalid media key: {key!r}")
+    return path
+
+
+# LOCAL DIRECTORY ###################################################
+class LocalStorage(MediaStorage):
+    """
+    Files in a local directory, one per key. The blocking file operations run in worker threads.
+
+    Args:
+        root: The directory
+        base_url: URL the directory is served under
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> Path:
+        return self.root.joinpath(*check_key(key).parts)
+
+    def _put(self, key: str, source: Path) -> None:
+        destination = self.path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # Copied next to the destination, then renamed over it: readers see the old file or the whole new one
+        descriptor, temporary = tempfile.mkstemp(dir=destination.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "wb") as buffer, source.open("rb") as original:
+                shutil.copyfileobj(original, buffer)
+            os.chmod(temporary, 0o644)  # mkstemp creates the file readable by its owner only
+            os.replace(temporary, destination)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+
+    async def put(self, key: str, source: Path) -> None:
+        await anyio.to_thread.run_sync(self._put, key, source)
+
+    async def get(self, key: str, destination: Path) -> None:
+        await anyio.to_thread.run_sync(shutil.copyfile, self.path(key), destination)
+
+    async def exists(self, key: str) -> bool:
+        return await anyio.to_thread.run_sync(self.path(key).is_file)
+
+    def _delete(self, keys: tuple[str, ...]) -> None:
+        for key in keys:
+            path = self.path(key)
+            path.unlink(missing_ok=True)
+            # And the fan-out directories left empty
+            for directory in path.parents:
+                if directory == self.root or not directory.is_relative_to(self.root):
+                    break
+                try:
+                    directory.rmdir()
+                except OSError:
+                    break
+
+    async def delete(self, *keys: str) -> None:
+        await anyio.to_thread.run_sync(self._delete, keys)
+
+    def _list_files(self) -> list[StoredFile]:
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith("."):
+                    # Temporary files of a put() in progress (and .gitkeep and the like)
+                    continue
+                path = Path(directory) / name
+                stat = path.stat()
+                key = path.relative_to(self.root).as_posix()
+                files.append(StoredFile(key, stat.st_size, datetime.fromtimestamp(stat.st_mtime, UTC)))
+        return files
+
+    async def list_files(self) -> list[StoredFile]:
+        return await anyio.to_thread.run_sync(self._list_files)
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+# S3 ###################################################
+def _is_not_found(exc: Exception) -> bool:
+    # botocore's ClientError, without importing botocore
+    error = getattr(exc, "response", {}).get("Error", {})
+    return str(error.get("Code")) in ("404", "NoSuchKey", "NotFound")
+
+
+class S3Storage(MediaStorage):
+    """
+    Files in an S3 (or S3-compatible) bucket, one object per key. boto3 is blocking, its calls run in worker threads.
+
+    Args:
+        client: A boto3 S3 client
+        bucket: The bucket
+        prefix: Prepended to every key (e.g. "profile_pics/")
+        base_url: URL the prefix is served under (the bucket's, or a CDN's)
+    """
+
+    name = "s3"
+
+    def __init__(self, client: Any, bucket: str, prefix: str, base_url: str):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.base_url = base_url.rstrip("/")
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + check_key(key).as_posix()
+
+    def _put(self, key: str, source: Path) -> None:
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        with source.open("rb") as body:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.object_key(key),
+                Body=body,
+                ContentType=content_type,
+                CacheControl=IMMUTABLE_CACHE_CONTROL,
+            )
+
+    async def put(self, key: str, source: Path) -> None:
+        await anyio.to_thread.run_sync(self._put, key, source)
+
+    def _get(self, key: str, destination: Path) -> None:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        with destination.open("wb") as buffer:
+            shutil.copyfileobj(response["Body"], buffer)
+
+    async def get(self, key: str, destination: Path) -> None:
+        await anyio.to_thread.run_sync(self._get, key, destination)
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except Exception as exc:
+            if _is_not_found(exc):
+                return False
+            raise
+        return True
+
+    async def exists(self, key: str) -> bool:
+        return await anyio.to_thread.run_sync(self._exists, key)
+
+    def _delete(self, keys: tuple[str, ...]) -> None:
+        # Up to 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": self.object_key(key)} for key in keys[start : start + 1000]]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+            if response.get("Errors"):
+                raise RuntimeError(f"Could not delete media files: {response['Errors']}")
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await anyio.to_thread.run_sync(self._delete, keys)
+
+    def _list_files(self) -> list[StoredFile]:
+        files = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                files.append(StoredFile(item["Key"][len(self.prefix) :], item["Size"], item["LastModified"]))
+        return files
+
+    async def list_files(self) -> list[StoredFile]:
+        return await anyio.to_thread.run_sync(self._list_files)
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+def build_storage(settings: Settings) -> MediaStorage:
+    if settings.media_backend == "s3":
+        # Optional dependency: pip install 'fastapi-blog[s3]'
+        import boto3
+
+        client = boto3.client("s3", endpoint_url=settings.media_s3_endpoint_url, region_name=settings.media_s3_region)
+        base_url = settings.media_public_url
+        if not base_url:
+            if settings.media_s3_endpoint_url:
+                # Path-style, as S3-compatible servers serve their buckets
+                base_url = f"{settings.media_s3_endpoint_url.rstrip('/')}/{settings.media_s3_bucket}/{settings.media_s3_prefix}"
+            else:
+                base_url = f"https://{settings.media_s3_bucket}.s3.amazonaws.com/{settings.media_s3_prefix}"
+        return S3Storage(client, settings.media_s3_bucket, settings.media_s3_prefix, base_url)
+    # Served by the /media mount of main.py
+    return LocalStorage(PROFILE_PICS_DIR, "/media/profile_pics")
+
+
+media_storage = build_storage(get_settings())
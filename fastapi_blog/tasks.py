@@ -0,0 +1,66 @@
+"""The background jobs of the blog (see jobs.py for the queue and the worker)."""
+
+import tempfile
+from pathlib import Path, PurePosixPath
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import jobs
+import media
+import models.models as models
+from cache import cache, user_tag
+from config import get_settings
+from images import THUMBNAIL_SIZES, UnsupportedImageError, create_thumbnails, thumbnail_filename
+from storage import media_storage
+
+
+# PROFILE THUMBNAILS ###################################################
+async def enqueue_profile_thumbnails(db: AsyncSession, user_id: int, image_file: str) -> int:
+    return await jobs.enqueue(db, "profile_thumbnails", {"user_id": user_id, "image_file": image_file})
+
+
+@jobs.handler("profile_thumbnails")
+async def profile_thumbnails(db: AsyncSession, payload: dict) -> None:
+    """Generate the WebP thumbnails of an uploaded profile picture, then let the pages use them."""
+    key = payload["image_file"]
+    thumbnail_keys = [thumbnail_filename(key, size) for size in THUMBNAIL_SIZES]
+    # Already there when the same picture was uploaded before (or the job is retried after storing them)
+    if not all([await media_storage.exists(thumbnail_key) for thumbnail_key in thumbnail_keys]):
+        if not await media_storage.exists(key):
+            # Replaced and garbage collected before the job ran, nothing to do
+            return
+        with tempfile.TemporaryDirectory() as directory:
+            # Generated from a local copy (the storage may be a bucket), next to it
+            source = Path(directory) / PurePosixPath(key).name
+            await media_storage.get(key, source)
+            try:
+                thumbnails = await create_thumbnails(source)
+            except UnsupportedImageError as exc:
+                # Undecodable image: pages keep showing the original
+                raise jobs.PermanentJobError(str(exc)) from exc
+            for thumbnail_key, thumbnail in zip(thumbnail_keys, thumbnails):
+                await media_storage.put(thumbnail_key, thumbnail)
+
+    # Every user who still has this picture (a newer upload has thumbnails of its own coming)
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.image_file == key, models.User.image_has_thumbnails.is_(False))
+        .values(image_has_thumbnails=True)
+        .returning(models.User.id)
+    )
+    user_ids = result.scalars().all()
+    if user_ids:
+        await db.commit()
+        await cache.invalidate_tags(*(user_tag(user_id) for user_id in user_ids))
+
+
+# MEDIA GARBAGE COLLECTION ###################################################
+async def enqueue_media_gc(db: AsyncSession, key: str) -> int:
+    """Delete a picture that just lost its last reference, once the grace period is over (see media.py)."""
+    return await jobs.enqueue(db, "media_gc", {"key": key}, delay_seconds=get_settings().media_gc_grace_seconds)
+
+
+@jobs.handler("media_gc")
+async def media_gc(db: AsyncSession, payload: dict) -> None:
+    await media.collect(db, media_storage, payload["key"], get_settings().media_gc_grace_seconds)
@@ -0,0 +1,55 @@
+"""Shared setup of the tests: a throwaway primary database and a read replica of it (two SQLite files).
+
+The settings are read when the app modules are imported (engines, caches, storage), so the
+environment is set here, before any test module imports them.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="blog-tests-"))
+PRIMARY_DB = DATA_DIR / "primary.db"
+REPLICA_DB = DATA_DIR / "replica.db"
+
+os.environ["BLOG_DATABASE_URL"] = f"sqlite+aiosqlite:///{PRIMARY_DB}"
+os.environ["BLOG_DATABASE_REPLICA_URLS"] = json.dumps([f"sqlite+aiosqlite:///{REPLICA_DB}"])
+# No warm-up requests at startup, and no template bytecode written next to the code
+os.environ["BLOG_WARMUP_ENABLED"] = "false"
+os.environ["BLOG_TEMPLATE_CACHE_DIR"] = ""
+# The tests send many writes from the same client in a burst
+os.environ["BLOG_RATE_LIMIT_ENABLED"] = "false"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def databases():
+    """Migrate the primary, then copy it to the replica: same schema, and the replica never sees later writes."""
+    from alembic import command
+    from alembic.config import Config
+
+    from database import BASE_DIR
+
+    command.upgrade(Config(str(BASE_DIR / "alembic.ini")), "head")
+    shutil.copyfile(PRIMARY_DB, REPLICA_DB)
+    yield
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client(databases):
+    """
+    A TestClient with the app started (lifespan included).
+
+    One for the whole session: the app runs on a single event loop, as it does under uvicorn,
+    and the tests that send requests concurrently run on that same loop (see client.portal).
+    """
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
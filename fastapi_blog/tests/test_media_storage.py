@@ -0,0 +1,291 @@
+"""Content-addressed profile picture storage: the backends, reference counts and garbage collection (see media.py).
+
+S3 is stood in for by FakeS3Client, the calls of boto3's client that S3Storage makes, on a dict.
+"""
+
+import hashlib
+import io
+import uuid
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+import jobs
+import media
+import models.models as models
+import tasks
+from database import AsyncSessionLocal
+from images import THUMBNAIL_SIZES
+from storage import IMMUTABLE_CACHE_CONTROL, LocalStorage, S3Storage, check_key
+
+
+class ClientError(Exception):
+    """Shaped like botocore's: the error code in `response`."""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects: dict[str, dict] = {}
+        self.delete_requests = 0
+
+    def put_object(self, Bucket: str, Key: str, Body, ContentType: str, CacheControl: str) -> None:
+        self.objects[Key] = {
+            "Body": Body.read(),
+            "ContentType": ContentType,
+            "CacheControl": CacheControl,
+            "LastModified": datetime.now(UTC),
+        }
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        if Key not in self.objects:
+            raise ClientError("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[Key]["Body"])}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        if Key not in self.objects:
+            raise ClientError("404")
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        self.delete_requests += 1
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+        return {}
+
+    def get_paginator(self, operation: str) -> "FakeS3Client":
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket: str, Prefix: str):
+        contents = [
+            {"Key": key, "Size": len(item["Body"]), "LastModified": item["LastModified"]}
+            for key, item in self.objects.items()
+            if key.startswith(Prefix)
+        ]
+        # Two pages, like a real listing would come in
+        yield {"Contents": contents[: len(contents) // 2]}
+        yield {"Contents": contents[len(contents) // 2 :]}
+
+
+@pytest.fixture
+def s3() -> FakeS3Client:
+    return FakeS3Client()
+
+
+@pytest.fixture
+def s3_storage(s3) -> S3Storage:
+    return S3Storage(s3, "blog", "profile_pics/", "https://cdn.example.com/profile_pics")
+
+
+@pytest.fixture
+def run(client):
+    """Run `function(db, *args)` with a session on the primary, on the event loop the app runs on."""
+
+    def runner(function, *args):
+        async def with_session():
+            async with AsyncSessionLocal() as db:
+                return await function(db, *args)
+
+        return client.portal.call(with_session)
+
+    return runner
+
+
+def new_picture(tmp_path: Path) -> tuple[str, Path]:
+    """A picture with content of its own, and its key."""
+    content = uuid.uuid4().bytes * 16
+    source = tmp_path / f"{uuid.uuid4().hex}.png"
+    source.write_bytes(content)
+    return media.content_key(hashlib.sha256(content).hexdigest(), ".png"), source
+
+
+def store_with_thumbnails(client, storage, key: str, source: Path) -> None:
+    for image_key in media.image_keys(key):
+        client.portal.call(storage.put, image_key, source)
+
+
+def stored_keys(client, storage) -> set[str]:
+    return {file.key for file in client.portal.call(storage.list_files)}
+
+
+async def media_row(db, key: str) -> models.MediaFile | None:
+    return (await db.execute(select(models.MediaFile).where(models.MediaFile.key == key))).scalar_one_or_none()
+
+
+async def add_references(db, key: str, count: int) -> None:
+    for _ in range(count):
+        await media.add_reference(db, key, size=256)
+    await db.commit()
+
+
+async def release(db, key: str) -> bool:
+    last = await media.release_reference(db, key)
+    await db.commit()
+    return last
+
+
+# KEYS ###################################################
+def test_content_key_fans_out_on_the_digest():
+    digest = hashlib.sha256(b"picture").hexdigest()
+
+    key = media.content_key(digest, ".png")
+    assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+    assert media.image_keys(key) == [key, *(f"{digest[:2]}/{digest[2:4]}/{digest}_{size}.webp" for size in THUMBNAIL_SIZES)]
+
+
+@pytest.mark.parametrize("key", ["", "/etc/passwd", "../outside.png", "ab/../../outside.png", "ab//cd.png", "ab/./cd.png"])
+def test_keys_cannot_leave_the_storage(key):
+    with pytest.raises(ValueError):
+        check_key(key)
+
+
+# BACKENDS ###################################################
+def test_local_storage(client, tmp_path):
+    storage = LocalStorage(tmp_path / "pictures", "/media/profile_pics")
+    key, source = new_picture(tmp_path)
+
+    client.portal.call(storage.put, key, source)
+    assert client.portal.call(storage.exists, key)
+    assert storage.url(key) == f"/media/profile_pics/{key}"
+    assert (storage.path(key).stat().st_mode & 0o777) == 0o644
+    client.portal.call(storage.get, key, tmp_path / "copy.png")
+    assert (tmp_path / "copy.png").read_bytes() == source.read_bytes()
+    assert stored_keys(client, storage) == {key}
+
+    client.portal.call(storage.delete, key, "ab/cd/missing.png")
+    assert not client.portal.call(storage.exists, key)
+    # The empty fan-out directories go with the file, the root stays
+    assert list((tmp_path / "pictures").iterdir()) == []
+
+
+def test_s3_storage(client, s3, s3_storage, tmp_path):
+    key, source = new_picture(tmp_path)
+
+    assert not client.portal.call(s3_storage.exists, key)
+    client.portal.call(s3_storage.put, key, source)
+    stored = s3.objects[f"profile_pics/{key}"]
+    assert stored["ContentType"] == "image/png"
+    assert stored["CacheControl"] == IMMUTABLE_CACHE_CONTROL
+    assert client.portal.call(s3_storage.exists, key)
+    assert s3_storage.url(key) == f"https://cdn.example.com/profile_pics/{key}"
+    client.portal.call(s3_storage.get, key, tmp_path / "copy.png")
+    assert (tmp_path / "copy.png").read_bytes() == source.read_bytes()
+    assert stored_keys(client, s3_storage) == {key}
+
+    client.portal.call(s3_storage.delete, key)
+    assert s3.objects == {}
+
+
+def test_s3_deletes_in_batches_of_1000(client, s3, s3_storage, tmp_path):
+    _, source = new_picture(tmp_path)
+    keys = [f"aa/bb/{index}.png" for index in range(1500)]
+    for key in keys:
+        s3_storage._put(key, source)
+
+    client.portal.call(s3_storage.delete, *keys)
+    assert s3.objects == {}
+    assert s3.delete_requests == 2
+
+
+# REFERENCE COUNTS ###################################################
+def test_references_are_counted(run, tmp_path):
+    key, _ = new_picture(tmp_path)
+
+    run(add_references, key, 2)
+    assert run(media_row, key).refcount == 2
+    assert run(release, key) is False
+    assert run(media_row, key).orphaned_at is None
+    assert run(release, key) is True
+    row = run(media_row, key)
+    assert (row.refcount, row.orphaned_at is not None) == (0, True)
+    # Never below zero, and only the last release reports it
+    assert run(release, key) is False
+    assert run(media_row, key).refcount == 0
+
+
+def test_orphaned_picture_is_collected_after_the_grace_period(client, run, s3_storage, tmp_path):
+    key, source = new_picture(tmp_path)
+    store_with_thumbnails(client, s3_storage, key, source)
+    run(add_references, key, 1)
+    run(release, key)
+
+    # Still within the grace period: pages cached meanwhile may show it
+    assert run(media.collect, s3_storage, key, 3600) is False
+    assert stored_keys(client, s3_storage) == set(media.image_keys(key))
+
+    assert run(media.collect, s3_storage, key, 0) is True
+    assert stored_keys(client, s3_storage) == set()
+    assert run(media_row, key) is None
+    # Already collected
+    assert run(media.collect, s3_storage, key, 0) is False
+
+
+def test_picture_used_again_within_the_grace_period_is_kept(client, run, s3_storage, tmp_path):
+    key, source = new_picture(tmp_path)
+    store_with_thumbnails(client, s3_storage, key, source)
+    run(add_references, key, 1)
+    run(release, key)
+
+    run(add_references, key, 1)
+    row = run(media_row, key)
+    assert (row.refcount, row.orphaned_at) == (1, None)
+    assert run(media.collect, s3_storage, key, 0) is False
+    assert stored_keys(client, s3_storage) == set(media.image_keys(key))
+
+
+def test_media_gc_job_collects_the_released_picture(client, run, s3_storage, monkeypatch, tmp_path):
+    key, source = new_picture(tmp_path)
+    store_with_thumbnails(client, s3_storage, key, source)
+    monkeypatch.setattr(tasks, "media_storage", s3_storage)
+    monkeypatch.setattr(tasks.get_settings(), "media_gc_grace_seconds", 0)
+    run(add_references, key, 1)
+
+    async def release_and_schedule(db):
+        assert await media.release_reference(db, key)
+        await tasks.enqueue_media_gc(db, key)
+        await db.commit()
+
+    run(release_and_schedule)
+    client.portal.call(jobs.Worker(AsyncSessionLocal, tasks.get_settings()).run_until_empty)
+
+    assert stored_keys(client, s3_storage) == set()
+    assert run(media_row, key) is None
+
+
+def test_sweep_deletes_stray_files_and_lost_orphans(client, run, s3_storage, tmp_path):
+    kept, kept_source = new_picture(tmp_path)
+    orphan, orphan_source = new_picture(tmp_path)
+    store_with_thumbnails(client, s3_storage, kept, kept_source)
+    store_with_thumbnails(client, s3_storage, orphan, orphan_source)
+    # A file stored by an upload that failed before registering it
+    stray, stray_source = new_picture(tmp_path)
+    client.portal.call(s3_storage.put, stray, stray_source)
+    run(add_references, kept, 1)
+    run(add_references, orphan, 1)
+    # Released, but its media_gc job was lost
+    run(release, orphan)
+
+    result = run(media.sweep, s3_storage, 0, True)
+    assert result["stray_files"] == 1 and result["collected"] >= 1
+    assert stored_keys(client, s3_storage) == {*media.image_keys(kept), *media.image_keys(orphan), stray}
+
+    result = run(media.sweep, s3_storage, 0)
+    assert result["stray_files"] == 1
+    assert stored_keys(client, s3_storage) == set(media.image_keys(kept))
+    assert run(media_row, orphan) is None
+    assert run(media_row, kept).refcount == 1
+
+
+def test_sweep_leaves_recent_files_alone(client, run, s3_storage, tmp_path):
+    stray, source = new_picture(tmp_path)
+    client.portal.call(s3_storage.put, stray, source)
+
+    # Maybe an upload in progress, that registers it in a moment
+    assert run(media.sweep, s3_storage, 3600)["stray_files"] == 0
+    assert stored_keys(client, s3_storage) == {stray}
@@ -0,0 +1,123 @@
+"""Read replica routing (see database.get_read_db and ReadYourWritesMiddleware).
+
+The replica is a copy of the primary taken before the tests (see conftest.py) that never receives
+their writes, like a replica lagging far behind: a post written by a test is only found on the primary.
+"""
+
+import sqlite3
+import time
+import uuid
+
+import pytest
+
+import database
+from conftest import REPLICA_DB
+from database import READ_YOUR_WRITES_COOKIE, ReplicaSet, build_engine
+
+
+def write_post(client) -> dict:
+    """A new post, by a new user. Leaves the read-your-writes cookie in the client, like a browser."""
+    user = client.post("/api/users", json={"username": f"writer{uuid.uuid4().hex[:8]}", "email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    assert user.status_code == 201, user.text
+    post = client.post("/api/posts", json={"title": "Fresh post", "content": "Only on the primary.", "user_id": user.json()["id"]})
+    assert post.status_code == 201, post.text
+    return post.json()
+
+
+def read_post(client, post_id: int, primary_until: float | None = None):
+    """GET the post as a client sending no cookie, or a read-your-writes cookie valid until `primary_until`."""
+    client.cookies.clear()
+    headers = {"cookie": f"{READ_YOUR_WRITES_COOKIE}={primary_until:.0f}"} if primary_until is not None else {}
+    return client.get(f"/api/posts/{post_id}", headers=headers)
+
+
+def test_writes_go_to_the_primary_only(client):
+    post = write_post(client)
+
+    with sqlite3.connect(REPLICA_DB) as replica:
+        assert replica.execute("SELECT count(*) FROM posts WHERE id = ?", (post["id"],)).fetchone() == (0,)
+
+
+def test_write_sets_the_read_your_writes_cookie(client):
+    client.cookies.clear()
+    write_post(client)
+
+    primary_until = float(client.cookies[READ_YOUR_WRITES_COOKIE])
+    assert time.time() < primary_until <= time.time() + database.get_settings().read_your_writes_seconds + 1
+
+
+def test_reads_go_to_the_replica(client):
+    post = write_post(client)
+
+    # Not on the replica yet
+    assert read_post(client, post["id"]).status_code == 404
+
+
+def test_a_client_that_just_wrote_reads_from_the_primary(client):
+    post = write_post(client)
+
+    response = read_post(client, post["id"], primary_until=time.time() + 5)
+    assert response.status_code == 200
+    assert response.json()["title"] == "Fresh post"
+
+
+def test_an_expired_cookie_reads_from_the_replica_again(client):
+    post = write_post(client)
+
+    assert read_post(client, post["id"], primary_until=time.time() - 1).status_code == 404
+
+
+def test_a_failed_write_sets_no_cookie(client):
+    client.cookies.clear()
+    response = client.post("/api/posts", json={"title": "Nobody", "content": "By a user who doesn't exist.", "user_id": 999_999})
+
+    assert response.status_code == 404
+    assert READ_YOUR_WRITES_COOKIE not in response.cookies
+
+
+def test_replica_reads_are_not_cached_for_the_other_clients(client):
+    post = write_post(client)
+    primary_until = time.time() + 5
+
+    # A client that didn't write reads the list and the home page from the replica, without the post...
+    client.cookies.clear()
+    assert post["id"] not in [item["id"] for item in client.get("/api/posts").json()["items"]]
+    assert f"/posts/{post['id']}" not in client.get("/").text
+
+    # ...which must not fill the shared caches: the client that wrote still gets the post, read from the primary
+    headers = {"cookie": f"{READ_YOUR_WRITES_COOKIE}={primary_until:.0f}"}
+    assert post["id"] in [item["id"] for item in client.get("/api/posts", headers=headers).json()["items"]]
+    assert f"/posts/{post['id']}" in client.get("/", headers=headers).text
+
+
+def test_reads_fall_back_to_the_primary_when_the_replica_is_down(client, monkeypatch, tmp_path):
+    post = write_post(client)
+    settings = database.get_settings()
+    # A replica that can't be connected to: its directory doesn't exist
+    unreachable = ReplicaSet([build_engine(settings, f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db")], retry_seconds=60)
+    monkeypatch.setattr(database, "replicas", unreachable)
+
+    assert read_post(client, post["id"]).status_code == 200
+    assert unreachable.status()[0]["healthy"] is False
+    # Skipped from now on, without trying it again
+    assert unreachable.pick() is None
+
+
+def test_replica_set_round_robin_skips_the_ones_down(tmp_path):
+    # Engines connect lazily: only the picking is tested
+    settings = database.get_settings()
+    replica_set = ReplicaSet([build_engine(settings, f"sqlite+aiosqlite:///{tmp_path}/{name}.db") for name in "abc"], retry_seconds=60)
+
+    assert [replica_set.pick() for _ in range(4)] == [0, 1, 2, 0]
+    replica_set.mark_down(1, "test")
+    assert [replica_set.pick() for _ in range(4)] == [2, 0, 2, 0]
+    replica_set.mark_down(0, "test")
+    replica_set.mark_down(2, "test")
+    assert replica_set.pick() is None
+
+
+@pytest.fixture(autouse=True)
+def forget_cookies(client):
+    # The client is shared by every test: don't let a write cookie of one test route the reads of the next
+    yield
+    client.cookies.clear()
@@ -0,0 +1,39 @@
+"""The backfill of the write-time rendering (see rendering.backfill)."""
+
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import rendering
+from conftest import PRIMARY_DB
+from database import AsyncSessionLocal
+
+
+def test_backfill_counts_the_posts_it_rendered_and_drops_their_cached_responses(client, monkeypatch):
+    author = client.post("/api/users", json={"username": f"backfill{uuid.uuid4().hex[:8]}", "email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    posts = [
+        client.post("/api/posts", json={"title": f"Old post {index}", "content": "Written before rendering.", "user_id": author.json()["id"]}).json()
+        for index in range(3)
+    ]
+    ids = [post["id"] for post in posts]
+    # Cached (read from the primary: the client just wrote)
+    assert client.get(f"/api/posts/{ids[0]}").json()["excerpt"] == "Written before rendering."
+    with sqlite3.connect(PRIMARY_DB) as db:
+        db.execute(f"UPDATE posts SET render_version = NULL WHERE id IN ({', '.join('?' * len(ids))})", ids)
+
+    def render_many(contents):
+        # The second post is edited while its batch renders: the backfill must leave it alone
+        with sqlite3.connect(PRIMARY_DB) as db:
+            db.execute("UPDATE posts SET updated_at = '2100-01-01 00:00:00.000000' WHERE id = ?", (ids[1],))
+        return [{**rendering.rendered_columns(content), "excerpt": "Rendered again."} for content in contents]
+
+    monkeypatch.setattr(rendering, "render_many", render_many)
+
+    async def run_backfill() -> int:
+        async with AsyncSessionLocal() as db:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                return await rendering.backfill(db, pool, workers=1)
+
+    assert client.portal.call(run_backfill) == 2
+    assert client.get(f"/api/posts/{ids[0]}").json()["excerpt"] == "Rendered again."
+    assert client.get(f"/api/posts/{ids[2]}").json()["excerpt"] == "Rendered again."
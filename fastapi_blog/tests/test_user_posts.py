@@ -0,0 +1,60 @@
+"""GET /api/posts/{user_id}/posts: the posts of one user, cursor paginated like GET /api/posts."""
+
+import uuid
+
+
+def create_user_with_posts(client, count: int) -> tuple[dict, list[int]]:
+    """A new user with `count` posts, and the post ids newest first."""
+    user = client.post("/api/users", json={"username": f"author{uuid.uuid4().hex[:8]}", "email": f"{uuid.uuid4().hex[:8]}@example.com"})
+    assert user.status_code == 201, user.text
+    ids = []
+    for index in range(count):
+        post = client.post("/api/posts", json={"title": f"Post {index}", "content": "One post of a paged list.", "user_id": user.json()["id"]})
+        assert post.status_code == 201, post.text
+        ids.append(post.json()["id"])
+    return user.json(), ids[::-1]
+
+
+def test_pages_through_the_posts_of_a_user(client):
+    user, ids = create_user_with_posts(client, 5)
+    url = f"/api/posts/{user['id']}/posts"
+
+    first = client.get(url, params={"limit": 2}).json()
+    assert [item["id"] for item in first["items"]] == ids[:2]
+    assert first["prev_cursor"] is None and first["next_cursor"] is not None
+
+    second = client.get(url, params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert [item["id"] for item in second["items"]] == ids[2:4]
+    # The links are the same URL with the cursor
+    assert client.get(second["next"]).json()["items"] == client.get(url, params={"limit": 2, "cursor": second["next_cursor"]}).json()["items"]
+
+    last = client.get(url, params={"limit": 2, "cursor": second["next_cursor"]}).json()
+    assert [item["id"] for item in last["items"]] == ids[4:]
+    assert last["next_cursor"] is None and last["next"] is None
+
+    back = client.get(url, params={"limit": 2, "cursor": last["prev_cursor"]}).json()
+    assert [item["id"] for item in back["items"]] == ids[2:4]
+
+
+def test_user_without_posts_and_unknown_user(client):
+    user, _ = create_user_with_posts(client, 0)
+
+    empty = client.get(f"/api/posts/{user['id']}/posts")
+    assert empty.status_code == 200
+    assert empty.json()["items"] == [] and empty.json()["next_cursor"] is None
+    assert client.get("/api/posts/999999/posts").status_code == 404
+
+
+def test_invalid_cursor(client):
+    user, _ = create_user_with_posts(client, 1)
+
+    assert client.get(f"/api/posts/{user['id']}/posts", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_fields_leave_the_other_fields_out(client):
+    user, ids = create_user_with_posts(client, 1)
+
+    items = client.get(f"/api/posts/{user['id']}/posts", params={"fields": "id,title"}).json()["items"]
+    assert items == [{"title": "Post 0", "id": ids[0]}]
+    # So the schema of the items can't require any field
+    assert "required" not in client.get("/openapi.json").json()["components"]["schemas"]["PostListItem"]
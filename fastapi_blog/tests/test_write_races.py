@@ -0,0 +1,138 @@
+"""Writes that rely on the unique and foreign key constraints instead of checking first (see database.constraint_violation).
+
+Concurrent duplicates must end as one success and clean 400s, never as a 500 or a second row.
+"""
+
+import asyncio
+import uuid
+
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+import models.models as models
+from database import AsyncSessionLocal, ConstraintViolation, constraint_violation
+
+
+def unique(prefix: str) -> str:
+    return f"{prefix}{uuid.uuid4().hex[:10]}"
+
+
+def race(client, requests: list[tuple[str, str, dict]]) -> list[httpx.Response]:
+    """Send all the (method, url, json) requests at once, on the event loop the app runs on."""
+
+    async def send_all() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=client.app), base_url="http://testserver") as http:
+            return await asyncio.gather(*(http.request(method, url, json=body) for method, url, body in requests))
+
+    return client.portal.call(send_all)
+
+
+def count(client, *where) -> int:
+    async def run() -> int:
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(select(func.count()).select_from(models.User).where(*where))).scalar_one()
+
+    return client.portal.call(run)
+
+
+def create_user(client) -> dict:
+    response = client.post("/api/users", json={"username": unique("user"), "email": f"{unique('mail')}@example.com"})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def test_concurrent_signups_with_the_same_username(client):
+    username = unique("racer")
+    responses = race(
+        client, [("POST", "/api/users", {"username": username, "email": f"{username}{i}@example.com"}) for i in range(20)]
+    )
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [201] + [400] * 19
+    assert {response.json()["detail"] for response in responses if response.status_code == 400} == {"Username already exists"}
+    assert count(client, models.User.username == username) == 1
+
+
+def test_concurrent_signups_with_the_same_email(client):
+    email = f"{unique('shared')}@example.com"
+    responses = race(client, [("POST", "/api/users", {"username": unique("racer"), "email": email}) for _ in range(10)])
+
+    assert sorted(response.status_code for response in responses) == [201] + [400] * 9
+    assert {response.json()["detail"] for response in responses if response.status_code == 400} == {"Email already exists"}
+    assert count(client, models.User.email == email) == 1
+
+
+def test_concurrent_email_changes_to_the_same_address(client):
+    first, second = create_user(client), create_user(client)
+    email = f"{unique('taken')}@example.com"
+    responses = race(client, [("PATCH", f"/api/users/{user['id']}", {"email": email}) for user in (first, second)])
+
+    assert sorted(response.status_code for response in responses) == [200, 400]
+    assert count(client, models.User.email == email) == 1
+
+
+def test_email_change_to_a_taken_address(client):
+    first, second = create_user(client), create_user(client)
+
+    response = client.patch(f"/api/users/{second['id']}", json={"email": first["email"]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already exists"
+    assert client.get(f"/api/users/{second['id']}").json()["email"] == second["email"]
+
+
+def test_post_by_an_unknown_user_hits_the_foreign_key(client):
+    title = unique("Orphan ")
+    response = client.post("/api/posts", json={"title": title, "content": "Nobody wrote this post.", "user_id": 999_999})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
+
+
+def test_post_written_in_one_round_trip_comes_back_whole(client):
+    author = create_user(client)
+    response = client.post("/api/posts", json={"title": "Returning", "content": "Some **Markdown** content.", "user_id": author["id"]})
+
+    assert response.status_code == 201
+    post = response.json()
+    assert post["author"]["username"] == author["username"]
+    assert post["content"] == "Some **Markdown** content."
+    assert post["content_html"] == "<p>Some <strong>Markdown</strong> content.</p>\n"
+
+
+def test_full_update_of_a_post_tells_the_failures_apart(client):
+    author, other = create_user(client), create_user(client)
+    post = client.post("/api/posts", json={"title": "Mine", "content": "Written by the author.", "user_id": author["id"]}).json()
+    body = {"title": "Taken over", "content": "Rewritten by someone else.", "user_id": other["id"]}
+
+    assert client.put(f"/api/posts/{post['id']}", json=body).status_code == 403
+    assert client.put("/api/posts/999999", json=body).status_code == 404
+    assert client.put(f"/api/posts/{post['id']}", json={**body, "user_id": 999_999}).status_code == 404
+    assert client.get(f"/api/posts/{post['id']}").json()["title"] == "Mine"
+
+
+def integrity_error(orig: Exception) -> IntegrityError:
+    return IntegrityError("INSERT ...", {}, orig)
+
+
+def test_constraint_violation_from_sqlite_messages():
+    assert constraint_violation(integrity_error(Exception("UNIQUE constraint failed: users.username"))) == ConstraintViolation(
+        "unique", "username"
+    )
+    assert constraint_violation(integrity_error(Exception("UNIQUE constraint failed: posts.a, posts.b"))).column == "a"
+    assert constraint_violation(integrity_error(Exception("FOREIGN KEY constraint failed"))).kind == "foreign_key"
+    assert constraint_violation(integrity_error(Exception("NOT NULL constraint failed: posts.title"))).kind == "other"
+
+
+def test_constraint_violation_from_postgres_sqlstates():
+    # The asyncpg adapter's error, with the driver's own exception (and its detail) as the cause
+    unique_error = Exception("duplicate key value violates unique constraint")
+    unique_error.sqlstate = "23505"
+    cause = Exception("duplicate key")
+    cause.detail = "Key (email)=(alice@example.com) already exists."
+    unique_error.__cause__ = cause
+    assert constraint_violation(integrity_error(unique_error)) == ConstraintViolation("unique", "email")
+
+    foreign_key_error = Exception("insert or update violates foreign key constraint")
+    foreign_key_error.sqlstate = "23503"
+    assert constraint_violation(integrity_error(foreign_key_error)).kind == "foreign_key"
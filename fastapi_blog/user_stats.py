@@ -0,0 +1,153 @@
+"""Per-user post counters: the user_stats table (post_count, last_posted_at, total_content_chars).
+
+The post write paths in routers/posts.py call these helpers in the same transaction as the
+change to the post itself, so the counters are committed (or rolled back) together with it:
+
+- record_posts_created: after an INSERT of one or many posts (an upsert per author)
+- record_post_content_changed: *before* an UPDATE that changes a post's content (it reads the old length)
+- record_post_deleted: after a DELETE ... RETURNING of a post
+
+If the table ever drifts (manual SQL, a bug), rebuild it from the posts, a batch of users at a time:
+    python -m user_stats --batch-size 1000
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+from typing import Any, Iterable
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models.models as models
+
+user_stats = models.UserStats.__table__
+
+
+def _upsert(db: AsyncSession):
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(user_stats)
+    new = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[user_stats.c.user_id],
+        set_={
+            "post_count": user_stats.c.post_count + new.post_count,
+            "total_content_chars": user_stats.c.total_content_chars + new.total_content_chars,
+            "last_posted_at": case(
+                (user_stats.c.last_posted_at.is_(None), new.last_posted_at),
+                (new.last_posted_at > user_stats.c.last_posted_at, new.last_posted_at),
+                else_=user_stats.c.last_posted_at,
+            ),
+            # ON CONFLICT DO UPDATE doesn't apply the column's onupdate, the row version is bumped here
+            "updated_at": new.updated_at,
+        },
+    )
+
+
+async def record_posts_created(db: AsyncSession, posts: Iterable[Any]) -> set[int]:
+    """
+    Count newly created posts. One statement, whatever the number of posts and authors.
+
+    Args:
+        posts: Anything with user_id, date_posted and content (Post objects or rows returned by INSERT ... RETURNING)
+
+    Returns:
+        The ids of the authors whose counters changed
+    """
+    totals: dict[int, dict[str, Any]] = defaultdict(lambda: {"post_count": 0, "total_content_chars": 0, "last_posted_at": None})
+    for post in posts:
+        author = totals[post.user_id]
+        author["post_count"] += 1
+        author["total_content_chars"] += len(post.content)
+        if author["last_posted_at"] is None or post.date_posted > author["last_posted_at"]:
+            author["last_posted_at"] = post.date_posted
+    if totals:
+        await db.execute(_upsert(db), [{"user_id": user_id, **values} for user_id, values in totals.items()])
+    return set(totals)
+
+
+async def record_post_content_changed(db: AsyncSession, post_id: int, new_content: str) -> None:
+    """Adjust total_content_chars for a post whose content is about to change. Call BEFORE updating the post."""
+    post = models.Post.__table__
+    old_length = select(func.length(post.c.content)).where(post.c.id == post_id).scalar_subquery()
+    author_id = select(post.c.user_id).where(post.c.id == post_id).scalar_subquery()
+    await db.execute(
+        update(user_stats)
+        .where(user_stats.c.user_id == author_id)
+        .values(total_content_chars=user_stats.c.total_content_chars - old_length + len(new_content))
+    )
+
+
+async def record_post_deleted(db: AsyncSession, user_id: int, date_posted: Any, content_chars: int) -> None:
+    """Uncount a deleted post. Call after the DELETE, with the values it returned."""
+    post = models.Post.__table__
+    # Only when the latest post was deleted does the previous one have to be looked up
+    previous_post_at = select(func.max(post.c.date_posted)).where(post.c.user_id == user_id).scalar_subquery()
+    await db.execute(
+        update(user_stats)
+        .where(user_stats.c.user_id == user_id)
+        .values(
+            post_count=user_stats.c.post_count - 1,
+            total_content_chars=user_stats.c.total_content_chars - content_chars,
+            last_posted_at=case((user_stats.c.last_posted_at == date_posted, previous_post_at), else_=user_stats.c.last_posted_at),
+        )
+    )
+
+
+async def rebuild_user_stats(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Recompute user_stats from the posts table, `batch_size` users per transaction.
+
+    Each batch replaces the rows of a range of user ids with fresh COUNT/MAX/SUM aggregates,
+    so a run over a large table never holds a long transaction.
+
+    Returns:
+        The number of users processed
+    """
+    post = models.Post.__table__
+    processed = 0
+    last_id = 0
+    while True:
+        ids = (
+            await db.execute(select(models.User.id).where(models.User.id > last_id).order_by(models.User.id).limit(batch_size))
+        ).scalars().all()
+        if not ids:
+            return processed
+        first, last_id = ids[0], ids[-1]
+        await db.execute(delete(user_stats).where(user_stats.c.user_id.between(first, last_id)))
+        await db.execute(
+            insert(user_stats).from_select(
+                ["user_id", "post_count", "last_posted_at", "total_content_chars", "updated_at"],
+                select(
+                    post.c.user_id,
+                    func.count(),
+                    func.max(post.c.date_posted),
+                    func.sum(func.length(post.c.content)),
+                    literal(models.utcnow(), user_stats.c.updated_at.type),
+                )
+                .where(post.c.user_id.between(first, last_id))
+                .group_by(post.c.user_id),
+            )
+        )
+        await db.commit()
+        processed += len(ids)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the user_stats table from the posts table.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Users per transaction")
+    args = parser.parse_args()
+
+    from database import AsyncSessionLocal, engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            processed = await rebuild_user_stats(db, args.batch_size)
+        print(f"rebuilt user_stats for {processed} users")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""Worker warm-up and readiness: the work the first requests after a deploy would otherwise pay for.
+
+The lifespan handler runs the warm-up before the worker takes its first request (uvicorn only
+serves once the startup is complete), then marks the worker ready for GET /ready:
+
+- templates: every template compiled up front. The compiled code is kept on disk
+  (BLOG_TEMPLATE_CACHE_DIR, a Jinja bytecode cache shared by the workers and kept across restarts),
+  so a restarted worker loads it instead of compiling the templates again.
+- pool: BLOG_WARMUP_CONNECTIONS connections opened and handed back to the pool (SQLite pragmas
+  applied, Postgres handshakes done), on the primary and on every replica.
+- requests: a GET of each of BLOG_WARMUP_PATHS through the whole app. Fills the fragment cache,
+  SQLAlchemy's compiled statement cache and the database's page cache, and runs every serializer
+  and template once. The cached pages and post lists are kept per host (their links are absolute),
+  so the requests only fill those caches when addressed to the host visitors use,
+  BLOG_WARMUP_BASE_URL (e.g. "https://blog.example.com"). Without it they skip them: entries under
+  a made-up host would never be hit. Either way the rate limits don't count them.
+
+The time spent in each phase is reported by GET /ready. `python -m benchmarks.startup` measures
+the import time, the time until a worker is ready and the latency of its first requests.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+from urllib.parse import urlsplit
+
+from jinja2 import Environment
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Scope
+
+logger = logging.getLogger(__name__)
+
+# Scope state of the warm-up requests: {"warmup": True, "cache_responses": whether they may fill the response caches}
+WARMUP_STATE_KEY = "warmup"
+
+
+class Readiness:
+    """Whether this worker has finished starting, and how long each startup phase took."""
+
+    def __init__(self):
+        self.ready = False
+        self.phases: dict[str, float] = {}  # phase -> seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        logger.info(
+            "Worker ready (%s)", ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        )
+
+    def reset(self) -> None:
+        # On shutdown, and before the app is started again in the same process (e.g. by tests)
+        self.ready = False
+        self.phases = {}
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"ready": self.ready, "startup_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}}
+
+
+readiness = Readiness()
+
+
+def precompile_templates(env: Environment) -> int:
+    """Compile every HTML template into the environment's cache (from the bytecode cache when it has them)."""
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+async def prime_pool(engine: AsyncEngine, connections: int) -> None:
+    """Open `connections` connections and give them back to the pool, ready for the first requests."""
+
+    async def checkout() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # All at once: one after the other, each checkout would get the connection the previous one gave back
+    await asyncio.gather(*(checkout() for _ in range(connections)))
+
+
+def is_warmup(scope: Scope) -> bool:
+    """Whether the request is one of this worker's warm-up requests."""
+    return bool(scope.get("state", {}).get(WARMUP_STATE_KEY))
+
+
+def skips_response_cache(request: Request) -> bool:
+    """Whether the request must neither read nor fill the per-host response caches: a warm-up request to no real host."""
+    state = request.scope.get("state", {})
+    return bool(state.get(WARMUP_STATE_KEY)) and not state.get("cache_responses")
+
+
+async def warm_routes(app: ASGIApp, paths: list[str], base_url: str | None = None) -> None:
+    """
+    GET each path through the app, as a client would. A failing path is logged, it doesn't stop the startup.
+
+    Args:
+        base_url: Scheme and host the requests are addressed to (BLOG_WARMUP_BASE_URL). None: they skip the response caches.
+    """
+    for path in paths:
+        try:
+            status_code = await asgi_get(app, path, base_url)
+        except Exception:
+            logger.exception("Warm-up request GET %s failed", path)
+            continue
+        if status_code >= 400:
+            logger.warning("Warm-up request GET %s answered %d", path, status_code)
+
+
+async def asgi_get(app: ASGIApp, path: str, base_url: str | None = None) -> int:
+    """
+    Send GET `path` (with its query string) straight to the ASGI app, as the server would. Returns the status code.
+
+    No HTTP client: httpx alone would add more to the startup than the requests themselves.
+
+    Args:
+        base_url: Scheme and host the request is addressed to, e.g. "https://blog.example.com" (as if behind
+            the proxy that serves it). None: to "http://localhost", and the request skips the response caches.
+    """
+    path, _, query = path.partition("?")
+    url = urlsplit(base_url or "http://localhost")
+    scheme = url.scheme or "http"
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": scheme,
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", url.netloc.encode()), (b"accept-encoding", b"gzip, br")],
+        # No address: the request comes from this worker, not from a client with a rate limit
+        "client": None,
+        "server": (url.hostname, url.port or (443 if scheme == "https" else 80)),
+        "state": {WARMUP_STATE_KEY: True, "cache_responses": base_url is not None},
+    }
+    status_code = 500
+    request_sent = False
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # A client that stays connected until the response is sent (the app stops listening then)
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await app(scope, receive, send)
+    return status_code